@@ -0,0 +1,136 @@
+"""
+Accidental display for the direct MusicXML writer.
+
+A port of music21's ``Pitch.updateAccidentalDisplay`` as called by ``makeNotation`` with its default settings
+(cautionary accidentals by pitch class and for non-immediate repeats), working on plain step/alter/octave data
+so the direct writer shows exactly the accidentals music21 would.
+"""
+
+
+class SpelledPitch:
+    __slots__ = ('step', 'alter', 'octave', 'has_accidental', 'display')
+
+    def __init__(self, step: str, alter: int, octave: int):
+        self.step = step
+        self.alter = alter
+        self.octave = octave
+        # music21 pitches only carry an Accidental object when altered, until a natural sign is displayed
+        self.has_accidental = alter != 0
+        self.display = None
+
+    def same_name(self, other: 'SpelledPitch') -> bool:
+        return self.step == other.step and self.alter == other.alter
+
+    def same_name_with_octave(self, other: 'SpelledPitch') -> bool:
+        return self.step == other.step and self.alter == other.alter and self.octave == other.octave
+
+    @property
+    def is_natural_sign(self) -> bool:
+        return self.has_accidental and self.alter == 0
+
+    def set_display(self, display: bool):
+        self.has_accidental = True
+        self.display = display
+
+
+def update_accidental_display(p: SpelledPitch, past: list, past_measure: list, key_alters: dict):
+    """
+    Decide whether ``p`` shows an accidental, given the pitches before it in its measure (``past``) and in the
+    previous measure (``past_measure``) and the key signature's alteration of each step.
+    """
+    name_in_key = p.alter != 0 and key_alters[p.step] == p.alter
+    step_in_key = key_alters[p.step] != 0
+    past_all = past_measure + past
+
+    if not past_all:
+        if p.has_accidental:
+            p.display = step_in_key if p.alter == 0 else not name_in_key
+        elif step_in_key:
+            p.set_display(True)
+        return
+
+    for q in reversed(past):
+        if q.step == p.step and q.octave == p.octave:
+            if not q.same_name(p):
+                p.set_display(True)
+                return
+            break
+
+    display_if_no_previous = False
+    set_from_past = False
+    out_of_measure = len(past_measure)
+    # Whether every pitch from past_all[i] on repeats p, kept up to date as i goes back
+    repeats = True
+    for i in range(len(past_all) - 1, -1, -1):
+        q = past_all[i]
+        repeats = repeats and q.same_name_with_octave(p)
+        if i < out_of_measure:
+            in_measure = False
+            continuous_repeats = False
+        else:
+            in_measure = True
+            continuous_repeats = repeats
+
+        if not in_measure and p.has_accidental and not name_in_key:
+            p.display = True
+            return
+        if q.step != p.step:
+            continue
+        octave_match = q.octave == p.octave
+
+        if continuous_repeats and q.has_accidental and q.display is True:
+            if p.has_accidental:
+                p.display = False
+            return
+        elif continuous_repeats and q.has_accidental and p.has_accidental and q.alter == p.alter:
+            if not name_in_key and (not octave_match or q.display is False):
+                display_if_no_previous = True
+                continue
+            p.display = False
+            set_from_past = True
+            break
+        elif q.is_natural_sign and p.alter == 0:
+            if continuous_repeats:
+                if step_in_key and not octave_match:
+                    p.set_display(True)
+                elif p.has_accidental:
+                    p.display = False
+            elif step_in_key:
+                p.set_display(True)
+            elif p.has_accidental:
+                p.display = False
+            set_from_past = True
+            break
+        elif q.has_accidental and q.alter != p.alter and q.alter != 0 and not p.has_accidental:
+            p.set_display(True)
+            set_from_past = True
+            break
+        elif (not q.has_accidental or q.alter == 0) and p.has_accidental and p.alter != 0:
+            p.display = True
+            set_from_past = True
+            break
+        elif q.has_accidental and p.has_accidental and q.alter != p.alter:
+            p.display = True
+            set_from_past = True
+            break
+        elif not q.has_accidental and p.has_accidental:
+            p.display = step_in_key if p.alter == 0 else True
+            set_from_past = True
+            break
+        elif not continuous_repeats and q.has_accidental and p.has_accidental and q.alter == p.alter \
+                and octave_match:
+            if q.display is False:
+                display_if_no_previous = True
+            else:
+                p.display = not name_in_key
+                return
+
+    if display_if_no_previous:
+        if not name_in_key:
+            p.set_display(True)
+        elif p.has_accidental:
+            p.display = False
+    elif not set_from_past and p.has_accidental:
+        p.display = step_in_key if p.alter == 0 else not name_in_key
+    elif not set_from_past and step_in_key:
+        p.set_display(True)
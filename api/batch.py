@@ -0,0 +1,116 @@
+"""
+Parallel rendering of many exercises for the batch endpoint.
+
+Cache hits are served straight from ``api.render_cache`` in the calling process; the rest are rendered in parallel
+by ``api.executor``, whose workers also store them in the render cache. Results are yielded as each render
+completes, not in request order.
+
+A practice set is the same exercises written one after another as a single score, in request order. Each is laid
+out in parallel by the workers and written a measure at a time as the score is streamed.
+"""
+import dataclasses
+import json
+from concurrent.futures import as_completed
+
+from django.conf import settings
+
+from . import jobs, metrics, musicxml_writer, render_cache
+from .executor import ExecutorSaturated, get_executor
+from .notation import UnsupportedScore
+from .specs import ExerciseSpec
+
+
+def parse_specs(items) -> list:
+    """
+    Validate a list of exercise spec objects, as sent to the batch endpoint.
+
+    Raises ValueError naming the first invalid item.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('Expected a non-empty list of exercises')
+    if len(items) > settings.BATCH_MAX_EXERCISES:
+        raise ValueError(f'At most {settings.BATCH_MAX_EXERCISES} exercises can be requested at once')
+
+    specs = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'Exercise {index}: expected an object')
+        try:
+            specs.append(ExerciseSpec.from_query(item))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f'Exercise {index}: {e}')
+    return specs
+
+
+def render_batch(specs: list):
+    """
+    Yield (index, xml or None, error or None) for each spec, in order of completion.
+    """
+    futures = {}
+    try:
+        for index, spec in enumerate(specs):
+            xml = render_cache.load(spec)
+            metrics.EXERCISES.inc(kind=spec.kind, cache='miss' if xml is None else 'hit')
+            if xml is not None:
+                yield index, xml, None
+                continue
+            try:
+                futures[get_executor().submit(jobs.scale, spec, coalesce='scales')] = index
+            except ExecutorSaturated as e:
+                yield index, None, f'{type(e).__name__}: {e}'
+
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, f'{type(e).__name__}: {e}'
+    finally:
+        # The client may have gone away; don't leave the pool busy with renders nobody will read
+        for future in futures:
+            future.cancel()
+
+
+def ndjson_lines(specs: list):
+    for index, xml, error in render_batch(specs):
+        line = {'index': index, 'spec': dataclasses.asdict(specs[index])}
+        if error is None:
+            line['xml'] = xml
+        else:
+            line['error'] = error
+        yield json.dumps(line) + '\n'
+
+
+def submit_practice_set(specs: list) -> list:
+    """
+    Submit the layout of each exercise in a practice set. Raises ExecutorSaturated, having cancelled the jobs
+    already submitted, if they don't all fit in the queue.
+    """
+    futures = []
+    try:
+        for spec in specs:
+            metrics.EXERCISES.inc(kind=spec.kind, cache='worker')
+            futures.append(get_executor().submit(jobs.scale_score, spec, coalesce='practice_set'))
+    except ExecutorSaturated:
+        for future in futures:
+            future.cancel()
+        raise
+    return futures
+
+
+def practice_set_scores(specs: list, futures: list):
+    """
+    Yield the CompactScore of each exercise in a practice set, in order, as its layout completes.
+    """
+    try:
+        for spec, future in zip(specs, futures):
+            score = future.result(settings.RENDER_TIMEOUT)
+            if isinstance(score, str):
+                raise UnsupportedScore(f'{spec} can only be exported by music21, so cannot join a practice set')
+            yield score
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def practice_set_chunks(specs: list, futures: list):
+    return musicxml_writer.iter_chunks(practice_set_scores(specs, futures))
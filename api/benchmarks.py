@@ -0,0 +1,170 @@
+"""
+Benchmarks for exercise generation and rendering, run with ``manage.py benchmark``.
+
+Each benchmark runs a workload a number of times, recording how long each phase takes (construction, beaming,
+fingering, courtesy clefs, then either the direct writer or music21's makeNotation and export), and runs it once
+more under tracemalloc for the peak memory of each phase. Phases are timed by wrapping the methods that implement
+them on the instance being benchmarked, so the code under test is the code that serves requests.
+"""
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .specs import ExerciseSpec
+
+
+class PhaseRecorder:
+    """
+    Collects the duration, and optionally the peak traced memory, of named phases.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.durations = {}
+        self.peaks = {}
+        self._wrapped = []
+
+    @contextmanager
+    def phase(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0) + time.perf_counter() - start
+            if self.trace_memory:
+                self.peaks[name] = max(self.peaks.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+    def wrap(self, obj, method: str, name: str):
+        """
+        Record calls to obj.method as the named phase, until restore() is called.
+        """
+        original = getattr(obj, method)
+        self._wrapped.append((obj, method, vars(obj).get(method)))
+
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return original(*args, **kwargs)
+
+        setattr(obj, method, timed)
+
+    def restore(self):
+        for obj, method, original in reversed(self._wrapped):
+            if original is None:
+                delattr(obj, method)
+            else:
+                setattr(obj, method, original)
+        self._wrapped = []
+
+
+def measure(workload, repeat: int) -> dict:
+    """
+    Run workload(recorder) repeat times for timings, then once under tracemalloc for peak memory.
+
+    Returns the median seconds of each phase and of the whole run, and the peak bytes allocated by each phase and by
+    the whole run.
+    """
+    runs = []
+    for _run in range(repeat):
+        recorder = PhaseRecorder()
+        start = time.perf_counter()
+        try:
+            workload(recorder)
+        finally:
+            recorder.restore()
+        runs.append((time.perf_counter() - start, recorder.durations))
+
+    recorder = PhaseRecorder(trace_memory=True)
+    tracemalloc.start()
+    try:
+        workload(recorder)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        recorder.restore()
+
+    phases = {name: statistics.median(durations.get(name, 0) for _total, durations in runs)
+              for name in runs[0][1]}
+    return {
+        'total': statistics.median(total for total, _durations in runs),
+        'phases': phases,
+        'peak_memory': peak,
+        'phase_peak_memory': recorder.peaks,
+        'runs': repeat,
+    }
+
+
+def exercise_workload(spec: ExerciseSpec, fast: bool):
+    from . import score_templates
+    from .transposition import transposed_exercise
+
+    def workload(recorder: PhaseRecorder):
+        # As served: the canonical exercise is built by the first run and transposed by the rest
+        with recorder.phase('construction'):
+            exercise = transposed_exercise(spec)
+        recorder.wrap(exercise, 'beam_in_groups', 'beaming')
+        recorder.wrap(exercise, 'insert_courtesy_clefs', 'courtesy_clefs')
+        if hasattr(exercise, 'apply_fingering'):
+            recorder.wrap(exercise, 'apply_fingering', 'fingering')
+        if fast:
+            recorder.wrap(exercise, 'compact_score', 'compact_score')
+            # Filled from a template, once the first run has compiled it
+            recorder.wrap(score_templates, 'write', 'xml_export')
+        else:
+            recorder.wrap(exercise, 'materialize', 'materialize')
+            recorder.wrap(exercise, 'make_notation', 'make_notation')
+            recorder.wrap(exercise, 'export', 'xml_export')
+        exercise.render(fast=fast)
+
+    return workload
+
+
+def chord_exercise_workload(tonic: str):
+    from music21 import musicxml
+
+    from .chords import chord_stream
+
+    def workload(recorder: PhaseRecorder):
+        # The chord shapes stay cached between runs, as in a worker that has served requests; the exercise's
+        # own LRU cache is bypassed by building and rendering the stream here
+        with recorder.phase('construction'):
+            s = chord_stream(tonic)
+        with recorder.phase('make_notation'):
+            s.makeNotation(inPlace=True)
+        with recorder.phase('xml_export'):
+            musicxml.m21ToXml.GeneralObjectExporter(s).parse()
+
+    return workload
+
+
+def random_note_workload(client, params: dict):
+    def workload(recorder: PhaseRecorder):
+        with recorder.phase('request'):
+            response = client.get('/api/exercise/', params)
+        assert response.status_code == 200, response.content
+
+    return workload
+
+
+def random_note_job_workload(bucket: tuple):
+    from . import jobs
+
+    def workload(recorder: PhaseRecorder):
+        with recorder.phase('render'):
+            jobs.random_note(bucket)
+
+    return workload
+
+
+def grand_staff_workload():
+    from music21 import key
+
+    from .utilities import create_grand_staff
+
+    def workload(recorder: PhaseRecorder):
+        with recorder.phase('construction'):
+            create_grand_staff(key.KeySignature(0))
+
+    return workload
@@ -0,0 +1,173 @@
+"""
+Practice books: every exercise a syllabus lists, rendered offline in parallel and written out as one score or as a
+directory of .mxl files, by ``manage.py build_exercise_book``.
+
+A syllabus is a JSON file, or with the optional ``PyYAML`` package a YAML file, listing groups of exercises::
+
+    exercises:
+      - kind: scale
+        tonic: [C, G, D]
+        quality: [major, harmonic]
+        octaves: 2
+      - kind: arpeggio
+        tonic: all
+        quality: dominant
+        style: Cooke
+      - kind: chords
+        tonic: [C, F]
+
+Each field is a value or a list of values, and a group stands for every combination of them; ``tonic: all`` is
+every tonic the quality has. ``style`` and ``octaves`` default as they do for /api/scale/. Chord groups are the
+common-tone chord series of major keys.
+
+Exercises are rendered by a pool of worker processes, and each is saved as soon as it is done, so an interrupted
+book carries on where it stopped: a directory of .mxl files skips the files already written, and a merged score
+keeps the layout of each finished exercise in a parts directory next to it until the score is written.
+"""
+import json
+import os
+import pickle
+from dataclasses import dataclass
+from itertools import product
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from .notation import UnsupportedScore
+from .render_cache import RENDER_VERSION
+from .specs import MAJOR_TONICS, TONICS_BY_QUALITY, ExerciseSpec, normalize_tonic
+
+
+@dataclass(frozen=True)
+class ChordSeries:
+    """
+    The common-tone chord exercise of a major key.
+    """
+    tonic: str
+    kind: str = 'chords'
+
+    def __str__(self):
+        return f'{self.tonic} major chords'
+
+
+def as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def load_syllabus(path: str) -> list:
+    """
+    The exercises a syllabus file lists, in order, each once.
+
+    Raises ValueError if the file can't be read as a syllabus, naming the first invalid group.
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError('Reading a YAML syllabus needs the PyYAML package; use JSON instead')
+            syllabus = yaml.safe_load(f)
+        else:
+            syllabus = json.load(f)
+    groups = syllabus.get('exercises') if isinstance(syllabus, dict) else syllabus
+    if not isinstance(groups, list) or not groups:
+        raise ValueError('Expected a non-empty list of exercises')
+
+    items = {}
+    for index, group in enumerate(groups):
+        try:
+            for item in expand_group(group):
+                items.setdefault(item, None)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f'Exercise group {index}: {e}')
+    return list(items)
+
+
+def expand_group(group: dict):
+    """
+    Yield the ExerciseSpec or ChordSeries of every combination in a syllabus group.
+    """
+    kind = group.get('kind', 'scale')
+    if kind == 'chords':
+        tonics = as_list(group.get('tonic', 'all'))
+        for tonic in MAJOR_TONICS if tonics == ['all'] else tonics:
+            tonic = normalize_tonic(tonic)
+            if tonic not in MAJOR_TONICS:
+                raise ValueError(f'No chord series for {tonic!r}')
+            yield ChordSeries(tonic)
+        return
+
+    if 'quality' not in group:
+        raise ValueError('Missing quality')
+    tonics = as_list(group.get('tonic', 'all'))
+    for quality, style, octaves in product(as_list(group['quality']), as_list(group.get('style', 'ABRSM')),
+                                           as_list(group.get('octaves', 2))):
+        if quality not in TONICS_BY_QUALITY:
+            raise ValueError(f'Invalid quality: {quality!r}')
+        for tonic in TONICS_BY_QUALITY[quality] if tonics == ['all'] else tonics:
+            yield ExerciseSpec(kind, tonic, quality, style, octaves)
+
+
+def item_name(item) -> str:
+    """
+    The file name an exercise is saved under, without an extension, e.g. 'scale-Ab-melodic-ABRSM-2'.
+    """
+    if isinstance(item, ChordSeries):
+        return f'chords-{item.tonic}'
+    return f'{item.kind}-{item.tonic}-{item.quality}-{item.style}-{item.octaves}'
+
+
+def mxl_path(directory: str, item) -> str:
+    return os.path.join(directory, item_name(item) + '.mxl')
+
+
+def part_path(directory: str, item) -> str:
+    # Parts laid out by other versions of the exercise code are never reused
+    return os.path.join(directory, f'{item_name(item)}.v{RENDER_VERSION}.pickle')
+
+
+def parts_dir(output: str) -> str:
+    return output + '.parts'
+
+
+def write_atomically(path: str, data: bytes):
+    """
+    Write a file whole or not at all, so an interrupted book never leaves a partial file to be mistaken for a
+    finished one.
+    """
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+def render_mxl(item) -> bytes:
+    """
+    Render an exercise as a .mxl file, in a worker process.
+    """
+    from .chords import chord_exercise
+    from .payloads import mxl
+    from .render_cache import render
+
+    return mxl(chord_exercise(item.tonic) if isinstance(item, ChordSeries) else render(item))
+
+
+def lay_out(item) -> bytes:
+    """
+    Lay out an exercise to be written into a merged score, in a worker process: its pickled CompactScore.
+    """
+    from .transposition import transposed_exercise
+
+    if isinstance(item, ChordSeries):
+        raise UnsupportedScore(f'{item} can only be exported by music21, so cannot join a merged score')
+    exercise = transposed_exercise(item)
+    exercise.lay_out()
+    score = exercise.writable_score()
+    if score is None:
+        raise UnsupportedScore(f'{item} can only be exported by music21, so cannot join a merged score')
+    return pickle.dumps(score, pickle.HIGHEST_PROTOCOL)
+
+
+def load_part(directory: str, item):
+    with open(part_path(directory, item), 'rb') as f:
+        return pickle.load(f)
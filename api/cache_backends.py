@@ -0,0 +1,256 @@
+"""
+Django cache backends shared by every server and worker process, for rendered exercises (see ``api.render_cache``).
+
+``SQLiteCache`` keeps entries in one SQLite database on local disk, and evicts the least recently used entries once
+they take up more than ``OPTIONS['MAX_SIZE']`` bytes. So that reads don't each take the database's write lock, a hit
+only records its access time once the last one recorded is ``OPTIONS['ACCESS_INTERVAL']`` seconds old, which makes
+the order of eviction approximate to within that. ``RESPCache`` talks the Redis protocol to Redis or a
+compatible server, with no client library needed; there eviction is the server's, e.g. ``maxmemory`` with the
+``allkeys-lru`` policy. Both survive restarts and serve every process on the host (or, with a Redis server, every
+host).
+
+Configured in ``CACHES`` like Django's own backends::
+
+    'renders': {
+        'BACKEND': 'api.cache_backends.SQLiteCache',
+        'LOCATION': '/var/cache/conbrio/renders.sqlite3',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_SIZE': 512 * 1024 * 1024, 'ACCESS_INTERVAL': 60},
+    }
+"""
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location: str, params: dict):
+        super().__init__(params)
+        self.location = location
+        options = params.get('OPTIONS', {})
+        self.max_size = int(options.get('MAX_SIZE', 256 * 1024 * 1024))
+        self.access_interval = float(options.get('ACCESS_INTERVAL', 60))
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, and a new one in a forked process
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        os.makedirs(os.path.dirname(os.path.abspath(self.location)), exist_ok=True)
+        connection = sqlite3.connect(self.location, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                           'expires REAL, accessed REAL NOT NULL, size INTEGER NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        row = connection.execute('SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        value, expires, accessed = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now))
+            return default
+        if now - accessed >= self.access_interval:
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value)
+
+    def _store(self, key: str, value, timeout, only_if_missing: bool) -> bool:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if only_if_missing:
+                row = connection.execute('SELECT expires FROM cache WHERE key = ?', (key,)).fetchone()
+                if row is not None and (row[0] is None or row[0] > now):
+                    connection.execute('COMMIT')
+                    return False
+            expires = self.get_backend_timeout(timeout)
+            connection.execute('INSERT OR REPLACE INTO cache (key, value, expires, accessed, size) '
+                               'VALUES (?, ?, ?, ?, ?)', (key, data, expires, now, len(data)))
+            self._evict(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return True
+
+    def _evict(self, connection: sqlite3.Connection):
+        """
+        Delete the least recently used entries until the cache fits in max_size.
+        """
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total <= self.max_size:
+            return
+        connection.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        rows = connection.execute('SELECT key, size FROM cache ORDER BY accessed').fetchall()
+        total = sum(size for _key, size in rows)
+        evicted = []
+        for key, size in rows[:-1]:  # Never the entry just stored
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany('DELETE FROM cache WHERE key = ?', evicted)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(self.make_and_validate_key(key, version=version), value, timeout, only_if_missing=False)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        return self._store(self.make_and_validate_key(key, version=version), value, timeout, only_if_missing=True)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('UPDATE cache SET expires = ? WHERE key = ? AND '
+                                            '(expires IS NULL OR expires > ?)',
+                                            (self.get_backend_timeout(timeout), key, time.time()))
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        return self._connection().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def has_key(self, key, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute('SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                         (key, time.time())).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def size(self) -> int:
+        """
+        The bytes taken up by cached values.
+        """
+        return self._connection().execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def close(self, **kwargs):
+        # Connections are kept for the life of the thread, like the cache instance Django gives each thread
+        pass
+
+
+class RESPError(Exception):
+    """
+    An error reply from the server.
+    """
+
+
+class RESPCache(BaseCache):
+    """
+    LOCATION is a URL such as redis://localhost:6379/0. Values are pickled, as by Django's Redis backend.
+    """
+
+    def __init__(self, location: str, params: dict):
+        super().__init__(params)
+        url = urlparse(location if '://' in location else f'redis://{location}')
+        self.host = url.hostname or 'localhost'
+        self.port = url.port or 6379
+        self.db = int(url.path.strip('/') or 0)
+        self.password = url.password
+        self.socket_timeout = float(params.get('OPTIONS', {}).get('SOCKET_TIMEOUT', 5))
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout)
+        self._local.socket, self._local.file, self._local.pid = sock, sock.makefile('rb'), os.getpid()
+        if self.password:
+            self._command('AUTH', self.password)
+        if self.db:
+            self._command('SELECT', self.db)
+
+    def _send(self, *args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f'${len(data)}\r\n'.encode() + data + b'\r\n')
+        self._local.socket.sendall(b''.join(parts))
+
+    def _reply(self):
+        line = self._local.file.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RESPError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._local.file.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._reply() for _item in range(length)]
+        raise RESPError(f'Unexpected reply {line!r}')
+
+    def _command(self, *args):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._connect()
+        try:
+            self._send(*args)
+            return self._reply()
+        except (OSError, ConnectionError):
+            # Reconnect once, e.g. after the server restarted
+            self._connect()
+            self._send(*args)
+            return self._reply()
+
+    def _milliseconds(self, timeout) -> int or None:
+        expires = self.get_backend_timeout(timeout)
+        return None if expires is None else int((expires - time.time()) * 1000)
+
+    def get(self, key, default=None, version=None):
+        value = self._command('GET', self.make_and_validate_key(key, version=version))
+        return default if value is None else pickle.loads(value)
+
+    def _store(self, key: str, value, timeout, *options) -> bool:
+        milliseconds = self._milliseconds(timeout)
+        if milliseconds is not None and milliseconds <= 0:
+            # Already expired
+            self._command('DEL', key)
+            return False
+        expiry = () if milliseconds is None else ('PX', milliseconds)
+        return self._command('SET', key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), *expiry, *options) == 'OK'
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(self.make_and_validate_key(key, version=version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        return self._store(self.make_and_validate_key(key, version=version), value, timeout, 'NX')
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        milliseconds = self._milliseconds(timeout)
+        if milliseconds is None:
+            return bool(self._command('PERSIST', key)) or bool(self._command('EXISTS', key))
+        return bool(self._command('PEXPIRE', key, max(1, milliseconds)))
+
+    def delete(self, key, version=None) -> bool:
+        return bool(self._command('DEL', self.make_and_validate_key(key, version=version)))
+
+    def has_key(self, key, version=None) -> bool:
+        return bool(self._command('EXISTS', self.make_and_validate_key(key, version=version)))
+
+    def clear(self):
+        self._command('FLUSHDB')
+
+    def close(self, **kwargs):
+        pass
@@ -0,0 +1,186 @@
+"""
+Rachmaninoff common-tone chord exercises.
+
+An exercise is twelve chord shapes built over the same common tone, each played up through its inversions and back
+down, and preceded by the key it belongs to. A shape's inversions and key don't depend on the tonic, so they are
+worked out once per shape on C4 (``shape_on_c``) and moved to the requested tonic by transposing note records.
+Both those and the finished exercises are kept in LRU caches shared by every request a process serves.
+"""
+from functools import lru_cache
+
+from .fingering import ChordFingering
+from .metrics import span
+from .notation import STEPS, NoteRecord
+from .specs import MAJOR_TONICS, normalize_tonic
+from .theory import INTERVALS, key_for, split_tonic
+
+# Intervals above the common tone, triads then four-note chords
+COMMON_TONE_TRIADS = (
+    ('M3', 'p5'),
+    ('m3', 'p5'),
+    ('m3', 'm6'),
+    ('M3', 'm6'),
+    ('M3', 'M6'),
+    ('p4', 'M6'),
+    ('p4', 'm6'),
+)
+COMMON_TONE_SEVENTHS = (
+    ('M3', 'p5', 'm7'),
+    ('m3', 'd5', 'm6'),
+    ('m3', 'p4', 'M6'),
+    ('M2', 'a4', 'M6'),
+    ('a2', 'a4', 'M6'),
+)
+
+MIDDLE_C = NoteRecord('C', 0, 4, 1)
+
+
+def spelling(n: NoteRecord) -> tuple:
+    return n.step, n.alter, n.octave
+
+
+@lru_cache(maxsize=None)
+def shape_on_c(intervals: tuple) -> tuple:
+    """
+    The inversion series and key of a chord shape built on C4.
+
+    Returns (series, key tonic, key mode), where series is a tuple of chords, each a tuple of (step, alter, octave)
+    from the bottom up: the chord, each inversion up to the next octave, and back down again.
+    """
+    from music21 import chord, key, pitch
+
+    notes = [MIDDLE_C] + [MIDDLE_C.transposed(*INTERVALS[i]) for i in intervals]
+    series = [tuple(notes)]
+    octave_up = INTERVALS['p8']
+    for inversion in range(len(notes)):
+        notes = sorted(notes[1:] + [notes[0].transposed(*octave_up)], key=lambda n: n.midi)
+        series.append(tuple(notes))
+    for inversion in range(len(notes)):
+        notes = sorted(notes[:-1] + [notes[-1].transposed(-octave_up[0], -octave_up[1])], key=lambda n: n.midi)
+        series.append(tuple(notes))
+
+    c = chord.Chord([pitch.Pitch(n.name_with_octave) for n in series[0]])
+    quality = c.quality
+    if quality == 'augmented':
+        _key = key.Key(c.root().name, 'major')
+    elif quality == 'diminished':
+        _key = key.Key(c.sortAscending()[0].transpose('p5').name, 'major')
+    elif c.seventh is not None:
+        # Dominant
+        _key = key.Key(c.root().transpose('p4'), 'major')
+    else:
+        _key = key.Key(c.root().name, quality)
+    tonic = NoteRecord(_key.tonic.step, int(_key.tonic.alter), 4, 1)
+
+    return tuple(tuple(spelling(n) for n in c) for c in series), spelling(tonic), _key.mode
+
+
+def common_tone(tonic: str) -> NoteRecord:
+    """
+    The common tone for an exercise in the given key: the tonic, an octave lower for A, B and Bb.
+    """
+    tonic = normalize_tonic(tonic)
+    if tonic not in MAJOR_TONICS:
+        raise ValueError(f'No chord series for {tonic!r}')
+    step, alter = split_tonic(tonic)
+    return NoteRecord(step, alter, 3 if tonic in ('A', 'B', 'Bb') else 4, 1)
+
+
+@lru_cache(maxsize=256)
+def shape_on(root: tuple, intervals: tuple) -> tuple:
+    """
+    A chord shape's inversion series and key, as from shape_on_c, built on another root (step, alter, octave).
+    """
+    root = NoteRecord(*root, 1)
+    steps = root.octave * 7 + STEPS.index(root.step) - 4 * 7
+    semitones = root.midi - MIDDLE_C.midi
+
+    def move(n: tuple) -> tuple:
+        return spelling(NoteRecord(*n, 1).transposed(steps, semitones))
+
+    series, key_tonic, mode = shape_on_c(intervals)
+    return tuple(tuple(move(n) for n in c) for c in series), move(key_tonic)[:2], mode
+
+
+def exercise_shapes(tonic: str) -> list:
+    """
+    The (series, key tonic, key mode) of each chord in the exercise for the given key.
+    """
+    root = common_tone(tonic)
+    shapes = [shape_on(spelling(root), intervals) for intervals in COMMON_TONE_TRIADS]
+
+    # If G or Ab, transpose down an octave for 7th chord series
+    if (root.step, root.alter) in (('G', 0), ('A', -1)):
+        root = root.transposed(*INTERVALS['-p8'])
+    shapes += [shape_on(spelling(root), intervals) for intervals in COMMON_TONE_SEVENTHS]
+    return shapes
+
+
+def fingerings(notes: tuple) -> list:
+    from music21 import articulations
+
+    lh_fingers, rh_fingers = ChordFingering.for_chord(notes)
+    lh_fingering = [articulations.Fingering(finger) for finger in lh_fingers]
+    rh_fingering = [articulations.Fingering(finger) for finger in rh_fingers]
+
+    fingering = lh_fingering
+    fingering.extend(rh_fingering)
+
+    for finger in lh_fingering:
+        finger.placement = 'below'
+        finger.alternate = True
+
+    for finger in rh_fingering:
+        finger.placement = 'above'
+        finger.substitution = True
+    return fingering
+
+
+def chord_stream(tonic: str):
+    """
+    Build the common-tone chord exercise for a major key, e.g. 'Ab', as a music21 stream without notation made.
+    """
+    from music21 import chord, clef, duration, key, layout, pitch, stream
+
+    def to_pitch(n: tuple) -> pitch.Pitch:
+        step, alter, octave = n
+        p = pitch.Pitch(step, octave=octave)
+        if alter:
+            p.accidental = pitch.Accidental(alter)
+        return p
+
+    s = stream.Stream()
+    s.insert(0, clef.TrebleClef())
+    s.insert(0, key.KeySignature(key_for(tonic, 'major').sharps))
+
+    for series, (key_step, key_alter), mode in exercise_shapes(tonic):
+        s.append(key.Key(to_pitch((key_step, key_alter, 4)).name, mode))
+        chords = []
+        for notes in series:
+            c = chord.Chord([to_pitch(n) for n in notes])
+            c.duration = duration.Duration(2)
+            c.articulations.extend(fingerings(notes))
+            chords.append(c)
+        chords[-1].duration = duration.Duration(4)
+        s.append(chords)
+        s.append(layout.SystemLayout(isNew=True))
+
+    s.definesExplicitSystemBreaks = True
+    return s
+
+
+@lru_cache(maxsize=32)
+def chord_exercise(tonic: str) -> str:
+    """
+    Render the common-tone chord exercise for a major key, e.g. 'Ab', to MusicXML.
+    """
+    from music21 import musicxml
+
+    with span('construction'):
+        s = chord_stream(tonic)
+    with span('make_notation'):
+        s.makeNotation(inPlace=True)
+
+    with span('xml_export'):
+        parser = musicxml.m21ToXml.GeneralObjectExporter(s)
+        return parser.parse().decode('utf-8')
@@ -0,0 +1,96 @@
+"""
+Single-flight coalescing of identical renders.
+
+When a class opens the same exercise at once, only the first request submits a render job; the others wait for the
+same job while it is in flight, rather than each rendering it again. A job is identified by its function and
+arguments, so requests to different endpoints that submit the same job (such as /api/scale/ and the batch endpoint
+rendering the same spec) share it too.
+
+Endpoints opt in by name with the ``COALESCE_ENDPOINTS`` setting. Each waiter gets its own future; cancelling it,
+e.g. when its request times out, cancels the job only if nobody else is waiting for it.
+"""
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+from django.conf import settings
+
+from . import metrics
+
+COALESCED = metrics.Counter('conbrio_coalesced_renders_total',
+                            'Requests that waited for a render already in flight instead of starting a duplicate',
+                            ('endpoint',))
+
+_flights = {}  # Job key -> [job future, number of waiters]
+_lock = threading.RLock()
+
+
+def job_key(fn, args: tuple) -> tuple:
+    return fn.__module__, fn.__qualname__, args
+
+
+def enabled(endpoint: str) -> bool:
+    return endpoint in settings.COALESCE_ENDPOINTS
+
+
+def in_flight() -> int:
+    with _lock:
+        return len(_flights)
+
+
+def _land(key: tuple, job: Future):
+    with _lock:
+        flight = _flights.get(key)
+        if flight is not None and flight[0] is job:
+            del _flights[key]
+
+
+def submit(endpoint: str, key: tuple, submit_job) -> Future:
+    """
+    A future for the result of the job for key: the one in flight if there is one, otherwise a new one from
+    submit_job(), which returns its future. Errors raised by submit_job, such as ExecutorSaturated, are passed on.
+
+    Parameters:
+        endpoint (str): The endpoint waiting for the job, for metrics.
+        key (tuple): What identifies the job, see job_key.
+        submit_job: Submits the job.
+    """
+    with _lock:
+        flight = _flights.get(key)
+        if flight is None:
+            job = submit_job()
+            flight = _flights[key] = [job, 0]
+            job.add_done_callback(lambda done: _land(key, done))
+        else:
+            COALESCED.inc(endpoint=endpoint)
+        flight[1] += 1
+        job = flight[0]
+
+    waiter = Future()
+
+    def job_done(job: Future):
+        try:
+            if job.cancelled():
+                waiter.cancel()
+            elif job.exception() is not None:
+                waiter.set_exception(job.exception())
+            else:
+                waiter.spans = getattr(job, 'spans', [])
+                waiter.set_result(job.result())
+        except InvalidStateError:
+            pass  # The waiter was cancelled in the meantime
+
+    def waiter_done(waiter: Future):
+        if not waiter.cancelled():
+            return
+        with _lock:
+            flight[1] -= 1
+            abandoned = flight[1] == 0
+        if abandoned:
+            job.cancel()
+
+    waiter.add_done_callback(waiter_done)
+    job.add_done_callback(job_done)
+    return waiter
+
+
+metrics.Gauge('conbrio_renders_in_flight', 'Distinct render jobs that requests can coalesce onto', in_flight)
@@ -0,0 +1,209 @@
+"""
+Process pool for rendering, so music21 work runs outside the request threads.
+
+``get_executor()`` returns the process's ``RenderExecutor``, created on first use (after any fork, so each server
+worker gets its own). Its worker processes import and warm up music21 as they start. Jobs are top-level functions
+(see ``api.jobs``) submitted with ``submit``, or awaited from async views with ``run``. The ``api.metrics`` spans a
+job records are sent back with its result and recorded here. Jobs submitted on behalf of an endpoint can share an
+identical job already in flight (see ``api.coalescing``).
+
+Settings:
+    RENDER_WORKERS: Number of worker processes, 0 for one per CPU shared between the WEB_CONCURRENCY server
+        processes on the host.
+    RENDER_TIMEOUT: Seconds ``run`` waits for a job before raising ``RenderTimeout``.
+    RENDER_QUEUE_DEPTH: Jobs that may be queued or running at once before ``submit`` raises ``ExecutorSaturated``.
+"""
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import coalescing, metrics
+
+
+class ExecutorSaturated(Exception):
+    """
+    Raised when the render queue is full; the client should retry later.
+    """
+
+
+class RenderTimeout(Exception):
+    """
+    Raised when a render takes longer than the executor's timeout.
+    """
+
+
+def default_workers() -> int:
+    """
+    The host's CPUs divided between its server processes, each of which has its own executor; at least one.
+    """
+    return max(1, (os.cpu_count() or 1) // settings.WEB_CONCURRENCY)
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+    from .warmup import warm_music21
+    warm_music21()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _instrumented(fn, *args) -> tuple:
+    with metrics.collect(observe=False) as timings:
+        result = fn(*args)
+    return result, timings.spans
+
+
+def _chain(job: Future) -> Future:
+    """
+    A future for the result of an _instrumented job, recording its spans when it finishes. Cancelling it cancels
+    the job.
+    """
+    future = Future()
+
+    def job_done(job: Future):
+        if job.cancelled():
+            future.cancel()
+            return
+        try:
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+                return
+            result, future.spans = job.result()
+            metrics.record_remote_spans(future.spans)
+            future.set_result(result)
+        except InvalidStateError:
+            pass  # Cancelled in the meantime
+
+    def cancelled(future: Future):
+        if future.cancelled():
+            job.cancel()
+
+    future.add_done_callback(cancelled)
+    job.add_done_callback(job_done)
+    return future
+
+
+class RenderExecutor:
+    def __init__(self, workers: int or None = None, timeout: float or None = None, queue_depth: int or None = None):
+        self.workers = workers or settings.RENDER_WORKERS or default_workers()
+        self.timeout = timeout or settings.RENDER_TIMEOUT
+        self.queue_depth = queue_depth if queue_depth is not None else settings.RENDER_QUEUE_DEPTH
+        self.pending = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        # Start every worker now, so music21 is imported before the first render arrives
+        for _worker in range(self.workers):
+            pool.submit(_ping)
+        return pool
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """
+        Replace a broken pool, unless a concurrent job already has, and return the current pool.
+        """
+        with self._lock:
+            if self._pool is broken:
+                self._pool = self._new_pool()
+                broken.shutdown(wait=False)
+            return self._pool
+
+    def _release(self, _future: Future):
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args, coalesce: str or None = None) -> Future:
+        """
+        Submit a job, or if coalesce names an endpoint with coalescing enabled, join an identical one in flight.
+
+        Raises ExecutorSaturated if the queue is full.
+        """
+        if coalesce is not None and coalescing.enabled(coalesce):
+            return coalescing.submit(coalesce, coalescing.job_key(fn, args), lambda: self.submit(fn, *args))
+
+        with self._lock:
+            if self.closed:
+                raise ExecutorSaturated('The render executor is shutting down')
+            if self.pending >= self.queue_depth:
+                raise ExecutorSaturated(f'{self.pending} renders are already queued')
+            self.pending += 1
+
+        try:
+            pool = self._pool
+            try:
+                job = pool.submit(_instrumented, fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); replace the pool rather than failing every later job
+                job = self._replace_pool(pool).submit(_instrumented, fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # The job holds its place in the queue until it has finished, even if its future is cancelled
+        job.add_done_callback(self._release)
+        return _chain(job)
+
+    async def run(self, fn, *args, timeout: float or None = None, coalesce: str or None = None):
+        """
+        Submit a job and wait for its result without blocking the event loop.
+
+        Raises ExecutorSaturated if the queue is full, or RenderTimeout if the job takes longer than the timeout.
+        A timed-out job is cancelled if it hasn't started (and no coalesced request is waiting for it); one that has
+        still counts towards the queue depth until it finishes.
+        """
+        future = self.submit(fn, *args, coalesce=coalesce)
+        try:
+            with metrics.span('render'):
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout(f'Render took longer than {timeout or self.timeout} seconds')
+        metrics.add_to_timings(future.spans)
+        return result
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop accepting jobs, cancel queued ones and, if wait, let running ones finish.
+        """
+        with self._lock:
+            self.closed = True
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> RenderExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = RenderExecutor()
+        return _executor
+
+
+def shutdown(wait: bool = True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait)
+            _executor = None
+
+
+def _pending():
+    executor = _executor
+    return executor.pending if executor is not None else None
+
+
+metrics.Gauge('conbrio_render_jobs_pending', 'Render jobs queued or running', _pending)
+
+atexit.register(shutdown)
@@ -1,123 +1,243 @@
-from copy import deepcopy
+import logging
+from copy import copy
+from fractions import Fraction
+
+from music21 import key, meter, duration, pitch, note, clef, musicxml, stream, articulations, tempo
+
+from api import musicxml_writer, score_templates
+from api.fingering import ArpeggioFingering, ScaleFingering
+from api.layout import ARPEGGIO_LAYOUT, BASS_CLEF_BELOW, SCALE_LAYOUTS, TREBLE_CLEF_ABOVE, Layout, apply_beams, \
+    clef_changes
+from api.metrics import span, timed
+from api.notation import STEPS, CompactScore, CompactStaff, NoteRecord, UnsupportedScore
+from api.pitch_tables import parse_midi
+from api.specs import normalize_tonic
+from api.theory import INTERVALS, dominant_key, interval, key_for, scale_spelling, split_tonic
+from api.utilities import create_grand_staff
 
-from music21 import key, scale, meter, duration, pitch, note, clef, musicxml, interval, chord, stream, articulations
+logger = logging.getLogger(__name__)
 
-from api.fingering import ScaleFingering
-from api.utilities import create_grand_staff
+# MusicXML beam values to music21 beam types
+BEAM_TYPES = {'begin': 'start', 'continue': 'continue', 'end': 'stop'}
+# Exercises start on the tonic below F4 (as a MIDI number)
+F4 = parse_midi('F4')
+CHORD_INTERVALS = {
+    'major': ('M3', 'p5'),
+    'minor': ('m3', 'p5'),
+    'dominant': ('M3', 'p5', 'm7'),
+    'diminished': ('m3', 'a4', 'm6'),
+}
 
 
 class Exercise:
     def __init__(self, tonic='C', quality='major', note_duration=duration.Duration(0.25), octaves=2,
-                 separated_by=interval.Interval('-p8'), key_sig=None, tempo=None, articulation=None, staff='grand'):
+                 separated_by='-p8', key_sig=None, tempo=None, articulation=None, staff='grand'):
         self.tonic = tonic
         self.quality = quality
         self.duration = note_duration
         self.octaves = octaves
         self.separated_by = separated_by
-        self.key = key_sig
+        self.key = key_sig  # An api.theory.Key
         self.tempo = tempo
         self.articulation = articulation
         self.staff = staff
+        self.time_signature = None
+        self.separation = interval(separated_by)  # (diatonic steps, semitones) from right to left hand
 
+        # Notes are kept as NoteRecords; music21 streams are only built by materialize(), for the music21 exporter
         if self.staff == 'grand':
-            sharps = 0
-            if self.key:
-                sharps = self.key.sharps
-            self.left_hand, self.right_hand, self.grand_staff, self.s = create_grand_staff(
-                key.KeySignature(sharps))
+            self.right_hand = CompactStaff('G')
+            self.left_hand = CompactStaff('F')
         else:
-            self.s = stream.PartStaff()
-            if self.key:
-                self.s.insert(0, key)
+            self.part = CompactStaff(None)
+        self.s = None
 
-        if self.tempo:
-            if self.staff == 'grand':
-                self.right_hand.insert(0, self.tempo)
-            else:
-                self.s.insert(0, self.tempo)
+    @property
+    def staves(self) -> list:
+        if self.staff == 'grand':
+            return [self.right_hand, self.left_hand]
+        return [self.part]
 
-    def beam_in_groups(self, group_size, duration='eighth'):
+    @property
+    def note_length(self) -> Fraction:
+        return Fraction(self.duration.quarterLength)
+
+    def transposed(self, tonic: str, steps: int, semitones: int) -> 'Exercise':
+        """
+        A copy of the exercise in another key, its notes moved by the given diatonic steps and semitones (see
+        ``api.theory.interval``). Beaming, fingering and courtesy clefs are left for render() to work out, as for an
+        exercise built in that key. Subclasses also respell the key.
+        """
+        exercise = copy(self)
+        exercise.tonic = tonic
         if self.staff == 'grand':
-            stream_list = [self.left_hand, self.right_hand]
+            exercise.right_hand = self.right_hand.transposed(steps, semitones)
+            exercise.left_hand = self.left_hand.transposed(steps, semitones)
         else:
-            stream_list = [self.s]
-
-        for s in stream_list:
-            beamed_notes = [n for n in s.notes if n.duration == s.notes[0].duration]
-            for number, _note in enumerate(beamed_notes):
-                _note.beams.beamsList = []
-                if number % group_size == 0:
-                    _note.beams.fill(duration, type='start')
-                elif number % group_size == group_size - 1:
-                    _note.beams.fill(duration, type='stop')
-                else:
-                    _note.beams.fill(duration, type='continue')
-
-            beamed_notes[-1].beams.fill(duration, type='stop')
-
-    def insert_courtesy_clefs(self, new_clef_threshold_asc=pitch.Pitch('F#4'),
-                              new_clef_threshold_desc=pitch.Pitch('Bb3'), quantize=1):
+            exercise.part = self.part.transposed(steps, semitones)
+        exercise.s = None
+        return exercise
+
+    @timed('beaming')
+    def beam_in_groups(self, group_size, duration='eighth'):
+        for staff in self.staves:
+            apply_beams(staff.notes, group_size, duration)
+
+    @timed('courtesy_clefs')
+    def insert_courtesy_clefs(self, new_clef_threshold_asc=TREBLE_CLEF_ABOVE, new_clef_threshold_desc=BASS_CLEF_BELOW,
+                              quantize=1):
         """
         Create courtesy clefs, usually for left hand part.
 
         Parameters:
-            new_clef_threshold_asc (pitch.Pitch): The note above which we will insert a treble clef.
-            new_clef_threshold_desc (pitch.Pitch): The note below which we will insert a bass clef.
+            new_clef_threshold_asc (int): The MIDI number of the note above which we will insert a treble clef.
+            new_clef_threshold_desc (int): The MIDI number of the note below which we will insert a bass clef.
             quantize (int or None): The number of beats in a grid where the new clef can be inserted.
         """
 
-        def do_quantize(offset):
-            if quantize:
-                return (offset // quantize) * quantize
+        s = self.part if self.staff != 'grand' else self.left_hand
+        s.clef_changes.extend(clef_changes(s.notes, new_clef_threshold_asc, new_clef_threshold_desc, quantize))
+
+    def apply_layout(self, layout: Layout):
+        """
+        Beam the exercise and insert its courtesy clefs as the layout says.
+        """
+        if layout.beam_group:
+            self.beam_in_groups(layout.beam_group, duration=layout.beam_duration)
+        self.insert_courtesy_clefs(layout.treble_clef_above, layout.bass_clef_below, quantize=layout.clef_grid)
+
+    @timed('compact_score')
+    def compact_score(self) -> CompactScore:
+        score = CompactScore(self.staves, fifths=self.key.sharps if self.key else 0)
+        if self.time_signature:
+            ts = self.time_signature
+            score.time_signature = (ts.numerator, ts.denominator)
+            score.show_time_signature = not ts.style.hideObjectOnPrint and len(ts.displaySequence) > 0
+        if self.tempo:
+            score.tempo = (Fraction(self.tempo.referent.quarterLength), self.tempo.number)
+        return score
 
-        if not self.staff == 'grand':
-            s = self.s
+    @timed('materialize')
+    def materialize(self):
+        """
+        Build the music21 score for the exercise as self.s.
+        """
+        if self.staff == 'grand':
+            sharps = 0
+            if self.key:
+                sharps = self.key.sharps
+            left_hand, right_hand, grand_staff, self.s = create_grand_staff(key.KeySignature(sharps))
+            parts = [(right_hand, self.right_hand), (left_hand, self.left_hand)]
         else:
-            s = self.left_hand
-
-        inserted_treble = False
-        for n in s.notes:
-            if not inserted_treble and n.pitch > new_clef_threshold_asc:
-                s.insert(do_quantize(n.offset), clef.TrebleClef())
-                inserted_treble = True
-            if inserted_treble and n.pitch < new_clef_threshold_desc:
-                s.insert(do_quantize(n.offset), clef.BassClef())
-                break
-
-    def render(self):
+            part = stream.PartStaff()
+            self.s = part
+            if self.key:
+                part.insert(0, key.KeySignature(self.key.sharps))
+            parts = [(part, self.part)]
+
+        first_part = parts[0][0]
+        if self.tempo:
+            first_part.insert(0, self.tempo)
+
+        for part, staff in parts:
+            if self.time_signature:
+                part.insert(self.time_signature)
+            for offset, sign in staff.clef_changes:
+                part.insert(offset, clef.TrebleClef() if sign == 'G' else clef.BassClef())
+            for record in staff.notes:
+                p = pitch.Pitch(record.step, octave=record.octave)
+                if record.alter:
+                    p.accidental = pitch.Accidental(record.alter)
+                n = note.Note(p, quarterLength=record.duration)
+                for value in record.beams:
+                    n.beams.append(BEAM_TYPES[value])
+                if self.articulation:
+                    n.articulations.append(self.articulation)
+                if record.fingering is not None:
+                    n.articulations.append(articulations.Fingering(record.fingering))
+                part.insert(record.offset, n)
+        return self.s
+
+    def lay_out(self):
+        """
+        Work out beaming, fingering and courtesy clefs before the exercise is written out. Subclasses lay out their
+        own exercises.
+        """
+
+    def render(self, fast=True):
+        """
+        Lay out and render the exercise to a MusicXML string.
+
+        Parameters:
+            fast (bool): Write the MusicXML directly with api.musicxml_writer when it supports the exercise's
+                content. Otherwise, or if False, make notation and export with music21.
+        """
+        self.lay_out()
+        if fast and self.staff == 'grand' and not self.articulation:
+            try:
+                score = self.compact_score()
+                with span('xml_export'):
+                    return score_templates.write(type(self).__name__.lower(), self.quality, self.style, self.octaves,
+                                                 score)
+            except UnsupportedScore:
+                pass
+        return self.render_music21()
+
+    def writable_score(self) -> CompactScore or None:
+        """
+        The laid-out exercise as a CompactScore api.musicxml_writer can write, e.g. a measure at a time while
+        streaming it, or None if only music21 can export it.
+        """
+        if self.staff != 'grand' or self.articulation:
+            return None
+        try:
+            score = self.compact_score()
+            musicxml_writer.MusicXMLWriter(score).check()
+        except UnsupportedScore:
+            return None
+        return score
+
+    def render_music21(self):
+        self.materialize()
+        self.make_notation()
+        return self.export()
+
+    @timed('make_notation')
+    def make_notation(self):
         if self.staff == 'grand':
-            for part in self.left_hand, self.right_hand:
+            for part in self.s.parts:
                 part.makeNotation(inPlace=True)  # makes measures
         else:
             self.s.makeNotation(inPlace=True)
 
+    @timed('xml_export')
+    def export(self) -> str:
         parser = musicxml.m21ToXml.GeneralObjectExporter(self.s)
-        print('Done generating scale!')
         return parser.parse().decode('utf-8')
 
 
+def spell_run(degrees: tuple, bottom: NoteRecord, count: int) -> list:
+    """
+    The first count notes of a scale going up from bottom, its tonic.
+
+    Parameters:
+        degrees (tuple): The (step, alter) of each degree of the scale, see api.theory.ScaleSpelling.
+        bottom (NoteRecord): The note to start from.
+        count (int): How many notes to spell.
+    """
+    first = bottom.octave * 7 + STEPS.index(bottom.step)
+    return [NoteRecord(*degrees[index % 7], (first + index) // 7, bottom.duration) for index in range(count)]
+
+
 class Scale(Exercise):
     def __init__(self, tonic='C', quality='major', note_duration=duration.Duration(0.25), octaves=2,
-                 separated_by=interval.Interval('-p8'), contrary=False, tempo=None, articulation=None,
+                 separated_by='-p8', contrary=False, tempo=None, articulation=None,
                  style='ABRSM'):
 
         self.contrary = contrary
         self.style = style
 
-        if quality == 'major':
-            key_sig = key.Key(tonic.upper())
-            self.scale = key_sig.getScale('major')
-        elif quality == 'minor':
-            key_sig = key.Key(tonic.lower())
-            self.scale = key_sig.getScale('minor')
-        elif quality == 'melodic':
-            key_sig = key.Key(tonic.lower())
-            self.scale = scale.MelodicMinorScale(tonic)
-        elif quality == 'harmonic':
-            key_sig = key.Key(tonic.lower())
-            self.scale = scale.HarmonicMinorScale(tonic)
-        else:
-            raise ('Invalid key quality passed to Scale constructor:', quality)
+        key_sig = key_for(tonic, quality)
 
         super().__init__(tonic, quality, note_duration, octaves, separated_by, key_sig, tempo, articulation,
                          staff='grand')
@@ -132,82 +252,55 @@ class Scale(Exercise):
             self.duration = duration.Duration(0.5)
         else:
             time_sig = meter.TimeSignature('4/4')
-        self.left_hand.insert(time_sig)
-        self.right_hand.insert(time_sig)
+        self.time_signature = time_sig
 
         # Spell scale
-        bottom_note = self.scale.pitchFromDegree(1)
-        if bottom_note >= pitch.Pitch('F4'):
-            bottom_note = bottom_note.transpose('-p8')
+        spelling = scale_spelling(tonic, quality)
+        length = self.note_length
+        bottom = NoteRecord(*spelling.ascending[0], 4, length)
+        if bottom.midi >= F4:
+            bottom.octave = 3
+        count = 7 * self.octaves + 1
 
-        top_note = deepcopy(bottom_note)
-        for octave in range(self.octaves):
-            top_note.transpose('p8', inPlace=True)
-
-        asc = scale.Direction.ASCENDING
-        desc = scale.Direction.DESCENDING
-        rh_notes = [note.Note(p, duration=self.duration) for p in self.scale.getPitches(bottom_note, top_note, asc)]
-        rh_notes.extend(
-            [note.Note(p, duration=self.duration) for p in self.scale.getPitches(bottom_note, top_note, desc)][1:])
-        rh_notes[-1].duration = duration.Duration(1)
+        rh_notes = spell_run(spelling.ascending, bottom, count)
+        rh_notes.extend(spell_run(spelling.descending, bottom, count)[::-1][1:])
+        rh_notes[-1].duration = Fraction(1)
 
         if not self.contrary:
-            lh_notes = [deepcopy(n).transpose(self.separated_by) for n in rh_notes]
+            lh_notes = [n.transposed(*self.separation) for n in rh_notes]
         else:
-            lh_top = bottom_note
-            lh_bottom = deepcopy(bottom_note)
-            for octave in range(self.octaves):
-                lh_bottom.transpose('-p8', inPlace=True)
-            lh_notes = [note.Note(p, duration=self.duration) for p in self.scale.getPitches(lh_bottom, lh_top, desc)]
-            lh_notes.extend(
-                [note.Note(p, duration=self.duration) for p in self.scale.getPitches(lh_bottom, lh_top, asc)][1:])
-            lh_notes[-1].duration = duration.Duration(1)
-
-        if self.articulation:
-            for n in lh_notes:
-                n.articulations.append(self.articulation)
-            for n in rh_notes:
-                n.articulations.append(self.articulation)
+            lh_bottom = bottom.transposed(-7 * self.octaves, -12 * self.octaves)
+            lh_notes = spell_run(spelling.descending, lh_bottom, count)[::-1]
+            lh_notes.extend(spell_run(spelling.ascending, lh_bottom, count)[1:])
+            lh_notes[-1].duration = Fraction(1)
 
         self.right_hand.append(rh_notes)
         self.left_hand.append(lh_notes)
 
+    def transposed(self, tonic: str, steps: int, semitones: int) -> 'Scale':
+        exercise = super().transposed(tonic, steps, semitones)
+        exercise.key = key_for(tonic, self.quality)
+        return exercise
+
+    @timed('fingering')
     def apply_fingering(self, detail='full'):
         fingering = ScaleFingering(self, detail=detail)
         fingering.apply()
 
-    def render(self):
-        quantize = 1
-        if self.style == 'ABRSM':
-            quantize = 2
-            self.beam_in_groups(4)
-        elif self.style == 'Cooke':
-            self.beam_in_groups(4, duration='sixteenth')
-
+    def lay_out(self):
         self.apply_fingering()
-        self.insert_courtesy_clefs(quantize=quantize)
-        return super().render()
+        self.apply_layout(SCALE_LAYOUTS.get(self.style, SCALE_LAYOUTS['4/4']))
 
 
 class Arpeggio(Exercise):
     def __init__(self, tonic='C', quality='major', note_duration=duration.Duration(0.5), octaves=2,
-                 separated_by=interval.Interval('-p8'), inversion=0, tempo=None, articulation=None,
+                 separated_by='-p8', inversion=0, tempo=None, articulation=None,
                  style='ABRSM'):
 
         self.inversion = inversion
         self.style = style
 
-        if quality == 'major':
-            key_sig = key.Key(tonic.upper(), mode='major')
-        elif quality == 'minor':
-            key_sig = key.Key(tonic.lower(), mode='minor')
-        elif quality == 'dominant':
-            key_sig = key.Key(
-                key.sharpsToPitch(key.Key(tonic.upper(), mode='major').sharps - 1))  # dominant of the base key
-        elif quality == 'diminished':
-            key_sig = None
-        else:
-            raise ('Invalid key quality passed to Arpeggio constructor:', quality)
+        key_sig = self.key_for(tonic, quality)
 
         super().__init__(tonic, quality, note_duration, octaves, separated_by, key_sig, tempo, articulation,
                          staff='grand')
@@ -218,71 +311,79 @@ class Arpeggio(Exercise):
             # Four-note broken chords, more space needed
             time_sig = meter.TimeSignature('9/4')
         time_sig.setDisplay(None)
-        self.left_hand.insert(time_sig)
-        self.right_hand.insert(time_sig)
-
-        if self.quality == 'major':
-            root = self.key.pitchFromDegree(1)
-            notes = [root, root.transpose('M3'), root.transpose('p5')]
-        elif self.quality == 'minor':
-            root = self.key.pitchFromDegree(1)
-            notes = [root, root.transpose('m3'), root.transpose('p5')]
-        elif self.quality == 'dominant':
-            root = self.key.pitchFromDegree(5)
-            root.octave = 4
-            notes = [root, root.transpose('M3'), root.transpose('p5'), root.transpose('m7')]
-        else:
-            # Diminished
-            root = pitch.Pitch(self.tonic, octave=4)
-            notes = [root, root.transpose('m3'), root.transpose('a4'), root.transpose('m6')]
-
-        c = chord.Chord(notes)
-        c = c.sortAscending()
-
-        if c[0].pitch >= pitch.Pitch('F4'):
-            print('Transposing down...')
-            c.transpose('-p8', inPlace=True)
-
-        if self.octaves >= 3:
-            for octave in range(self.octaves - 2):
-                c.transpose('-p8', inPlace=True)
-        if self.inversion != 0:
-            c.inversion(self.inversion)
-
-        c = c.sortAscending()
+        self.time_signature = time_sig
+
+        # Root position on the tonic below F4, lower still for three octaves or more
+        root = NoteRecord(*split_tonic(normalize_tonic(tonic)), 4, self.note_length)
+        chord_notes = [root] + [root.transposed(*INTERVALS[name]) for name in CHORD_INTERVALS[quality]]
+        octaves_down = max(self.octaves - 2, 0) + (1 if root.midi >= F4 else 0)
+        if octaves_down:
+            chord_notes = [n.transposed(-7 * octaves_down, -12 * octaves_down) for n in chord_notes]
+        if self.inversion:
+            # Counted, as music21 counts them, from the root of the chord: for a diminished seventh spelled on the
+            # tonic, its augmented fourth
+            bass = (self.inversion + (2 if quality == 'diminished' else 0)) % len(chord_notes)
+            chord_notes = chord_notes[bass:] + [n.transposed(*INTERVALS['p8']) for n in chord_notes[:bass]]
+
+        octave_up = INTERVALS['p8']
 
         rh_notes = []
-
-        top_note = deepcopy(c[0])
-        top_note.duration = self.duration
-
-        for octave in range(self.octaves):
-            top_note = top_note.transpose('p8')
-
         for octave in range(self.octaves):
-            new_notes = [note.Note(p, duration=self.duration) for p in c.pitches]
-            c = c.transpose('p8')
-            rh_notes.extend(new_notes)
+            rh_notes.extend(n.transposed(octave_up[0] * octave, octave_up[1] * octave) for n in chord_notes)
+        top_note = chord_notes[0].transposed(octave_up[0] * self.octaves, octave_up[1] * self.octaves)
 
-        rh_notes_descending = deepcopy(rh_notes[::-1])
+        rh_notes_descending = [n.copy() for n in rh_notes[::-1]]
         rh_notes.append(top_note)
         rh_notes.extend(rh_notes_descending)
 
         if self.quality == 'dominant' and self.style == 'ABRSM':
             # ABRSM 2022-2023 dominant arpeggios resolve on the tonic
-            rh_notes[-1] = rh_notes[-2].transpose('m2')
-        rh_notes[-1].duration = duration.Duration(1)  # End with quarter note
+            rh_notes[-1] = rh_notes[-2].transposed(*INTERVALS['m2'])
+        rh_notes[-1].duration = Fraction(1)  # End with quarter note
 
-        lh_notes = [deepcopy(n).transpose(self.separated_by) for n in rh_notes]
+        lh_notes = [n.transposed(*self.separation) for n in rh_notes]
 
         self.right_hand.append(rh_notes)
         self.left_hand.append(lh_notes)
 
-    def render(self):
-        if self.tonic in ['A', 'Ab']:
-            asc_threshold = pitch.Pitch('F4')
+    @staticmethod
+    def key_for(tonic, quality):
+        """
+        The api.theory.Key of an arpeggio, or None for a diminished seventh, which is written without a key signature.
+        """
+        if quality in ('major', 'minor'):
+            return key_for(tonic, quality)
+        elif quality == 'dominant':
+            return dominant_key(tonic)  # dominant of the base key
+        elif quality == 'diminished':
+            return None
         else:
-            asc_threshold = pitch.Pitch('G4')
-        self.insert_courtesy_clefs(new_clef_threshold_asc=asc_threshold, quantize=2)
-        self.beam_in_groups(4)
-        return super(Arpeggio, self).render()
+            raise ValueError(f'Invalid arpeggio quality: {quality!r}')
+
+    def transposed(self, tonic: str, steps: int, semitones: int) -> 'Arpeggio':
+        exercise = super().transposed(tonic, steps, semitones)
+        exercise.key = self.key_for(tonic, self.quality)
+        return exercise
+
+    @timed('fingering')
+    def apply_fingering(self, detail='full'):
+        fingering = ArpeggioFingering(self, detail=detail)
+        fingering.apply()
+
+    def lay_out(self):
+        layout = ARPEGGIO_LAYOUT
+        if self.tonic in ['A', 'Ab']:
+            layout = layout._replace(treble_clef_above=F4)
+        self.apply_layout(layout)
+        self.apply_fingering()
+
+
+def build_exercise(kind, tonic, quality, style='ABRSM', octaves=2) -> Exercise:
+    """
+    Build the scale or arpeggio exercise served by the API for the given parameters.
+    """
+    with span('construction'):
+        metronome = tempo.MetronomeMark(number=110, referent=duration.Duration(2))
+        if kind == 'scale':
+            return Scale(tonic, quality, octaves=octaves, tempo=metronome, style=style)
+        return Arpeggio(tonic, quality, octaves=octaves, tempo=metronome, style=style)
@@ -1,63 +1,270 @@
-from dataclasses import dataclass
+"""
+Piano fingering for scales, arpeggios and chords.
 
-from music21 import note, articulations
+Scale fingerings are looked up in ``FINGERING_TABLE``, built once from the traditional fingering of each key: the
+finger each hand uses on every degree of the scale mid-run, ascending and descending. Arpeggio and chord fingerings
+follow from the shape of the chord and are cached per shape. Either way fingering an exercise is one pass over its
+notes.
+"""
+from functools import lru_cache
 
+from api.notation import STEPS, NoteRecord
+from api.specs import normalize_tonic
 
-class ChordFingering:
-    pass
+BLACK_KEYS = {1, 3, 6, 8, 10}  # Pitch classes
+
+# Right and left hand fingers for scale degrees 1-7 mid-run, when the thumb passes under to continue. At the top
+# (right hand) or bottom (left hand) of a run, where the thumb would pass under, the hand stretches to the next
+# finger instead: 5 for C major.
+GROUP_1 = ('1231234', '1432132')  # Thumbs on the tonic and subdominant (right hand) or dominant (left hand)
+SCALE_FINGERINGS = {
+    **{f'{tonic} {mode}': GROUP_1 for tonic in ('C', 'G', 'D', 'A', 'E') for mode in ('major', 'minor')},
+
+    # Group 2: the keys around the black-key group
+    'B major': ('1231234', '1321432'),
+    'Cb major': ('1231234', '1321432'),
+    'B minor': ('1231234', '1321432'),
+    'F# major': ('2341231', '4321321'),
+    'Gb major': ('2341231', '4321321'),
+    'F# minor': ('3412312', '4321321'),
+    'C# major': ('2312341', '3214321'),
+    'Db major': ('2312341', '3214321'),
+    'C# minor': ('3412312', '3214321'),
+
+    # Group 3: the flat keys, with thumbs on the white keys after black ones
+    'F major': ('1234123', '1432132'),
+    'F minor': ('1234123', '1432132'),
+    'Bb major': ('4123123', '3214321'),
+    'Bb minor': ('4123123', '2132143'),
+    'A# minor': ('4123123', '2132143'),
+    'Eb major': ('3123412', '3214321'),
+    'Eb minor': ('3123412', '2143213'),
+    'D# minor': ('3123412', '2143213'),
+    'Ab major': ('3412312', '3214321'),
+    'Ab minor': ('3412312', '3213214'),
+    'G# minor': ('3412312', '3213214'),
+}
+# Right and left hand fingers on the tonic a run starts and ends on, where the mid-run finger in SCALE_FINGERINGS
+# would leave the hand without a finger for the note before it: 2 rather than 4 on B flat. None keeps the mid-run
+# finger.
+SCALE_END_FINGERS = {
+    'Bb major': (2, None),
+    'Bb minor': (2, None),
+    'A# minor': (2, None),
+}
+# Melodic minors whose raised sixth and seventh would put the right thumb on a black key going up
+MELODIC_ASCENDING_RIGHT_HAND = {
+    'F#': '2312341',
+    'C#': '2312341',
+}
+
+
+def build_fingering_table() -> dict:
+    """
+    {(tonic, quality, hand, direction): fingers for degrees 1-7} for every scale in SCALE_FINGERINGS.
+    """
+    table = {}
+    for name, (right, left) in SCALE_FINGERINGS.items():
+        tonic, mode = name.split()
+        qualities = ('major',) if mode == 'major' else ('minor', 'harmonic', 'melodic')
+        for quality in qualities:
+            for direction in ('ascending', 'descending'):
+                fingers = {'right': right, 'left': left}
+                if quality == 'melodic' and direction == 'ascending' and tonic in MELODIC_ASCENDING_RIGHT_HAND:
+                    fingers['right'] = MELODIC_ASCENDING_RIGHT_HAND[tonic]
+                for hand, digits in fingers.items():
+                    table[(tonic, quality, hand, direction)] = tuple(int(d) for d in digits)
+    return table
+
+
+def build_end_finger_table() -> dict:
+    """
+    {(tonic, quality, hand): the finger on the tonic at either end of a run} for every scale in SCALE_END_FINGERS.
+    """
+    table = {}
+    for name, fingers in SCALE_END_FINGERS.items():
+        tonic, mode = name.split()
+        for quality in ('major',) if mode == 'major' else ('minor', 'harmonic', 'melodic'):
+            for hand, finger in zip(('right', 'left'), fingers):
+                if finger is not None:
+                    table[(tonic, quality, hand)] = finger
+    return table
+
+
+FINGERING_TABLE = build_fingering_table()
+END_FINGER_TABLE = build_end_finger_table()
+
+
+def is_black(n: NoteRecord) -> bool:
+    return n.midi % 12 in BLACK_KEYS
+
+
+def annotate(notes: list, fingers: list, detail: str):
+    """
+    Set the fingering of each note. With detail 'full' every note is marked; with 'crossings', only the first and
+    last notes and those where the hand changes position.
+    """
+    last = None
+    for index, (n, finger) in enumerate(zip(notes, fingers)):
+        if finger is None:
+            continue
+        if detail == 'full' or index in (0, len(notes) - 1) or last is None or abs(finger - last) != 1:
+            n.fingering = str(finger)
+        last = finger
 
 
 class ScaleFingering:
     def __init__(self, scale, detail='full'):
         self.scale = scale
         self.detail = detail
-        self.group = 1
-
-    def fingering_for_scale(self):
-        group = 1
-        scale_name = f'{self.scale.tonic} {self.scale.quality}'
-        if scale_name in ['Cb major', 'B major', 'B minor', 'F# major', 'F# minor',
-                          'Gb major', 'C# major', 'C# minor', 'Db major']:
-            group = 2
-        elif scale_name in ['Ab major', 'Ab minor', 'Bb major', 'Bb minor', 'D# minor', 'Eb major', 'Eb minor',
-                            'G# minor', 'A# minor', 'F major', 'F minor']:
-            group = 3
-
-    def fingering_for_note(self, _note: note.Note, hand: str, last_note: note.Note or None,
-                           last_finger: int) -> int or None:
-        degree = self.scale.key.getScaleDegreeFromPitch(_note.pitch)
-
-        if hand == 'left':
-            top_note = max(self.scale.left_hand.notes)
-            bottom_note = min(self.scale.left_hand.notes)
-        else:
-            top_note = max(self.scale.right_hand.notes)
-            bottom_note = min(self.scale.right_hand.notes)
+        try:
+            self.tonic = normalize_tonic(scale.tonic)
+        except ValueError:
+            self.tonic = None
 
-        ascending = True
-        if last_note is None:
-            if hand == 'left' and self.scale.contrary:
-                ascending = False
-        else:
-            if _note < last_note or _note == top_note:
-                ascending = False
-
-        # return self.fingering[self.scale.tonic][self.scale.quality][degree]
-        return "345"
-
-    def apply_fingering_for_hand(self, notes, hand: str):
-        last_note = None
-        last_finger = None
-        for n in notes:
-            finger = self.fingering_for_note(n, hand, last_note, last_finger)
-            last_finger = finger
-            last_note = n
-            if finger:
-                n.articulations.append(articulations.Fingering(finger))
+    def fingers_for_hand(self, notes: list, hand: str) -> list or None:
+        """
+        The finger for each note, or None if the scale has no traditional fingering.
+        """
+        key = (self.tonic, self.scale.quality, hand)
+        ascending = FINGERING_TABLE.get(key + ('ascending',))
+        descending = FINGERING_TABLE.get(key + ('descending',))
+        if ascending is None or not notes:
+            return None
+
+        tonic_index = STEPS.index(self.tonic[0])
+        # The end of the run where the thumb can't pass under: the top for the right hand, the bottom for the left
+        extreme = max(n.midi for n in notes) if hand == 'right' else min(n.midi for n in notes)
+
+        fingers = []
+        last = len(notes) - 1
+        for index, n in enumerate(notes):
+            degree = (STEPS.index(n.step) - tonic_index) % 7
+            if index < last:
+                going_up = notes[index + 1].midi > n.midi
+            else:
+                going_up = index > 0 and notes[index - 1].midi < n.midi
+            fingers.append((ascending if going_up else descending)[degree])
+
+        for index, n in enumerate(notes):
+            if fingers[index] == 1 and n.midi == extreme and last > 0:
+                neighbour = fingers[index - 1] if index > 0 else fingers[index + 1]
+                fingers[index] = min(neighbour + 1, 5)
+
+        end_finger = END_FINGER_TABLE.get(key)
+        if end_finger is not None:
+            for index in {0, last}:
+                if notes[index].step == self.tonic[0]:
+                    fingers[index] = end_finger
+        return fingers
+
+    def apply(self):
+        if not self.scale.staff == 'grand':
+            raise ValueError('Cannot apply fingering without separate hand information')
+
+        for hand, notes in (('left', self.scale.left_hand.notes), ('right', self.scale.right_hand.notes)):
+            fingers = self.fingers_for_hand(notes, hand)
+            if fingers is not None:
+                annotate(notes, fingers, self.detail)
+
+
+@lru_cache(maxsize=256)
+def arpeggio_pattern(tones: tuple, hand: str) -> dict:
+    """
+    The finger for each tone of a broken chord mid-run, by pitch class.
+
+    Parameters:
+        tones (tuple): The pitch classes of the chord, ascending from its lowest note.
+        hand (str): 'right' or 'left'.
+    """
+    size = len(tones)
+    if hand == 'right':
+        # Thumb on the first white key going up; the widest stretch, a fourth, takes the fourth finger
+        cycle = list(tones)
+    else:
+        # Mirrored: counting down from the left thumb
+        cycle = [tones[0]] + list(reversed(tones[1:]))
+    thumb = next((i for i, tone in enumerate(cycle) if tone not in BLACK_KEYS), 0)
+    cycle = cycle[thumb:] + cycle[:thumb]
+
+    fingers = {cycle[0]: 1, cycle[1]: 2}
+    if size == 3:
+        gap = (cycle[2] - cycle[1]) % 12 if hand == 'right' else (cycle[1] - cycle[2]) % 12
+        wide = gap >= 5 or (hand == 'left' and cycle[2] not in BLACK_KEYS)
+        fingers[cycle[2]] = 4 if wide else 3
+    else:
+        for index, tone in enumerate(cycle[2:], start=3):
+            fingers[tone] = min(index, 4)
+    return fingers
+
+
+class ArpeggioFingering:
+    def __init__(self, arpeggio, detail='full'):
+        self.arpeggio = arpeggio
+        self.detail = detail
+
+    @staticmethod
+    def fingers_for_hand(notes: list, hand: str, chord_size: int) -> list or None:
+        if len(notes) <= chord_size:
+            return None
+        tones = tuple(n.midi % 12 for n in notes[:chord_size])
+        pattern = arpeggio_pattern(tones, hand)
+        top = max(n.midi for n in notes)
+        bottom = min(n.midi for n in notes)
+
+        fingers = [pattern.get(n.midi % 12) for n in notes]
+        last = len(notes) - 1
+        for index, n in enumerate(notes):
+            neighbour = index + 1 if index == 0 else index - 1
+            if fingers[index] is None:
+                # A note outside the chord, such as the tonic a dominant seventh resolves to: the next finger over
+                step = 1 if n.midi > notes[neighbour].midi else -1
+                if hand == 'left':
+                    step = -step
+                fingers[index] = max(1, min(fingers[neighbour] + step, 5))
+            elif fingers[index] == 1 and n.midi == (top if hand == 'right' else bottom):
+                fingers[index] = 5
+            elif hand == 'right' and n.midi == bottom and fingers[index] > 2 and fingers[neighbour] == 1 \
+                    and index in (0, last):
+                # Start (and finish) a run from a black key on the second finger, passing straight to the thumb
+                fingers[index] = 2
+        return fingers
 
     def apply(self):
-        if not self.scale.left_hand:
-            raise 'Cannot apply fingering without separate hand information.'
+        size = 3 if self.arpeggio.quality in ('major', 'minor') else 4
+        for hand, notes in (('left', self.arpeggio.left_hand.notes), ('right', self.arpeggio.right_hand.notes)):
+            fingers = self.fingers_for_hand(notes, hand, size)
+            if fingers is not None:
+                annotate(notes, fingers, self.detail)
+
+
+class ChordFingering:
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def for_intervals(steps: tuple) -> tuple:
+        """
+        The (left hand, right hand) fingers for a chord, each from the bottom note up.
+
+        Parameters:
+            steps (tuple): The diatonic steps between each note of the chord and the next, from the bottom up.
+        """
+        if len(steps) == 2:
+            # The wider gap of a fourth is taken between the second and fifth fingers
+            left = (5, 2, 1) if steps[0] >= 3 else (5, 3, 1)
+            right = (1, 2, 5) if steps[1] >= 3 else (1, 3, 5)
+        elif len(steps) == 3:
+            # A second is played with neighbouring fingers
+            left = (5, 4, 2, 1) if steps[0] == 1 else (5, 3, 2, 1)
+            right = (1, 2, 4, 5) if steps[2] == 1 else (1, 2, 3, 5)
+        else:
+            right = tuple(1 + round(4 * i / max(len(steps), 1)) for i in range(len(steps) + 1))
+            left = tuple(6 - finger for finger in right)
+        return left, right
 
-        for hand, notes in zip(('left', 'right'), (self.scale.left_hand.notes, self.scale.right_hand.notes)):
-            self.apply_fingering_for_hand(notes, hand)
+    @classmethod
+    def for_chord(cls, notes: tuple) -> tuple:
+        """
+        The (left hand, right hand) fingers for a chord of (step, alter, octave) notes, from the bottom up.
+        """
+        positions = [octave * 7 + STEPS.index(step) for step, _alter, octave in notes]
+        return cls.for_intervals(tuple(b - a for a, b in zip(positions, positions[1:])))
@@ -0,0 +1,222 @@
+"""
+Pool of pre-rendered random-note flashcards.
+
+Cards are bucketed by the random-note parameters (see ``bucket_from_query``). ``take`` pops a ready card, and
+whenever a bucket falls below ``FLASHCARD_POOL_LOW`` cards a background thread tops it back up to
+``FLASHCARD_POOL_SIZE`` by rendering a batch in ``api.executor``. The pool keeps at most
+``FLASHCARD_MAX_BUCKETS`` buckets, dropping the least recently used.
+
+``metrics()`` reports the hit rate and how long refills lag behind the request that asked for them; the same figures
+are exported to /metrics (see ``api.metrics``).
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import jobs, metrics
+from .executor import ExecutorSaturated, get_executor
+from .pitch_tables import candidate_count, parse_midi
+from .specs import replace_fancy_accidentals
+
+logger = logging.getLogger(__name__)
+
+REFILL_LAG = metrics.Histogram('conbrio_flashcard_refill_lag_seconds',
+                               'Time from a bucket running low to its refill being ready')
+CARDS_RENDERED = metrics.Counter('conbrio_flashcard_cards_rendered_total', 'Flashcards rendered into the pool')
+
+# Notes to a phrase in a sight-reading session -> the quarter length of each, filling a 4/4 measure
+SESSION_NOTE_LENGTHS = {1: 4.0, 2: 2.0, 4: 1.0}
+
+
+def bucket_from_query(params) -> tuple:
+    """
+    The (max_sharps, max_flats, min_note, max_note, accidentals) bucket for /api/exercise/ query parameters.
+    Raises ValueError for invalid parameters.
+    """
+    max_sharps = int(params.get('max_sharps', 7))
+    max_flats = int(params.get('max_flats', 7))
+    if not 0 <= max_sharps <= 7 or not 0 <= max_flats <= 7:
+        raise ValueError('max_sharps and max_flats must be between 0 and 7')
+    min_note = replace_fancy_accidentals(params.get('min_note', 'A0'))
+    max_note = replace_fancy_accidentals(params.get('max_note', 'C8'))
+    if parse_midi(min_note) > parse_midi(max_note):
+        raise ValueError(f'min_note {min_note} is above max_note {max_note}')
+    # Each card draws from a random key signature's scale, so every one allowed needs a note in the range
+    for sharps in range(-max_flats, max_sharps + 1):
+        if not candidate_count(min_note, max_note, sharps):
+            raise ValueError(f'No notes between {min_note} and {max_note} in the key signature with '
+                             f'{abs(sharps)} {"flats" if sharps < 0 else "sharps"}')
+    accidentals = params.get('accidentals', 'true') == 'true'
+    return max_sharps, max_flats, min_note, max_note, accidentals
+
+
+def session_from_query(params) -> tuple:
+    """
+    The (bucket, count, phrase_length) of a sight-reading session for /api/exercise/session/ query parameters: count
+    random notes in phrases of phrase_length notes to a 4/4 measure. Raises ValueError for invalid parameters.
+    """
+    bucket = bucket_from_query(params)
+    count = int(params.get('count', 16))
+    phrase_length = int(params.get('phrase', 1))
+    if not 1 <= count <= settings.SESSION_MAX_NOTES:
+        raise ValueError(f'count must be between 1 and {settings.SESSION_MAX_NOTES}')
+    if phrase_length not in SESSION_NOTE_LENGTHS:
+        raise ValueError(f'phrase must be one of {", ".join(map(str, SESSION_NOTE_LENGTHS))}')
+    if count % phrase_length:
+        raise ValueError('count must be a whole number of phrases')
+    return bucket, count, phrase_length
+
+
+class FlashcardPool:
+    def __init__(self, size: int or None = None, low: int or None = None, max_buckets: int or None = None):
+        self.size = size or settings.FLASHCARD_POOL_SIZE
+        self.low = low if low is not None else settings.FLASHCARD_POOL_LOW
+        self.max_buckets = max_buckets or settings.FLASHCARD_MAX_BUCKETS
+        self.buckets = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.cards_rendered = 0
+        self.refill_lag_total = 0.0
+        self.refill_lag_max = 0.0
+
+        self._lock = threading.Lock()
+        self._wanted = queue.Queue()
+        self._requested = {}  # bucket -> time its refill was requested
+        self._failed = set()  # Buckets whose refill failed, which are never refilled again
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._refill_loop, name='flashcard-refill', daemon=True)
+        self._thread.start()
+
+    def _cards(self, bucket: tuple) -> deque:
+        with self._lock:
+            cards = self.buckets.get(bucket)
+            if cards is None:
+                cards = self.buckets[bucket] = deque()
+                while len(self.buckets) > self.max_buckets:
+                    evicted, _cards = self.buckets.popitem(last=False)
+                    self._failed.discard(evicted)
+            else:
+                self.buckets.move_to_end(bucket)
+            return cards
+
+    def take(self, bucket: tuple) -> dict or None:
+        """
+        Pop a ready card for the bucket, or None if it is empty. Either way, ask for a refill if it is running low.
+        """
+        cards = self._cards(bucket)
+        try:
+            card = cards.popleft()
+        except IndexError:
+            card = None
+
+        with self._lock:
+            if card is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if len(cards) < self.low and bucket not in self._requested and bucket not in self._failed:
+                self._requested[bucket] = time.perf_counter()
+                self._wanted.put(bucket)
+        return card
+
+    def _refill_loop(self):
+        while not self._closed.is_set():
+            try:
+                bucket = self._wanted.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            cards = self._cards(bucket)
+            missing = self.size - len(cards)
+            try:
+                future = get_executor().submit(jobs.random_notes, bucket, missing) if missing > 0 else None
+                rendered = future.result(timeout=settings.RENDER_TIMEOUT) if future else []
+            except ExecutorSaturated:
+                # Leave the executor to the requests; try again shortly
+                time.sleep(0.5)
+                self._wanted.put(bucket)
+                continue
+            except Exception:
+                logger.exception('Flashcard refill for %s failed; it will not be refilled again', bucket)
+                rendered = []
+                with self._lock:
+                    self._failed.add(bucket)
+
+            cards.extend(rendered)
+            with self._lock:
+                lag = time.perf_counter() - self._requested.pop(bucket)
+                self.refills += 1
+                self.cards_rendered += len(rendered)
+                self.refill_lag_total += lag
+                self.refill_lag_max = max(self.refill_lag_max, lag)
+            REFILL_LAG.observe(lag)
+            CARDS_RENDERED.inc(len(rendered))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'refills': self.refills,
+                'cards_rendered': self.cards_rendered,
+                'refill_lag_mean': self.refill_lag_total / self.refills if self.refills else None,
+                'refill_lag_max': self.refill_lag_max,
+                'refills_pending': len(self._requested),
+                'buckets': len(self.buckets),
+                'cards_ready': sum(len(cards) for cards in self.buckets.values()),
+            }
+
+    def wait_for_refills(self, timeout: float = 30) -> bool:
+        """
+        Wait until no refills are pending. Returns False if some still are after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while self._requested:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> FlashcardPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = FlashcardPool()
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def _pool_metric(name: str):
+    def collect():
+        pool = _pool
+        return pool.metrics()[name] if pool is not None else None
+
+    return collect
+
+
+metrics.Gauge('conbrio_flashcard_cards_ready', 'Flashcards ready in the pool', _pool_metric('cards_ready'))
+metrics.Gauge('conbrio_flashcard_buckets', 'Parameter sets with flashcards in the pool', _pool_metric('buckets'))
+metrics.Gauge('conbrio_flashcard_refills_pending', 'Buckets waiting to be refilled', _pool_metric('refills_pending'))
@@ -0,0 +1,169 @@
+"""
+Render jobs run by the worker processes of ``api.executor``.
+
+Each job is a top-level function of picklable arguments returning a picklable result, so it can be sent to a
+worker process. music21 is imported inside the jobs, so that importing this module (as the views do) stays cheap.
+"""
+import random
+
+from . import render_cache
+from .metrics import span
+from .pitch_tables import parse_midi
+from .specs import ExerciseSpec
+
+# Notes below Ab3 are always shown in the left hand, and above F#4 in the right hand
+LEFT_HAND_BELOW = parse_midi('Ab3')
+RIGHT_HAND_ABOVE = parse_midi('F#4')
+
+
+def random_hand(ps: float) -> int:
+    """
+    The hand a random note is shown in: left (0) or right (1) at random, unless it is too low or high for one.
+    """
+    if ps < LEFT_HAND_BELOW:
+        return 0
+    if ps > RIGHT_HAND_ABOVE:
+        return 1
+    return random.randint(0, 1)
+
+
+def random_notes(bucket: tuple, count: int) -> list:
+    """
+    Render random-note flashcards.
+
+    Parameters:
+        bucket (tuple): (max_sharps, max_flats, min_note, max_note, accidentals), see api.flashcards.
+        count (int): The number of cards to render, each with its own random key signature and note.
+    """
+    from .utilities import generate_random_note
+
+    max_sharps, max_flats, min_note, max_note, accidentals = bucket
+    cards = []
+    for _card in range(count):
+        # Choose random key signature, hand, and note
+        sharps = random.randint(max_flats * -1, max_sharps)
+        random_note = generate_random_note(min_note, max_note, accidentals, sharps)
+        hand = random_hand(random_note.ps)
+
+        # The same card comes up again and again, so its render is cached like an exercise's
+        xml = render_cache.get_or_set(f'card:{sharps}:{hand}:{random_note.nameWithOctave}',
+                                      lambda: card(sharps, hand, random_note))
+        cards.append({'note': random_note.midi, 'xml': xml})
+    return cards
+
+
+def card(sharps: int, hand: int, random_note) -> str:
+    """
+    Render a flashcard: a grand staff in the key signature with the given sharps (negative for flats), with the note
+    on the left (0) or right (1) hand.
+    """
+    from music21 import key, note, musicxml
+    from .utilities import create_grand_staff
+
+    with span('construction'):
+        left_hand, right_hand, grand_staff, s = create_grand_staff(key.KeySignature(sharps))
+        if hand == 0:
+            left_hand.insert(note.Note(random_note))
+        else:
+            right_hand.insert(note.Note(random_note))
+
+    with span('make_notation'):
+        for part in left_hand, right_hand:
+            part.makeNotation(inPlace=True)  # makes measures
+
+    with span('xml_export'):
+        parser = musicxml.m21ToXml.GeneralObjectExporter(s)
+        return parser.parse().decode('utf-8')
+
+
+def reading_session(bucket: tuple, count: int, phrase_length: int) -> dict:
+    """
+    Render a sight-reading session: count random notes in one grand-staff score, phrase_length notes to a 4/4
+    measure. Each measure is a flashcard's worth of choices: its own random key signature, and notes chosen as for
+    random_notes.
+
+    Returns {'notes': the MIDI number of each note, in order, 'xml': the score's MusicXML}.
+    """
+    from music21 import key, meter, musicxml, note
+    from .flashcards import SESSION_NOTE_LENGTHS
+    from .utilities import create_grand_staff, generate_random_notes
+
+    max_sharps, max_flats, min_note, max_note, accidentals = bucket
+    length = SESSION_NOTE_LENGTHS[phrase_length]
+    answers = []
+    with span('construction'):
+        left_hand, right_hand, grand_staff, s = create_grand_staff(None)
+        hands = (left_hand, right_hand)
+        for part in hands:
+            part.insert(0, meter.TimeSignature('4/4'))
+
+        previous_sharps = None
+        for measure in range(count // phrase_length):
+            sharps = random.randint(max_flats * -1, max_sharps)
+            if sharps != previous_sharps:
+                for part in hands:
+                    part.insert(measure * 4, key.KeySignature(sharps))
+                previous_sharps = sharps
+            for index, p in enumerate(generate_random_notes(min_note, max_note, accidentals, sharps, phrase_length)):
+                offset = measure * 4 + index * length
+                hand = random_hand(p.ps)
+                hands[hand].insert(offset, note.Note(p, quarterLength=length))
+                hands[1 - hand].insert(offset, note.Rest(quarterLength=length))
+                answers.append(p.midi)
+
+    with span('make_notation'):
+        for part in hands:
+            part.makeNotation(inPlace=True)  # makes measures
+
+    with span('xml_export'):
+        parser = musicxml.m21ToXml.GeneralObjectExporter(s)
+        return {'notes': answers, 'xml': parser.parse().decode('utf-8')}
+
+
+def random_note(bucket: tuple) -> dict:
+    return random_notes(bucket, 1)[0]
+
+
+def scale(spec: ExerciseSpec) -> str:
+    return render_cache.get_or_render(spec)
+
+
+def scale_score(spec: ExerciseSpec):
+    """
+    Lay out an exercise to be streamed: its CompactScore, for api.musicxml_writer to write a measure at a time as it
+    is sent, or if the direct writer can't write it, its MusicXML.
+    """
+    from .transposition import transposed_exercise
+
+    exercise = transposed_exercise(spec)
+    exercise.lay_out()
+    score = exercise.writable_score()
+    if score is None:
+        return render_cache.get_or_render(spec)
+    return score
+
+
+def playback(spec: ExerciseSpec, variant: str) -> bytes:
+    return render_cache.get_or_render_playback(spec, variant)
+
+
+def chord_exercise(tonic: str) -> str:
+    from .chords import chord_exercise
+
+    return render_cache.get_or_set(f'chords:{tonic}', lambda: chord_exercise(tonic))
+
+
+def chord_playback(tonic: str, variant: str) -> bytes:
+    """
+    A playback format of the chord exercise for a major key, rendering every format the first time one is asked for.
+    """
+    from .chords import chord_stream
+    from .playback import stream_formats
+
+    def render():
+        formats = stream_formats(chord_stream(tonic))
+        render_cache.get_cache().set_many({f'chords:{tonic}:{other}': data for other, data in formats.items()},
+                                          version=render_cache.RENDER_VERSION)
+        return formats[variant]
+
+    return render_cache.get_or_set(f'chords:{tonic}:{variant}', render)
@@ -0,0 +1,122 @@
+"""
+Beaming and courtesy clefs for exercises, worked out over arrays of a staff's notes.
+
+Beam groups are found over an array of a staff's durations: the notes as long as the first are beamed, by a position
+count modulo the group size, worked out with NumPy once for each number of beamed notes and group size. Clef changes
+are threshold crossings, found with two array searches over a staff's MIDI numbers and then alternated between. The
+results are written back to the notes in one pass.
+
+How each kind and style of exercise is laid out is looked up in ``SCALE_LAYOUTS`` and ``ARPEGGIO_LAYOUT``.
+"""
+from bisect import bisect_left
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from .notation import BEAM_LEVELS
+from .pitch_tables import parse_midi
+
+# Beam codes, one per note
+NO_BEAM, BEGIN, CONTINUE, END = 0, 1, 2, 3
+BEAM_VALUES = {BEGIN: 'begin', CONTINUE: 'continue', END: 'end'}
+# {duration: {code: the note's MusicXML beam values, one per level}}
+BEAM_TUPLES = {duration: {code: (value,) * levels for code, value in BEAM_VALUES.items()}
+               for duration, levels in BEAM_LEVELS.items()}
+
+# Where the left hand changes to the treble clef going up, and back to the bass clef going down, as MIDI numbers.
+# The gap between them keeps a hand hovering around middle C from flipping clefs on every note.
+TREBLE_CLEF_ABOVE = parse_midi('F#4')
+BASS_CLEF_BELOW = parse_midi('Bb3')
+
+
+class Layout(NamedTuple):
+    beam_group: int or None = None  # Notes per beam group, or None to leave notes unbeamed
+    beam_duration: str = 'eighth'  # The note value beamed, for the number of beam levels
+    clef_grid: int or None = 1  # Clef changes are moved back to a multiple of this many beats
+    treble_clef_above: int = TREBLE_CLEF_ABOVE
+    bass_clef_below: int = BASS_CLEF_BELOW
+
+
+SCALE_LAYOUTS = {
+    'ABRSM': Layout(4, 'eighth', clef_grid=2),
+    'Cooke': Layout(4, '16th'),
+    '4/4': Layout(),
+}
+# Arpeggios change to the treble clef above G4, except on A and Ab (see Arpeggio.lay_out)
+ARPEGGIO_LAYOUT = Layout(4, 'eighth', clef_grid=2, treble_clef_above=parse_midi('G4'))
+
+
+def midi_of(notes: list) -> np.ndarray:
+    return np.fromiter((n.midi for n in notes), dtype=np.int16, count=len(notes))
+
+
+def durations_of(notes: list) -> np.ndarray:
+    # Quarter note lengths are exact in binary, and dividing is much faster than Fraction.__float__
+    return np.fromiter((a / b for a, b in (n.duration.as_integer_ratio() for n in notes)), dtype=np.float64,
+                       count=len(notes))
+
+
+@lru_cache(maxsize=None)
+def group_codes(count: int, group_size: int) -> tuple:
+    """
+    The beam codes of count beamed notes in groups of group_size, the last of them ending a group. Exercises are a
+    handful of lengths, so each is worked out once.
+    """
+    position = np.arange(count) % group_size
+    codes = np.where(position == 0, BEGIN, np.where(position == group_size - 1, END, CONTINUE))
+    codes[-1:] = END
+    return tuple(codes.tolist())
+
+
+def beam_codes(durations: np.ndarray, group_size: int) -> np.ndarray:
+    """
+    The beam code of each note, from an array of the notes' durations in quarter notes: notes as long as the first are
+    beamed in groups of group_size, the last of them ending a group, and the others get NO_BEAM.
+    """
+    codes = np.full(len(durations), NO_BEAM, dtype=np.int8)
+    beamed = np.flatnonzero(durations == durations[0])
+    codes[beamed] = group_codes(len(beamed), group_size)
+    return codes
+
+
+def clef_change_indices(midi: np.ndarray, treble_clef_above: int, bass_clef_below: int) -> list:
+    """
+    The (note index, clef) of each clef change for a staff starting in the bass clef: to 'G' at the first note above
+    treble_clef_above, then back to 'F' at the next note below bass_clef_below, and so on.
+    """
+    crossings = {'G': np.flatnonzero(midi > treble_clef_above).tolist(),
+                 'F': np.flatnonzero(midi < bass_clef_below).tolist()}
+    changes = []
+    start, clef = 0, 'G'
+    while True:
+        candidates = crossings[clef]
+        i = bisect_left(candidates, start)
+        if i == len(candidates):
+            return changes
+        start = candidates[i]
+        changes.append((start, clef))
+        clef = 'F' if clef == 'G' else 'G'
+
+
+def apply_beams(notes: list, group_size: int, duration: str = 'eighth'):
+    """
+    Beam a staff's notes as beam_codes says, with the beam levels of duration. Unbeamed notes are left as they are.
+    """
+    if not notes:
+        return
+    values = BEAM_TUPLES[duration]
+    for n, code in zip(notes, beam_codes(durations_of(notes), group_size).tolist()):
+        if code != NO_BEAM:
+            n.beams = values[code]
+
+
+def clef_changes(notes: list, treble_clef_above: int, bass_clef_below: int, grid: int or None) -> list:
+    """
+    The (offset, clef) of each clef change for a staff's notes, each moved back to a multiple of grid beats.
+    """
+    changes = []
+    for index, clef in clef_change_indices(midi_of(notes), treble_clef_above, bass_clef_below):
+        offset = notes[index].offset
+        changes.append(((offset // grid) * grid if grid else offset, clef))
+    return changes
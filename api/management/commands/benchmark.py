@@ -0,0 +1,151 @@
+import json
+import platform
+import subprocess
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+from api.specs import MAJOR_TONICS, OCTAVES, STYLES, exercise_matrix
+
+
+class Command(BaseCommand):
+    help = ('Time exercise generation and rendering phase by phase, with peak memory. Results can be saved as JSON '
+            'and compared against an earlier run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--octaves', type=int, nargs='+', default=list(OCTAVES), choices=OCTAVES)
+        parser.add_argument('--style', nargs='+', default=list(STYLES), choices=STYLES)
+        parser.add_argument('--path', choices=('fast', 'music21', 'both'), default='fast',
+                            help='Render exercises with the direct writer, music21\'s exporter, or both')
+        parser.add_argument('--only', nargs='+', choices=('exercises', 'chords', 'random_note', 'grand_staff'),
+                            help='Run only these benchmark groups')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Compare against results saved earlier with --output')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='Slowdown ratio counted as a regression by --compare')
+
+    def run(self, results: dict, name: str, workload, repeat: int):
+        results[name] = benchmarks.measure(workload, repeat)
+
+    def handle(self, *args, **options):
+        groups = options['only'] or ('exercises', 'chords', 'random_note', 'grand_staff')
+        paths = ('fast', 'music21') if options['path'] == 'both' else (options['path'],)
+        repeat = options['repeat']
+        results = {}
+        start = time.perf_counter()
+
+        if 'exercises' in groups:
+            for spec in exercise_matrix(octaves=options['octaves'], styles=options['style']):
+                for path in paths:
+                    name = f'{spec.kind}/{spec.tonic}/{spec.quality}/{spec.style}/{spec.octaves}/{path}'
+                    self.run(results, name, benchmarks.exercise_workload(spec, path == 'fast'), repeat)
+
+        if 'chords' in groups:
+            for tonic in MAJOR_TONICS:
+                self.run(results, f'chords/{tonic}', benchmarks.chord_exercise_workload(tonic), repeat)
+
+        if 'random_note' in groups:
+            from django.test import Client
+            from django.test.utils import setup_test_environment, teardown_test_environment
+
+            from api import executor, flashcards
+
+            bucket = (7, 7, 'A0', 'C8', True)
+            self.run(results, 'random_note/job', benchmarks.random_note_job_workload(bucket), repeat)
+
+            # Through the view, as the pool and render executor serve it
+            setup_test_environment()
+            try:
+                params = {'max_sharps': 7, 'max_flats': 7, 'min_note': 'A0', 'max_note': 'C8'}
+                # Start the executor and fill the pool first, so only served requests are timed
+                client = Client()
+                client.get('/api/exercise/', params)
+                flashcards.get_pool().wait_for_refills()
+                self.run(results, 'random_note/request', benchmarks.random_note_workload(client, params), repeat)
+            finally:
+                teardown_test_environment()
+                flashcards.shutdown()
+                executor.shutdown()
+
+        if 'grand_staff' in groups:
+            self.run(results, 'create_grand_staff', benchmarks.grand_staff_workload(), repeat)
+
+        self.report(results)
+        self.stdout.write(f'{len(results)} benchmarks in {time.perf_counter() - start:.1f}s')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'meta': self.metadata(options), 'results': results}, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    @staticmethod
+    def metadata(options: dict) -> dict:
+        import music21
+        import numpy
+
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'music21': music21.__version__,
+            'numpy': numpy.__version__,
+            'options': {key: options[key] for key in ('octaves', 'style', 'path', 'only', 'repeat')},
+        }
+
+    def report(self, results: dict):
+        # Exercises are summarised per kind, quality, octaves and path; everything else is listed as is
+        groups = defaultdict(list)
+        for name, result in results.items():
+            parts = name.split('/')
+            if parts[0] in ('scale', 'arpeggio'):
+                kind, _tonic, quality, _style, octaves, path = parts
+                groups[f'{kind} {quality} {octaves}oct {path}'].append(result)
+            else:
+                groups[name].append(result)
+
+        self.stdout.write(f'{"benchmark":<32}{"total":>10}{"peak":>10}  phases (ms)')
+        for group, group_results in groups.items():
+            total = sum(r['total'] for r in group_results) / len(group_results)
+            peak = max(r['peak_memory'] for r in group_results)
+            phases = defaultdict(float)
+            for r in group_results:
+                for phase, seconds in r['phases'].items():
+                    phases[phase] += seconds / len(group_results)
+            phase_text = ', '.join(f'{phase} {seconds * 1000:.1f}' for phase, seconds in phases.items())
+            self.stdout.write(f'{group:<32}{total * 1000:>8.1f}ms{peak / 1024:>8.0f}KB  {phase_text}')
+
+    def compare(self, results: dict, path: str, threshold: float):
+        with open(path) as f:
+            baseline = json.load(f)['results']
+
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]
+            measures = [('total', before['total'], result['total'])]
+            measures += [(phase, before['phases'][phase], seconds)
+                         for phase, seconds in result['phases'].items() if before['phases'].get(phase)]
+            measures.append(('peak_memory', before['peak_memory'], result['peak_memory']))
+            for measure, old, new in measures:
+                if old and new / old > threshold:
+                    regressions.append(f'{name} {measure}: {old:.4g} -> {new:.4g} ({new / old:.2f}x)')
+
+        compared = len(results.keys() & baseline.keys())
+        self.stdout.write(f'Compared {compared} benchmarks with {path}')
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f'{len(regressions)} measurements regressed by more than {threshold}x')
@@ -0,0 +1,73 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter: loads the WSGI application the way a server worker would, then times the first
+# request to a page that doesn't need music21 and the first request to one that does.
+PROBE = '''
+import json, os, sys, time
+
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conbrio.settings')
+from conbrio.wsgi import application
+timings = {'startup': time.perf_counter() - start}
+
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+client = Client()
+
+start = time.perf_counter()
+client.get('/')
+timings['first_home'] = time.perf_counter() - start
+timings['music21_loaded_by_home'] = 'music21' in sys.modules
+
+start = time.perf_counter()
+client.get('/api/exercise/')
+timings['first_random_note'] = time.perf_counter() - start
+
+start = time.perf_counter()
+client.get('/api/exercise/')
+timings['second_random_note'] = time.perf_counter() - start
+
+print(json.dumps(timings))
+'''
+
+PHASES = ('startup', 'first_home', 'first_random_note', 'second_random_note')
+
+
+class Command(BaseCommand):
+    help = 'Measure worker startup and first-request latency with music21 loaded lazily (cold) and preloaded (warm).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters to start per mode')
+        parser.add_argument('--json', action='store_true', help='Print the median timings as JSON')
+
+    def probe(self, preload: bool) -> dict:
+        env = dict(os.environ, PRELOAD_MUSIC21=str(preload))
+        output = subprocess.run([sys.executable, '-c', PROBE], env=env, cwd=settings.BASE_DIR, check=True,
+                                capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode, preload in (('cold', False), ('warm', True)):
+            runs = [self.probe(preload) for _ in range(options['runs'])]
+            results[mode] = {phase: statistics.median(run[phase] for run in runs) for phase in PHASES}
+            results[mode]['music21_loaded_by_home'] = runs[0]['music21_loaded_by_home']
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f'{"":<20}{"cold":>10}{"warm":>10}')
+        for phase in PHASES:
+            self.stdout.write(f'{phase:<20}{results["cold"][phase] * 1000:>8.0f}ms'
+                              f'{results["warm"][phase] * 1000:>8.0f}ms')
+        self.stdout.write(f'{"music21 on home":<20}{str(results["cold"]["music21_loaded_by_home"]):>10}'
+                          f'{str(results["warm"]["music21_loaded_by_home"]):>10}')
@@ -0,0 +1,86 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import books, musicxml_writer
+from api.executor import _init_worker
+
+
+class Command(BaseCommand):
+    help = ('Render every exercise a syllabus lists, in parallel, into one merged MusicXML score or a directory of '
+            '.mxl files. An interrupted book is resumed by running the command again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('syllabus', help='JSON or YAML file listing the exercises (see api.books)')
+        parser.add_argument('output', help='The .musicxml file to write, or the directory to write .mxl files to')
+        parser.add_argument('--format', choices=('musicxml', 'mxl'),
+                            help='One merged score, or a .mxl file per exercise (default: from the output name)')
+        parser.add_argument('--workers', type=int, default=0, help='Worker processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Re-render exercises already written')
+
+    def handle(self, *args, **options):
+        try:
+            items = books.load_syllabus(options['syllabus'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Invalid syllabus {options["syllabus"]}: {e}')
+
+        output = options['output']
+        merged = (options['format'] or ('musicxml' if output.endswith(('.musicxml', '.xml')) else 'mxl')) == 'musicxml'
+        if merged and any(isinstance(item, books.ChordSeries) for item in items):
+            raise CommandError('Chord series can only be written as .mxl files (--format mxl)')
+        directory = books.parts_dir(output) if merged else output
+        path_of = books.part_path if merged else books.mxl_path
+        os.makedirs(directory, exist_ok=True)
+
+        todo = [item for item in items if options['force'] or not os.path.exists(path_of(directory, item))]
+        workers = min(options['workers'] or os.cpu_count(), len(todo)) or 1
+        start = time.perf_counter()
+        rendered, failed = self.render(books.lay_out if merged else books.render_mxl, todo, directory, path_of,
+                                       workers, options['verbosity'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} exercises in {elapsed:.1f}s ({rendered / elapsed:.1f} exercises/s on {workers} '
+            f'workers; {len(items) - len(todo)} already done, {failed} failed)'))
+        if failed:
+            raise CommandError(f'{failed} exercises failed; run the command again to retry them')
+
+        if merged:
+            chunks = musicxml_writer.iter_chunks(books.load_part(directory, item) for item in items)
+            books.write_atomically(output, ''.join(chunks).encode('utf-8'))
+            shutil.rmtree(directory)
+            self.stdout.write(f'Wrote {len(items)} exercises to {output}')
+
+    def render(self, job, todo: list, directory: str, path_of, workers: int, verbosity: int) -> tuple:
+        """
+        Render the exercises in todo with job in a pool of worker processes, saving each as it completes.
+
+        Returns (rendered, failed) counts.
+        """
+        rendered = failed = 0
+        if not todo:
+            return rendered, failed
+
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        futures = {pool.submit(job, item): item for item in todo}
+        try:
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'Failed to render {item}: {e!r}')
+                    continue
+                books.write_atomically(path_of(directory, item), data)
+                rendered += 1
+                if verbosity > 1:
+                    self.stdout.write(f'[{rendered + failed}/{len(todo)}] {item}')
+        except KeyboardInterrupt:
+            raise CommandError(f'Interrupted after {rendered} exercises; run the command again to resume')
+        finally:
+            pool.shutdown(cancel_futures=True)
+        return rendered, failed
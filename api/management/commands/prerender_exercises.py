@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import render_cache
+from api.specs import OCTAVES, STYLES, exercise_matrix
+
+
+class Command(BaseCommand):
+    help = ('Render every scale and arpeggio combination, with its playback formats, into the render cache, e.g. at '
+            'deploy time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--octaves', type=int, nargs='+', choices=OCTAVES, default=list(OCTAVES),
+                            help='Octave counts to render (default: all)')
+        parser.add_argument('--style', nargs='+', choices=STYLES, default=list(STYLES),
+                            help='Styles to render (default: all)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render exercises that are already cached')
+
+    def handle(self, *args, **options):
+        rendered = skipped = 0
+        failed = []
+        start = time.perf_counter()
+
+        for spec in exercise_matrix(octaves=options['octaves'], styles=options['style']):
+            if not options['force'] and render_cache.load(spec) is not None:
+                skipped += 1
+                continue
+            try:
+                render_cache.store(spec, *render_cache.render_formats(spec))
+            except Exception as e:
+                failed.append(spec)
+                self.stderr.write(f'Failed to render {spec}: {e!r}')
+                continue
+            rendered += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Rendered {spec}')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} exercises in {elapsed:.1f}s ({skipped} already cached, {len(failed)} failed)'))
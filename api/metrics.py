@@ -0,0 +1,261 @@
+"""
+Render instrumentation, exposed in the Prometheus text format at /metrics.
+
+``span(name)`` (or the ``timed(name)`` decorator) times a phase of a render, such as construction, beaming,
+fingering or xml_export, into the ``conbrio_phase_seconds`` histogram. Spans recorded while a job runs in one of
+``api.executor``'s worker processes are sent back with the job's result and recorded in the process that submitted
+it. ``metrics_middleware`` counts and times requests by route, records response sizes, and with
+``SERVER_TIMING`` set lists the request's spans in a ``Server-Timing`` header.
+
+Metrics are kept per server process; with several processes, scrape each of them.
+"""
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REGISTRY = []
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [count per bucket (the last for +Inf), sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def count(self, **labels) -> int:
+        counts = self.values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return sum(counts[0]) if counts else 0
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_value(bound)
+                yield f'{self.name}_bucket', {**labels, 'le': le}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Gauge:
+    """
+    A value read when metrics are scraped, from collect(), which returns a number or None to leave it out.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, help_text: str, collect):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def samples(self):
+        value = self.collect()
+        if value is not None:
+            yield self.name, {}, value
+
+
+def exposition() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+PHASE_SECONDS = Histogram('conbrio_phase_seconds', 'Time spent in each phase of rendering', ('phase',))
+REQUESTS = Counter('conbrio_requests_total', 'Requests handled', ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('conbrio_request_seconds', 'Time to handle a request', ('route',))
+RESPONSE_BYTES = Histogram('conbrio_response_bytes', 'Size of response bodies, except streamed ones', ('route',),
+                           buckets=BYTES_BUCKETS)
+EXERCISES = Counter('conbrio_exercises_total',
+                    'Exercises served, by type and cache outcome: hit or miss in the render cache or flashcard pool, '
+                    'worker when rendering is left to a worker\'s own memo, or not_modified when the client\'s '
+                    'copy is still current',
+                    ('kind', 'cache'))
+RENDER_ERRORS = Counter('conbrio_render_errors_total', 'Renders refused or abandoned', ('reason',))
+
+
+class Timings:
+    """
+    The spans recorded while handling a request, or while running a job in a worker process. If not observe, they
+    are only collected, to be recorded by the process the job's result is sent back to.
+    """
+
+    def __init__(self, observe: bool = True):
+        self.observe = observe
+        self.spans = []
+
+    def totals(self) -> dict:
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0) + seconds
+        return totals
+
+
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def record_span(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings.spans.append((name, seconds))
+    if timings is None or timings.observe:
+        PHASE_SECONDS.observe(seconds, phase=name)
+
+
+def record_remote_spans(spans: list):
+    """
+    Record spans sent back from a worker process.
+    """
+    for name, seconds in spans:
+        PHASE_SECONDS.observe(seconds, phase=name)
+
+
+def add_to_timings(spans: list):
+    """
+    List spans already recorded (e.g. by record_remote_spans) in the current request's Server-Timing.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.spans.extend(spans)
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """
+    Decorate a function so each call is recorded as a span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def collect(observe: bool = True):
+    timings = Timings(observe)
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing(timings: Timings, total: float) -> str:
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.totals().items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def record_request(request, response, timings: Timings, seconds: float):
+    route = request.resolver_match.route if request.resolver_match else 'unmatched'
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    REQUEST_SECONDS.observe(seconds, route=route)
+    if not response.streaming:
+        RESPONSE_BYTES.observe(len(response.content), route=route)
+    if settings.SERVER_TIMING:
+        response['Server-Timing'] = server_timing(timings, seconds)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            start = time.perf_counter()
+            with collect() as timings:
+                response = await get_response(request)
+            record_request(request, response, timings, time.perf_counter() - start)
+            return response
+    else:
+        def middleware(request):
+            start = time.perf_counter()
+            with collect() as timings:
+                response = get_response(request)
+            record_request(request, response, timings, time.perf_counter() - start)
+            return response
+
+    return middleware
@@ -0,0 +1,307 @@
+"""
+Direct MusicXML serializer for generated exercises.
+
+Writes a ``CompactScore`` as a single partwise part with one staff per ``CompactStaff``, the way music21's
+``GeneralObjectExporter`` writes a grand staff, but without building measures or walking a music21 object graph.
+Anything it can't express raises ``UnsupportedScore`` so callers can fall back to the music21 exporter; ``check``
+finds out before anything is written.
+
+The MusicXML is produced a measure at a time by ``iter_chunks``, so it can be streamed to a client as it is written.
+``iter_chunks`` also writes several exercises one after another as a single score, each on a new system.
+"""
+import math
+from fractions import Fraction
+from xml.sax.saxutils import escape
+
+from .accidentals import SpelledPitch, update_accidental_display
+from .notation import CompactScore, UnsupportedScore
+
+NOTE_TYPES = (
+    (Fraction(4), 'whole'),
+    (Fraction(2), 'half'),
+    (Fraction(1), 'quarter'),
+    (Fraction(1, 2), 'eighth'),
+    (Fraction(1, 4), '16th'),
+    (Fraction(1, 8), '32nd'),
+    (Fraction(1, 16), '64th'),
+)
+# Quarter length -> (type, dots)
+DURATION_TYPES = {}
+for _length, _type in NOTE_TYPES:
+    DURATION_TYPES[_length] = (_type, 0)
+    DURATION_TYPES[_length * Fraction(3, 2)] = (_type, 1)
+    DURATION_TYPES[_length * Fraction(7, 4)] = (_type, 2)
+
+ACCIDENTALS = {-2: 'flat-flat', -1: 'flat', 0: 'natural', 1: 'sharp', 2: 'double-sharp'}
+CLEF_LINES = {'G': 2, 'F': 4}
+SHARP_ORDER = 'FCGDAEB'
+
+HEADER = ('<?xml version="1.0" encoding="utf-8"?>\n'
+          '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.1 Partwise//EN" '
+          '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+          '<score-partwise version="3.1">\n'
+          '<identification><encoding><software>conbrio</software></encoding></identification>\n'
+          '<defaults><scaling><millimeters>7</millimeters><tenths>40</tenths></scaling></defaults>\n'
+          '<part-list><score-part id="P1"><part-name /></score-part></part-list>\n'
+          '<part id="P1">\n')
+FOOTER = '</part>\n</score-partwise>\n'
+
+
+def key_alters(fifths: int or None) -> dict:
+    """
+    The alteration the key signature applies to each step, e.g. {'F': 1, 'C': 1} for D major.
+    """
+    alters = {step: 0 for step in SHARP_ORDER}
+    if fifths:
+        steps = SHARP_ORDER[:fifths] if fifths > 0 else SHARP_ORDER[::-1][:-fifths]
+        for step in steps:
+            alters[step] = 1 if fifths > 0 else -1
+    return alters
+
+
+def duration_type(length: Fraction) -> tuple:
+    try:
+        return DURATION_TYPES[length]
+    except KeyError:
+        raise UnsupportedScore(f'No note type for quarter length {length}')
+
+
+def pitch_xml(n) -> str:
+    alter = f'<alter>{n.alter}</alter>' if n.alter else ''
+    return f'<step>{n.step}</step>{alter}<octave>{n.octave}</octave>'
+
+
+def accidental_xml(n, shown: bool) -> str:
+    if not shown:
+        return ''
+    if n.alter not in ACCIDENTALS:
+        raise UnsupportedScore(f'Unsupported alteration {n.alter}')
+    return f'<accidental>{ACCIDENTALS[n.alter]}</accidental>'
+
+
+def fingering_xml(n) -> str:
+    if n.fingering is None:
+        return ''
+    return f'<notations><technical><fingering>{escape(n.fingering)}</fingering></technical></notations>'
+
+
+def show_accidental(n, past: list, past_measure: list, alters: dict) -> bool:
+    """
+    Decide accidental display the way music21's ``makeNotation`` does, recording the pitch in ``past``.
+    """
+    p = SpelledPitch(n.step, n.alter, n.octave)
+    update_accidental_display(p, past, past_measure, alters)
+    past.append(p)
+    return p.has_accidental and p.display is True
+
+
+def hidden_rest_lengths(length: Fraction):
+    """
+    Split a gap into the fewest undotted note values, largest first.
+    """
+    while length > 0:
+        for value, _type in NOTE_TYPES:
+            if value <= length:
+                yield value
+                length -= value
+                break
+        else:
+            raise UnsupportedScore(f'Cannot fill a gap of {length} quarter lengths with rests')
+
+
+class MusicXMLWriter:
+    def __init__(self, score: CompactScore, first_measure: int = 1, final: bool = True):
+        """
+        Parameters:
+            score (CompactScore): The exercise to write.
+            first_measure (int): The number of its first measure. Later exercises in a score start on a new system.
+            final (bool): Whether the exercise ends the score, with a final barline rather than a double bar.
+        """
+        self.score = score
+        self.first_measure = first_measure
+        self.final = final
+        beats, beat_type = score.time_signature
+        self.measure_length = Fraction(4 * beats, beat_type)
+        self.key_alters = key_alters(score.fifths)
+
+        lengths = [n.duration for staff in score.staves for n in staff.notes]
+        offsets = [n.offset for staff in score.staves for n in staff.notes]
+        offsets.extend(offset for staff in score.staves for offset, _clef in staff.clef_changes)
+        self.divisions = math.lcm(1, *(Fraction(x).denominator for x in lengths + offsets))
+
+        end = max((n.offset + n.duration for staff in score.staves for n in staff.notes), default=0)
+        self.measure_count = max(1, math.ceil(end / self.measure_length))
+
+    def ticks(self, length: Fraction) -> int:
+        return int(length * self.divisions)
+
+    def check(self):
+        """
+        Raise UnsupportedScore if the score can't be written, without writing it.
+        """
+        if self.score.tempo:
+            duration_type(self.score.tempo[0])
+        end = self.measure_count * self.measure_length
+        for staff in self.score.staves:
+            position = Fraction(0)
+            for n in staff.notes:
+                duration_type(n.duration)
+                if n.alter not in ACCIDENTALS:
+                    raise UnsupportedScore(f'Unsupported alteration {n.alter}')
+                if n.offset < position:
+                    raise UnsupportedScore('Overlapping notes are not supported')
+                if n.offset + n.duration > (n.offset // self.measure_length + 1) * self.measure_length:
+                    raise UnsupportedScore('Notes across barlines are not supported')
+                self.check_gap(position, n.offset)
+                position = n.offset + n.duration
+            self.check_gap(position, end)
+
+    def check_gap(self, start: Fraction, end: Fraction):
+        while start < end:
+            barline = (start // self.measure_length + 1) * self.measure_length
+            list(hidden_rest_lengths(min(end, barline) - start))
+            start = barline
+
+    def iter_measures(self):
+        """
+        Yield the MusicXML for each measure in turn.
+        """
+        staves = []
+        for staff in self.score.staves:
+            staves.append((iter(staff.notes), iter(staff.clef_changes)))
+        pending = [[next(notes, None), next(clef_changes, None)] for notes, clef_changes in staves]
+        # Pitches already written in the previous measure of each staff, for accidental display
+        past_measures = [[] for _staff in staves]
+
+        for number in range(self.measure_count):
+            start = number * self.measure_length
+            end = start + self.measure_length
+            parts = [f'<measure number="{self.first_measure + number}">\n']
+            if number == 0:
+                if self.first_measure > 1:
+                    parts.append('<print new-system="yes" />\n')
+                parts.append(self.first_attributes())
+                if self.score.tempo:
+                    parts.append(self.tempo_direction())
+
+            for index, ((notes, clef_changes), current) in enumerate(zip(staves, pending)):
+                if index > 0:
+                    parts.append(f'<backup><duration>{self.ticks(self.measure_length)}</duration></backup>\n')
+                past = []
+                position = start
+                while current[0] is not None and current[0].offset < end:
+                    n = current[0]
+                    if n.offset + n.duration > end:
+                        raise UnsupportedScore('Notes across barlines are not supported')
+                    if n.offset < position:
+                        raise UnsupportedScore('Overlapping notes are not supported')
+                    while current[1] is not None and current[1][0] <= n.offset:
+                        parts.append(self.clef_change(index + 1, current[1][1]))
+                        current[1] = next(clef_changes, None)
+                    parts.extend(self.hidden_rests(n.offset - position, index + 1))
+                    parts.append(self.note(n, index + 1, past, past_measures[index]))
+                    position = n.offset + n.duration
+                    current[0] = next(notes, None)
+                parts.extend(self.hidden_rests(end - position, index + 1))
+                past_measures[index] = past
+
+            if number == self.measure_count - 1:
+                bar_style = 'light-heavy' if self.final else 'light-light'
+                parts.append(f'<barline location="right"><bar-style>{bar_style}</bar-style></barline>\n')
+            parts.append('</measure>\n')
+            yield ''.join(parts)
+
+    def iter_chunks(self):
+        yield HEADER
+        yield from self.iter_measures()
+        yield FOOTER
+
+    def write(self) -> str:
+        return ''.join(self.iter_chunks())
+
+    def first_attributes(self) -> str:
+        beats, beat_type = self.score.time_signature
+        parts = [f'<attributes><divisions>{self.divisions}</divisions>']
+        if self.score.fifths is not None:
+            parts.append(f'<key><fifths>{self.fifths()}</fifths></key>')
+        print_object = '' if self.score.show_time_signature else ' print-object="no"'
+        parts.append(f'<time{print_object}><beats>{beats}</beats><beat-type>{beat_type}</beat-type></time>')
+        parts.append(f'<staves>{len(self.score.staves)}</staves>')
+        for number, staff in enumerate(self.score.staves, start=1):
+            parts.append(self.clef(number, staff.clef))
+        parts.append('</attributes>\n')
+        return ''.join(parts)
+
+    def tempo_direction(self) -> str:
+        referent, per_minute = self.score.tempo
+        beat_unit, dots = duration_type(referent)
+        quarter_tempo = per_minute * referent
+        if quarter_tempo == int(quarter_tempo):
+            quarter_tempo = int(quarter_tempo)
+        return ('<direction placement="above"><direction-type><metronome parentheses="no">'
+                f'<beat-unit>{beat_unit}</beat-unit>{"<beat-unit-dot />" * dots}<per-minute>{per_minute}</per-minute>'
+                f'</metronome></direction-type><staff>1</staff><sound tempo="{quarter_tempo}" /></direction>\n')
+
+    @staticmethod
+    def clef(number: int, sign: str) -> str:
+        return f'<clef number="{number}"><sign>{sign}</sign><line>{CLEF_LINES[sign]}</line></clef>'
+
+    def clef_change(self, number: int, sign: str) -> str:
+        return f'<attributes>{self.clef(number, sign)}</attributes>\n'
+
+    def hidden_rests(self, length: Fraction, staff: int):
+        for value in hidden_rest_lengths(length):
+            _type, dots = duration_type(value)
+            yield (f'<note print-object="no"><rest /><duration>{self.ticks(value)}</duration>'
+                   f'<voice>{staff}</voice><type>{_type}</type><staff>{staff}</staff></note>\n')
+
+    # The parts of the score that depend on its key and spelling, which api.score_templates leaves as slots
+
+    def fifths(self) -> str:
+        return str(self.score.fifths)
+
+    def pitch(self, n) -> str:
+        return pitch_xml(n)
+
+    def accidental(self, n, past: list, past_measure: list) -> str:
+        return accidental_xml(n, show_accidental(n, past, past_measure, self.key_alters))
+
+    def fingering(self, n) -> str:
+        return fingering_xml(n)
+
+    def note(self, n, staff: int, past: list, past_measure: list) -> str:
+        _type, dots = duration_type(n.duration)
+        parts = ['<note><pitch>', self.pitch(n),
+                 f'</pitch><duration>{self.ticks(n.duration)}</duration><voice>{staff}</voice><type>{_type}</type>'
+                 f'{"<dot />" * dots}',
+                 self.accidental(n, past, past_measure),
+                 f'<staff>{staff}</staff>']
+        for level, value in enumerate(n.beams, start=1):
+            parts.append(f'<beam number="{level}">{value}</beam>')
+        parts.append(self.fingering(n))
+        parts.append('</note>\n')
+        return ''.join(parts)
+
+
+def write(score: CompactScore) -> str:
+    return MusicXMLWriter(score).write()
+
+
+def iter_chunks(scores):
+    """
+    Yield the MusicXML of a score made of several exercises, one after another, a measure at a time.
+
+    Parameters:
+        scores: CompactScores, e.g. a generator yielding each as it is rendered.
+    """
+    yield HEADER
+    scores = iter(scores)
+    score = next(scores, None)
+    first_measure = 1
+    while score is not None:
+        following = next(scores, None)
+        writer = MusicXMLWriter(score, first_measure, final=following is None)
+        yield from writer.iter_measures()
+        first_measure += writer.measure_count
+        score = following
+    yield FOOTER
@@ -0,0 +1,155 @@
+"""
+Compact note data for generated exercises.
+
+Exercises are built as flat lists of ``NoteRecord``s rather than music21 notes: transposing and doubling a hand is
+integer arithmetic on step, alteration and octave. A ``CompactScore`` holds just what a grand-staff exercise needs
+to be written out as MusicXML: a key, a time signature, an optional tempo, and for each staff a clef, its clef
+changes and its notes. ``api.musicxml_writer`` serializes it directly, and ``Exercise.materialize`` turns it into
+music21 objects only when the music21 exporter is needed.
+"""
+import re
+from dataclasses import dataclass, field
+from fractions import Fraction
+
+STEPS = 'CDEFGAB'
+NATURAL_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+# Beam levels for each note value, as music21's Beams.fill names them
+BEAM_LEVELS = {'eighth': 1, '16th': 2, '32nd': 3, '64th': 4}
+
+# Semitones in each simple interval of a major scale, by generic size
+MAJOR_INTERVAL_SEMITONES = {1: 0, 2: 2, 3: 4, 4: 5, 5: 7, 6: 9, 7: 11}
+PERFECT_SIZES = (1, 4, 5)
+INTERVAL_NAME = re.compile(r'^(-?)(d+|m|M|P|p|A+|a+)(\d+)$')
+
+
+class UnsupportedScore(Exception):
+    """
+    Raised for exercise content the compact representation or the direct writer can't express.
+    """
+
+
+def interval_steps(i) -> tuple:
+    """
+    The (diatonic steps, semitones) an interval moves a pitch by.
+
+    Parameters:
+        i (str or music21.interval.Interval): An interval such as 'M3', 'p5' or '-p8'.
+    """
+    if not isinstance(i, str):
+        directed = i.generic.directed
+        return directed - 1 if directed > 0 else directed + 1, int(i.semitones)
+
+    match = INTERVAL_NAME.match(i)
+    if not match:
+        raise ValueError(f'Invalid interval: {i}')
+    sign, quality, number = match.groups()
+    number = int(number)
+    if number < 1:
+        raise ValueError(f'Invalid interval: {i}')
+
+    octaves, simple = divmod(number - 1, 7)
+    semitones = MAJOR_INTERVAL_SEMITONES[simple + 1] + 12 * octaves
+    if simple + 1 in PERFECT_SIZES:
+        if quality in ('m', 'M'):
+            raise ValueError(f'Invalid interval: {i}')
+        adjustments = {'P': 0, 'p': 0, 'A': len(quality), 'a': len(quality), 'd': -len(quality)}
+    else:
+        if quality in ('P', 'p'):
+            raise ValueError(f'Invalid interval: {i}')
+        adjustments = {'M': 0, 'm': -1, 'A': len(quality), 'a': len(quality), 'd': -1 - len(quality)}
+    semitones += adjustments[quality[0]]
+
+    steps = number - 1
+    if sign:
+        return -steps, -semitones
+    return steps, semitones
+
+
+class NoteRecord:
+    __slots__ = ('step', 'alter', 'octave', 'duration', 'offset', 'beams', 'fingering')
+
+    def __init__(self, step: str, alter: int, octave: int, duration: Fraction, offset: Fraction = Fraction(0),
+                 beams: tuple = (), fingering: str or None = None):
+        self.step = step
+        self.alter = alter
+        self.octave = octave
+        self.duration = duration
+        self.offset = offset
+        self.beams = beams  # MusicXML beam values, one per level
+        self.fingering = fingering
+
+    def __repr__(self):
+        return f'<NoteRecord {self.step}{"#" * self.alter or "-" * -self.alter}{self.octave} {self.duration}>'
+
+    @classmethod
+    def from_pitch(cls, p, duration: Fraction) -> 'NoteRecord':
+        """
+        Parameters:
+            p (music21.pitch.Pitch): The pitch to spell the note with.
+            duration (Fraction): The note's length in quarter notes.
+        """
+        alter = p.accidental.alter if p.accidental else 0
+        if alter != int(alter):
+            raise UnsupportedScore(f'Microtonal pitch {p}')
+        return cls(p.step, int(alter), p.octave, duration)
+
+    @property
+    def midi(self) -> int:
+        return 12 * (self.octave + 1) + NATURAL_SEMITONES[self.step] + self.alter
+
+    @property
+    def name_with_octave(self) -> str:
+        return f'{self.step}{"#" * self.alter or "-" * -self.alter}{self.octave}'
+
+    def copy(self) -> 'NoteRecord':
+        return NoteRecord(self.step, self.alter, self.octave, self.duration, self.offset, self.beams,
+                          self.fingering)
+
+    def transposed(self, steps: int, semitones: int) -> 'NoteRecord':
+        """
+        A new note of the same length, moved by the given diatonic steps and semitones (see ``interval_steps``).
+        """
+        octave, index = divmod(self.octave * 7 + STEPS.index(self.step) + steps, 7)
+        step = STEPS[index]
+        alter = self.midi + semitones - 12 * (octave + 1) - NATURAL_SEMITONES[step]
+        return NoteRecord(step, alter, octave, self.duration)
+
+
+@dataclass
+class CompactStaff:
+    clef: str or None  # 'G' or 'F'
+    notes: list = field(default_factory=list)
+    clef_changes: list = field(default_factory=list)  # (offset, clef) pairs in offset order
+
+    def append(self, notes: list):
+        """
+        Place notes one after another at the end of the staff.
+        """
+        offset = self.notes[-1].offset + self.notes[-1].duration if self.notes else Fraction(0)
+        for n in notes:
+            n.offset = offset
+            offset += n.duration
+            self.notes.append(n)
+
+    def transposed(self, steps: int, semitones: int) -> 'CompactStaff':
+        """
+        A copy of the staff with every note moved by the given diatonic steps and semitones. Clef changes and
+        fingering depend on the pitches, so are left out; beams are kept.
+        """
+        staff = CompactStaff(self.clef)
+        for n in self.notes:
+            moved = n.transposed(steps, semitones)
+            moved.offset = n.offset
+            moved.beams = n.beams
+            staff.notes.append(moved)
+        return staff
+
+
+@dataclass
+class CompactScore:
+    staves: list
+    fifths: int or None = None
+    time_signature: tuple = (4, 4)  # (beats, beat type)
+    show_time_signature: bool = True
+    tempo: tuple or None = None  # (referent quarter length, beats per minute)
@@ -0,0 +1,231 @@
+"""
+Content negotiation for rendered scores.
+
+Besides the default JSON ``{"xml": ...}``, a score can be requested as raw MusicXML
+(``application/vnd.recordare.musicxml+xml``) or compressed MusicXML (``application/vnd.recordare.musicxml``, a .mxl
+zip), with ``?format=json|musicxml|mxl`` or the Accept header. JSON and raw MusicXML are gzip or brotli compressed
+for clients that accept it. Brotli needs the optional ``brotli`` package.
+
+Exercises can also be played back: ``?format=midi`` (or ``Accept: audio/midi``) is a Standard MIDI File, and
+``?format=events`` a JSON list of note events (see ``api.playback``).
+
+Each combination is a ``Payload`` variant, such as 'musicxml.gz' or 'mxl', whose bytes can be cached with the
+render (see ``api.render_cache.load_variant``) so they are encoded once per exercise.
+
+JSON and raw MusicXML can also be streamed, encoding and compressing a score's chunks as they are written
+(``Payload.stream``). A .mxl zip and the playback formats can't be streamed.
+"""
+import gzip
+import io
+import json
+import zipfile
+import zlib
+from dataclasses import dataclass
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MUSICXML_TYPE = 'application/vnd.recordare.musicxml+xml'
+MXL_TYPE = 'application/vnd.recordare.musicxml'
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'musicxml': f'{MUSICXML_TYPE}; charset=utf-8',
+    'mxl': MXL_TYPE,
+    'midi': 'audio/midi',
+    'events': 'application/json',
+}
+FORMATS_BY_MEDIA_TYPE = {'application/json': 'json', MUSICXML_TYPE: 'musicxml', MXL_TYPE: 'mxl', 'audio/midi': 'midi'}
+SCORE_FORMATS = ('json', 'musicxml', 'mxl')
+PLAYBACK_FORMATS = ('midi', 'events')
+# Formats that are already compressed, or too small to be worth it
+UNCOMPRESSED_FORMATS = ('mxl', 'midi')
+ENCODING_SUFFIXES = {'br': 'br', 'gzip': 'gz'}
+# Every Payload.variant
+VARIANTS = ('json', 'json.gz', 'json.br', 'musicxml', 'musicxml.gz', 'musicxml.br', 'mxl', 'midi', 'events',
+            'events.gz', 'events.br')
+
+MXL_CONTAINER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<container>\n'
+                 '  <rootfiles>\n'
+                 '    <rootfile full-path="score.musicxml" media-type="application/vnd.recordare.musicxml+xml"/>\n'
+                 '  </rootfiles>\n'
+                 '</container>\n')
+
+
+def parse_quality_list(header: str) -> dict:
+    """
+    The q-value of each item in an Accept or Accept-Encoding header, e.g. {'gzip': 1.0, 'br': 0.5}.
+    """
+    qualities = {}
+    for item in header.split(','):
+        value, *params = [part.strip() for part in item.split(';')]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, number = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        qualities[value.lower()] = max(q, qualities.get(value.lower(), 0.0))
+    return qualities
+
+
+def negotiate_format(request, formats: tuple) -> str:
+    requested = request.GET.get('format')
+    if requested is not None:
+        if requested not in formats:
+            raise ValueError(f'format must be one of {", ".join(formats)}')
+        return requested
+
+    accept = parse_quality_list(request.headers.get('Accept', ''))
+    best, best_q = formats[0], 0.0
+    for media_type, fmt in FORMATS_BY_MEDIA_TYPE.items():
+        if fmt in formats and accept.get(media_type, 0.0) > best_q:
+            best, best_q = fmt, accept[media_type]
+    return best
+
+
+def negotiate_encoding(request) -> str or None:
+    accept = parse_quality_list(request.headers.get('Accept-Encoding', ''))
+    wildcard = accept.get('*', 0.0)
+    gzip_q = accept.get('gzip', wildcard)
+    br_q = accept.get('br', wildcard) if brotli is not None else 0.0
+    if br_q > 0 and br_q >= gzip_q:
+        return 'br'
+    if gzip_q > 0:
+        return 'gzip'
+    return None
+
+
+def mxl(xml: str) -> bytes:
+    """
+    Zip MusicXML into a compressed .mxl file. The archive's timestamps are fixed, so the same score always gives
+    the same bytes.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        # The mimetype entry must come first and be stored uncompressed
+        archive.writestr(zipfile.ZipInfo('mimetype'), MXL_TYPE, compress_type=zipfile.ZIP_STORED)
+        archive.writestr(zipfile.ZipInfo('META-INF/container.xml'), MXL_CONTAINER, compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr(zipfile.ZipInfo('score.musicxml'), xml, compress_type=zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def compress(data: bytes, encoding: str or None, best: bool = False) -> bytes:
+    """
+    Compress data for a Content-Encoding, as small as possible if best (for bodies that are cached), otherwise at
+    a level fast enough to use on every request.
+    """
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return data
+
+
+def iter_compressed(chunks, encoding: str or None):
+    """
+    Compress a stream of bytes for a Content-Encoding, flushing after each chunk so it can be sent straight away.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        yield from chunks
+
+
+@dataclass(frozen=True)
+class Payload:
+    format: str = 'json'
+    encoding: str or None = None
+
+    @classmethod
+    def from_request(cls, request, formats: tuple = SCORE_FORMATS) -> 'Payload':
+        """
+        The payload a request asked for. Raises ValueError for a format parameter not in formats.
+        """
+        fmt = negotiate_format(request, formats)
+        return cls(fmt, negotiate_encoding(request) if fmt not in UNCOMPRESSED_FORMATS else None)
+
+    @property
+    def variant(self) -> str:
+        if self.encoding is None:
+            return self.format
+        return f'{self.format}.{ENCODING_SUFFIXES[self.encoding]}'
+
+    def encode(self, xml: str, fields: dict or None = None, best: bool = False) -> bytes:
+        """
+        The response body for a score.
+
+        Parameters:
+            xml (str): The score's MusicXML.
+            fields (dict or None): Other fields to include in JSON.
+            best (bool): Compress as much as possible, for a body that will be cached.
+        """
+        if self.format == 'mxl':
+            return mxl(xml)
+        if self.format == 'json':
+            data = json.dumps({**(fields or {}), 'xml': xml}).encode('utf-8')
+        else:
+            data = xml.encode('utf-8')
+        return compress(data, self.encoding, best)
+
+    def encode_playback(self, data: bytes, best: bool = False) -> bytes:
+        """
+        The response body for a playback format, as api.playback renders it.
+        """
+        return compress(data, self.encoding, best)
+
+    def stream(self, chunks, fields: dict or None = None):
+        """
+        The response body for a score written in chunks, encoded chunk by chunk.
+
+        Parameters:
+            chunks: The score's MusicXML, in pieces of str.
+            fields (dict or None): Other fields to include in JSON.
+        """
+        if self.format == 'mxl':
+            raise ValueError('.mxl scores cannot be streamed')
+        return iter_compressed(self.iter_encoded(chunks, fields), self.encoding)
+
+    def iter_encoded(self, chunks, fields: dict or None):
+        if self.format == 'json':
+            # The object up to the opening quote of the xml string, e.g. '{"xml": "'
+            yield json.dumps({**(fields or {}), 'xml': ''})[:-2].encode('utf-8')
+            for chunk in chunks:
+                yield json.dumps(chunk)[1:-1].encode('utf-8')
+            yield b'"}'
+        else:
+            for chunk in chunks:
+                yield chunk.encode('utf-8')
+
+    def response(self, body: bytes) -> HttpResponse:
+        return self.with_headers(HttpResponse(body, content_type=CONTENT_TYPES[self.format]))
+
+    def streaming_response(self, body) -> StreamingHttpResponse:
+        return self.with_headers(StreamingHttpResponse(body, content_type=CONTENT_TYPES[self.format]))
+
+    def with_headers(self, response):
+        if self.encoding is not None:
+            response['Content-Encoding'] = self.encoding
+        if self.format == 'mxl':
+            response['Content-Disposition'] = 'inline; filename="score.mxl"'
+        elif self.format == 'midi':
+            response['Content-Disposition'] = 'inline; filename="score.mid"'
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
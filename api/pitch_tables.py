@@ -0,0 +1,135 @@
+"""
+Precomputed pitch tables for random note selection.
+
+Each of the 15 key signatures (and the chromatic scale) has a ``PitchTable``: every pitch of its major scale from
+A0 to C8, spelled as music21 spells it, held in parallel NumPy arrays sorted by pitch. Picking random notes in a
+range is then a binary search for the range and an array draw, without building music21 scales or pitches.
+"""
+import os
+import re
+
+import numpy as np
+
+from .notation import NATURAL_SEMITONES, STEPS
+
+LOWEST_MIDI = 21  # A0
+HIGHEST_MIDI = 108  # C8
+SHARP_ORDER = 'FCGDAEB'
+
+# How music21's ChromaticScale('C') spells each pitch class, from C4 up; below C4 it spells A-flat as G-sharp
+CHROMATIC_SPELLINGS = (('C', 0), ('C', 1), ('D', 0), ('E', -1), ('E', 0), ('F', 0), ('F', 1), ('G', 0), ('A', -1),
+                       ('A', 0), ('B', -1), ('B', 0))
+
+PITCH_NAME = re.compile(r'^([A-Ga-g])([#b\-]*)(\d+)$')
+
+_rng = np.random.default_rng()
+
+
+def _reseed():
+    # Forked workers would otherwise all draw the same "random" notes
+    global _rng
+    _rng = np.random.default_rng()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reseed)
+
+
+def parse_midi(name: str) -> int:
+    """
+    The MIDI number of a pitch name such as 'A0', 'F#3', 'Bb4' or music21's 'B-4'.
+    """
+    match = PITCH_NAME.match(name.strip())
+    if not match:
+        raise ValueError(f'Invalid pitch: {name!r}')
+    step, accidentals, octave = match.groups()
+    alter = accidentals.count('#') - accidentals.count('b') - accidentals.count('-')
+    return 12 * (int(octave) + 1) + NATURAL_SEMITONES[step.upper()] + alter
+
+
+class PitchTable:
+    """
+    Parallel arrays of step index (into STEPS), alteration, octave and MIDI number, sorted by MIDI number.
+    """
+    __slots__ = ('steps', 'alters', 'octaves', 'midi')
+
+    def __init__(self, spellings: list):
+        spellings.sort(key=lambda s: s[3])
+        self.steps = np.array([s[0] for s in spellings], dtype=np.int8)
+        self.alters = np.array([s[1] for s in spellings], dtype=np.int8)
+        self.octaves = np.array([s[2] for s in spellings], dtype=np.int8)
+        self.midi = np.array([s[3] for s in spellings], dtype=np.int16)
+
+    @classmethod
+    def for_key(cls, sharps: int) -> 'PitchTable':
+        alters = {step: 0 for step in STEPS}
+        for step in SHARP_ORDER[:sharps] if sharps > 0 else SHARP_ORDER[::-1][:-sharps]:
+            alters[step] = 1 if sharps > 0 else -1
+
+        spellings = []
+        for octave in range(-1, 10):
+            for index, step in enumerate(STEPS):
+                midi = 12 * (octave + 1) + NATURAL_SEMITONES[step] + alters[step]
+                if LOWEST_MIDI <= midi <= HIGHEST_MIDI:
+                    spellings.append((index, alters[step], octave, midi))
+        return cls(spellings)
+
+    @classmethod
+    def chromatic(cls) -> 'PitchTable':
+        spellings = []
+        for midi in range(LOWEST_MIDI, HIGHEST_MIDI + 1):
+            step, alter = CHROMATIC_SPELLINGS[midi % 12]
+            if step == 'A' and alter == -1 and midi < 60:
+                step, alter = 'G', 1
+            spellings.append((STEPS.index(step), alter, midi // 12 - 1, midi))
+        return cls(spellings)
+
+    def between(self, min_midi: int, max_midi: int) -> slice:
+        """
+        The slice of the table from min_midi to max_midi inclusive.
+        """
+        return slice(int(np.searchsorted(self.midi, min_midi, side='left')),
+                     int(np.searchsorted(self.midi, max_midi, side='right')))
+
+
+KEY_TABLES = {sharps: PitchTable.for_key(sharps) for sharps in range(-7, 8)}
+CHROMATIC_TABLE = PitchTable.chromatic()
+
+
+def candidate_count(min_note: str, max_note: str, sharps: int or None = None) -> int:
+    """
+    How many pitches random_pitches can draw between two notes, for a key signature or the chromatic scale.
+    """
+    table = CHROMATIC_TABLE if sharps is None else KEY_TABLES[sharps]
+    candidates = table.between(parse_midi(min_note), parse_midi(max_note))
+    return max(candidates.stop - candidates.start, 0)
+
+
+def random_pitches(min_note: str, max_note: str, accidentals: bool, sharps: int or None = None, count: int = 1,
+                   rng: np.random.Generator or None = None) -> tuple:
+    """
+    Draw random pitches between two notes, as music21's generate_random_note would.
+
+    Parameters:
+        min_note (str): The lowest pitch that may be drawn, e.g. 'A0'.
+        max_note (str): The highest pitch that may be drawn, e.g. 'C8'.
+        accidentals (bool): Replace each pitch's alteration with a random one from double flat to double sharp.
+        sharps (int or None): Draw from this key signature's major scale, or the chromatic scale if None.
+        count (int): How many pitches to draw, with replacement.
+        rng (numpy.random.Generator or None): Random generator to draw with.
+
+    Returns a tuple of arrays (step indices into STEPS, alterations, octaves, MIDI numbers).
+    """
+    table = CHROMATIC_TABLE if sharps is None else KEY_TABLES[sharps]
+    rng = rng or _rng
+    candidates = table.between(parse_midi(min_note), parse_midi(max_note))
+    if candidates.start >= candidates.stop:
+        raise ValueError(f'No pitches between {min_note} and {max_note}')
+
+    picks = rng.integers(candidates.start, candidates.stop, size=count)
+    steps, alters, octaves, midi = table.steps[picks], table.alters[picks], table.octaves[picks], table.midi[picks]
+    if accidentals:
+        new_alters = rng.integers(-2, 3, size=count).astype(np.int8)
+        midi = midi - alters + new_alters
+        alters = new_alters
+    return steps, alters, octaves, midi
@@ -0,0 +1,137 @@
+"""
+Playback formats for exercises: a Standard MIDI File and a compact JSON event list.
+
+Both are made from the exercise's note records, the same build its MusicXML is written from, at the tempo of its
+metronome mark, so a client can play an exercise without parsing and synthesizing its score. They are rendered with
+the MusicXML and cached alongside it as the 'midi' and 'events' variants (see ``api.render_cache``).
+
+A note is (onset, MIDI number, duration, hand), onset and duration in quarter notes, hand 'right', 'left' or None.
+The event list is::
+
+    {"tempo": 220, "columns": ["onset", "pitch", "duration", "hand"], "events": [[0, 60, 0.545, "right"], ...]}
+
+with the tempo in quarter notes a minute and onsets and durations in seconds.
+"""
+import json
+import struct
+from fractions import Fraction
+
+from .notation import CompactScore
+
+PPQ = 480  # MIDI ticks per quarter note
+DEFAULT_TEMPO = 120  # Quarter notes a minute, as MIDI players assume without a tempo
+VELOCITY = 80
+HANDS = ('right', 'left')  # Of a grand staff's staves, in order
+TRACK_NAMES = {'right': 'Right hand', 'left': 'Left hand', None: 'Piano'}
+
+
+def quarter_tempo(score: CompactScore) -> float:
+    """
+    The score's tempo in quarter notes a minute.
+    """
+    if not score.tempo:
+        return DEFAULT_TEMPO
+    referent, per_minute = score.tempo
+    tempo = per_minute * referent
+    return int(tempo) if tempo == int(tempo) else float(tempo)
+
+
+def score_notes(score: CompactScore) -> list:
+    """
+    The (onset, MIDI number, duration, hand) of each note in a score, in order of onset, lowest first.
+    """
+    hands = HANDS if len(score.staves) == 2 else (None,) * len(score.staves)
+    notes = [(n.offset, n.midi, n.duration, hand) for staff, hand in zip(score.staves, hands) for n in staff.notes]
+    return sorted(notes, key=lambda n: (n[0], n[1]))
+
+
+def stream_notes(s) -> list:
+    """
+    The (onset, MIDI number, duration, hand) of each note and chord tone in a music21 stream, e.g. a chord exercise.
+    """
+    notes = []
+    for element in s.flatten().notes:
+        offset, length = Fraction(element.offset), Fraction(element.quarterLength)
+        notes.extend((offset, p.midi, length, None) for p in element.pitches)
+    return sorted(notes, key=lambda n: (n[0], n[1]))
+
+
+def events_json(notes: list, tempo: float) -> bytes:
+    seconds = 60 / tempo
+    events = [[round(float(onset) * seconds, 3), midi, round(float(length) * seconds, 3), hand]
+              for onset, midi, length, hand in notes]
+    return json.dumps({'tempo': tempo, 'columns': ['onset', 'pitch', 'duration', 'hand'], 'events': events},
+                      separators=(',', ':')).encode('utf-8')
+
+
+def variable_length(value: int) -> bytes:
+    """
+    A MIDI variable-length quantity: seven bits a byte, most significant first, the high bit set on all but the last.
+    """
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def track(events: list) -> bytes:
+    """
+    An MTrk chunk of (tick, event bytes) pairs, which are sorted by tick and end with End of Track.
+    """
+    data = bytearray()
+    previous = 0
+    for tick, event in sorted(events, key=lambda e: e[0]):
+        data += variable_length(tick - previous) + event
+        previous = tick
+    data += b'\x00\xff\x2f\x00'
+    return b'MTrk' + struct.pack('>I', len(data)) + bytes(data)
+
+
+def meta(kind: int, data: bytes) -> bytes:
+    return bytes((0xFF, kind)) + variable_length(len(data)) + data
+
+
+def standard_midi_file(notes: list, tempo: float, time_signature: tuple = (4, 4)) -> bytes:
+    """
+    A format 1 Standard MIDI File: a tempo track, then a track for each hand, the right hand's on channel 1.
+    """
+    beats, beat_type = time_signature
+    conductor = [
+        (0, meta(0x51, round(60_000_000 / tempo).to_bytes(3, 'big'))),
+        (0, meta(0x58, bytes((beats, beat_type.bit_length() - 1, 24, 8)))),
+    ]
+    tracks = [track(conductor)]
+
+    used = {hand for _onset, _midi, _length, hand in notes}
+    hands = [hand for hand in (*HANDS, None) if hand in used]
+    for channel, hand in enumerate(hands):
+        events = [(0, meta(0x03, TRACK_NAMES[hand].encode('ascii'))), (0, bytes((0xC0 | channel, 0)))]
+        for onset, midi, length, note_hand in notes:
+            if note_hand != hand:
+                continue
+            start = round(onset * PPQ)
+            events.append((start, bytes((0x90 | channel, midi, VELOCITY))))
+            events.append((start + round(length * PPQ), bytes((0x80 | channel, midi, 0))))
+        # Notes ending at a tick are released before those starting there, so a repeated note is heard again
+        tracks.append(track(sorted(events, key=lambda e: (e[0], e[1][0] & 0xF0 != 0x80))))
+
+    return b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), PPQ) + b''.join(tracks)
+
+
+def score_formats(score: CompactScore) -> dict:
+    """
+    The playback formats of an exercise, {variant: bytes}.
+    """
+    notes = score_notes(score)
+    tempo = quarter_tempo(score)
+    return {'midi': standard_midi_file(notes, tempo, score.time_signature), 'events': events_json(notes, tempo)}
+
+
+def stream_formats(s) -> dict:
+    """
+    The playback formats of a music21 stream without a tempo mark, such as a chord exercise, at DEFAULT_TEMPO.
+    """
+    notes = stream_notes(s)
+    return {'midi': standard_midi_file(notes, DEFAULT_TEMPO), 'events': events_json(notes, DEFAULT_TEMPO)}
@@ -0,0 +1,192 @@
+"""
+Cache of rendered exercise MusicXML, shared by every process.
+
+Renders are kept in the ``renders`` cache of ``settings.CACHES`` (see ``api.cache_backends``), by default a SQLite
+database under ``settings.RENDER_CACHE_DIR`` that evicts the least recently used renders beyond a size limit.
+Keys are versioned with ``RENDER_VERSION``, a hash of the source of the modules that generate what is cached and
+of the music21 version, so renders made by other code, e.g. before a deploy, are never served from a shared cache.
+The cache is filled on demand by the views and ahead of time by ``manage.py prerender_exercises``.
+
+Alongside each render are the variants it has been served as (see ``api.payloads``), e.g. 'musicxml.gz' or 'mxl',
+each encoded the first time it is asked for, and its playback formats, 'midi' and 'events' (see ``api.playback``),
+rendered from the same build as the MusicXML. Chord exercises and random-note cards are cached here too, with
+``get_or_set``.
+
+When several processes miss the same key at once, the first renders it while the others wait for its result, rather
+than all rendering it (see ``get_or_set``).
+"""
+import hashlib
+import os
+import time
+from importlib.metadata import version
+
+from django.core.cache import caches
+
+from .metrics import span
+from .payloads import VARIANTS
+from .specs import ExerciseSpec
+
+# The api modules whose code decides the bytes of a render, a variant, a chord exercise or a card
+GENERATOR_MODULES = ('accidentals', 'chords', 'exercises', 'fingering', 'jobs', 'layout', 'musicxml_writer', 'notation',
+                     'payloads', 'pitch_tables', 'playback', 'score_templates', 'theory', 'transposition', 'utilities')
+CACHE_ALIAS = 'renders'
+CHUNK_SIZE = 64 * 1024
+# Seconds a process waits for another to finish rendering the same key before rendering it itself
+LOCK_TIMEOUT = 30
+LOCK_POLL = 0.05
+
+
+def source_version(modules: tuple = GENERATOR_MODULES, directory: str = os.path.dirname(__file__)) -> int:
+    """
+    A cache version that changes whenever the source of any of the modules in directory, or music21, does.
+    """
+    digest = hashlib.sha256(version('music21').encode('utf-8'))
+    for module in modules:
+        with open(os.path.join(directory, f'{module}.py'), 'rb') as f:
+            digest.update(f.read())
+    return int(digest.hexdigest()[:12], 16)
+
+
+RENDER_VERSION = source_version()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def exercise_key(spec: ExerciseSpec, variant: str or None = None) -> str:
+    """
+    The key of a spec's render, or of a variant of it.
+    """
+    key = f'exercise:{spec.kind}:{spec.tonic}:{spec.quality}:{spec.style}:{spec.octaves}'
+    return key if variant is None else f'{key}:{variant}'
+
+
+def load(spec: ExerciseSpec) -> str or None:
+    return get_cache().get(exercise_key(spec), version=RENDER_VERSION)
+
+
+def iter_render(spec: ExerciseSpec):
+    """
+    The cached render of a spec in chunks of CHUNK_SIZE characters, or None if it hasn't been rendered.
+    """
+    xml = load(spec)
+    if xml is None:
+        return None
+    return (xml[start:start + CHUNK_SIZE] for start in range(0, len(xml), CHUNK_SIZE))
+
+
+def store(spec: ExerciseSpec, xml: str, variants: dict or None = None):
+    """
+    Store a render, and the variants rendered with it, e.g. by render_formats.
+    """
+    cache = get_cache()
+    cache.set(exercise_key(spec), xml, version=RENDER_VERSION)
+    # Variants encoded from an earlier render of the spec (e.g. before prerender_exercises --force) are now stale
+    cache.delete_many([exercise_key(spec, variant) for variant in VARIANTS], version=RENDER_VERSION)
+    if variants:
+        store_variants(spec, variants)
+
+
+def store_chunks(spec: ExerciseSpec, chunks):
+    """
+    Pass on the chunks of a render as they are written, storing it once the last has been yielded. If the consumer
+    stops early, e.g. because the client went away, nothing is stored.
+    """
+    written = []
+    for chunk in chunks:
+        written.append(chunk)
+        yield chunk
+    store(spec, ''.join(written))
+
+
+def load_variant(spec: ExerciseSpec, variant: str) -> bytes or None:
+    return get_cache().get(exercise_key(spec, variant), version=RENDER_VERSION)
+
+
+def store_variant(spec: ExerciseSpec, variant: str, data: bytes):
+    get_cache().set(exercise_key(spec, variant), data, version=RENDER_VERSION)
+
+
+def store_variants(spec: ExerciseSpec, variants: dict):
+    get_cache().set_many({exercise_key(spec, variant): data for variant, data in variants.items()},
+                         version=RENDER_VERSION)
+
+
+def get_or_set(key: str, render):
+    """
+    The cached value for key, or else render() it and cache the result.
+
+    While one process renders a key, others that miss it wait for its result, for up to LOCK_TIMEOUT seconds, before
+    rendering it themselves. Waits are recorded as cache_wait spans.
+    """
+    cache = get_cache()
+    value = cache.get(key, version=RENDER_VERSION)
+    if value is not None:
+        return value
+
+    lock = f'lock:{key}'
+    locked = cache.add(lock, os.getpid(), LOCK_TIMEOUT, version=RENDER_VERSION)
+    if not locked:
+        with span('cache_wait'):
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while not locked and time.monotonic() < deadline:
+                time.sleep(LOCK_POLL)
+                value = cache.get(key, version=RENDER_VERSION)
+                if value is not None:
+                    return value
+                locked = cache.add(lock, os.getpid(), LOCK_TIMEOUT, version=RENDER_VERSION)
+
+    try:
+        # It may have been stored while the lock was being taken
+        value = cache.get(key, version=RENDER_VERSION)
+        if value is None:
+            value = render()
+            cache.set(key, value, version=RENDER_VERSION)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock, version=RENDER_VERSION)
+
+
+def render(spec: ExerciseSpec) -> str:
+    from .transposition import transposed_exercise
+
+    return transposed_exercise(spec).render()
+
+
+def render_formats(spec: ExerciseSpec) -> tuple:
+    """
+    Build a spec's exercise once, and render it both to MusicXML and to each playback format.
+
+    Returns (xml, {variant: bytes}).
+    """
+    from .playback import score_formats
+    from .transposition import transposed_exercise
+
+    exercise = transposed_exercise(spec)
+    xml = exercise.render()
+    with span('playback'):
+        return xml, score_formats(exercise.compact_score())
+
+
+def get_or_render(spec: ExerciseSpec) -> str:
+    def render_and_store():
+        xml, variants = render_formats(spec)
+        store_variants(spec, variants)
+        return xml
+
+    return get_or_set(exercise_key(spec), render_and_store)
+
+
+def get_or_render_playback(spec: ExerciseSpec, variant: str) -> bytes:
+    """
+    A playback format of a spec's exercise, 'midi' or 'events', rendering it with the MusicXML if it isn't cached.
+    """
+    data = load_variant(spec, variant)
+    if data is None:
+        xml, variants = render_formats(spec)
+        get_cache().add(exercise_key(spec), xml, version=RENDER_VERSION)
+        store_variants(spec, variants)
+        data = variants[variant]
+    return data
@@ -0,0 +1,142 @@
+"""
+Compiled MusicXML templates for exercises.
+
+Every exercise of a (kind, quality, style, octaves) has the same measures, rhythm, beams, hidden rests, time signature
+and tempo whatever its tonic; only the key signature and each note's spelling, displayed accidental and fingering
+differ, and where its courtesy clefs fall. So the direct writer's output for one of them is kept as a template: its
+MusicXML split at those slots. Another exercise of the same shape is written by filling the slots from its note
+records and splicing them between the template's fixed text, without walking measures, durations and rests again.
+
+A template is compiled from the first exercise written with its shape and checked there and then against the direct
+writer's output, which is itself tested against music21's exporter. A template that doesn't reproduce it is never
+used, and exercises of its shape are written by the direct writer as before.
+"""
+import logging
+
+from . import metrics
+from .musicxml_writer import MusicXMLWriter, accidental_xml, fingering_xml, key_alters, pitch_xml, show_accidental, \
+    write as write_directly
+from .notation import CompactScore, UnsupportedScore
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_WRITES = metrics.Counter('conbrio_template_writes_total',
+                                  'Exercises written from a compiled template: compiled, filled, or written directly '
+                                  'because their template was rejected', ('outcome',))
+
+# Marks each slot in a template's text; never otherwise written
+SLOT = '\x00'
+
+_templates = {}  # Shape -> Template, or None if rejected
+
+
+class TemplateWriter(MusicXMLWriter):
+    """
+    Writes a score with SLOT in place of each part that depends on the key and spelling, recording the note whose
+    slots each is.
+    """
+
+    def __init__(self, score: CompactScore):
+        super().__init__(score)
+        self.positions = {id(n): (staff, index) for staff, s in enumerate(score.staves)
+                          for index, n in enumerate(s.notes)}
+        self.notes = []  # (staff, note index, measure) of each note written, in order
+
+    def fifths(self) -> str:
+        return SLOT
+
+    def pitch(self, n) -> str:
+        return SLOT
+
+    def accidental(self, n, past: list, past_measure: list) -> str:
+        return SLOT
+
+    def fingering(self, n) -> str:
+        return SLOT
+
+    def note(self, n, staff: int, past: list, past_measure: list) -> str:
+        self.notes.append((*self.positions[id(n)], int(n.offset // self.measure_length)))
+        return super().note(n, staff, past, past_measure)
+
+
+class Template:
+    def __init__(self, score: CompactScore):
+        writer = TemplateWriter(score)
+        self.text = writer.write().split(SLOT)
+        self.notes = tuple(writer.notes)
+        self.keyed = score.fifths is not None
+        self.counts = tuple(len(staff.notes) for staff in score.staves)
+
+    def fill(self, score: CompactScore) -> str:
+        """
+        The MusicXML of a score with this template's shape.
+        """
+        staves = [staff.notes for staff in score.staves]
+        if tuple(len(notes) for notes in staves) != self.counts:
+            raise UnsupportedScore('The score does not have the shape of the template')
+        alters = key_alters(score.fifths)
+        values = [str(score.fifths)] if self.keyed else []
+        # Pitches written so far in each (staff, measure), for accidental display
+        pasts = {}
+        for staff, index, measure in self.notes:
+            n = staves[staff][index]
+            past = pasts.get((staff, measure))
+            if past is None:
+                past = pasts[(staff, measure)] = []
+            values.append(pitch_xml(n))
+            values.append(accidental_xml(n, show_accidental(n, past, pasts.get((staff, measure - 1), []), alters)))
+            values.append(fingering_xml(n))
+
+        parts = [None] * (len(self.text) + len(values))
+        parts[::2] = self.text
+        parts[1::2] = values
+        return ''.join(parts)
+
+
+def shape(kind: str, quality: str, style: str, octaves: int, score: CompactScore) -> tuple:
+    return (kind, quality, style, octaves, score.fifths is None,
+            tuple(tuple(staff.clef_changes) for staff in score.staves))
+
+
+def compile_template(key: tuple, score: CompactScore) -> tuple:
+    """
+    Compile the template for a shape from a score, checking it against the direct writer.
+
+    Returns (template or None if rejected, the score's MusicXML).
+    """
+    xml = write_directly(score)
+    template = Template(score)
+    if template.fill(score) != xml:
+        logger.warning('Rejected the template for %s, which does not reproduce the direct writer', key)
+        return None, xml
+    return template, xml
+
+
+def write(kind: str, quality: str, style: str, octaves: int, score: CompactScore) -> str:
+    """
+    Write an exercise's score, as musicxml_writer.write does, from the template for its shape. Raises
+    UnsupportedScore if the direct writer can't write it.
+    """
+    key = shape(kind, quality, style, octaves, score)
+    if key not in _templates:
+        _templates[key], xml = compile_template(key, score)
+        TEMPLATE_WRITES.inc(outcome='compiled')
+        return xml
+    template = _templates[key]
+    if template is None:
+        TEMPLATE_WRITES.inc(outcome='rejected')
+        return write_directly(score)
+    try:
+        xml = template.fill(score)
+    except UnsupportedScore:
+        # Not the template's shape after all, or not writable at all, in which case the writer raises it again
+        return write_directly(score)
+    TEMPLATE_WRITES.inc(outcome='filled')
+    return xml
+
+
+def reset():
+    """
+    Forget every compiled template.
+    """
+    _templates.clear()
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+SCALE_QUALITIES = ('major', 'minor', 'melodic', 'harmonic')
+ARPEGGIO_QUALITIES = ('major', 'minor', 'dominant', 'diminished')
+STYLES = ('ABRSM', 'Cooke')
+OCTAVES = (1, 2, 3, 4)
+
+# Tonics in the order of the circle of fifths, one spelling per key signature
+MAJOR_TONICS = ('Cb', 'Gb', 'Db', 'Ab', 'Eb', 'Bb', 'F', 'C', 'G', 'D', 'A', 'E', 'B', 'F#', 'C#')
+MINOR_TONICS = ('Ab', 'Eb', 'Bb', 'F', 'C', 'G', 'D', 'A', 'E', 'B', 'F#', 'C#', 'G#', 'D#', 'A#')
+# Dominant sevenths are spelled in the key a fifth below, which must itself have a key signature
+DOMINANT_TONICS = MAJOR_TONICS[1:]
+DIMINISHED_TONICS = ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'G#', 'A', 'Bb', 'B')
+
+TONICS_BY_QUALITY = {
+    'major': MAJOR_TONICS,
+    'minor': MINOR_TONICS,
+    'melodic': MINOR_TONICS,
+    'harmonic': MINOR_TONICS,
+    'dominant': DOMINANT_TONICS,
+    'diminished': DIMINISHED_TONICS,
+}
+
+
+def replace_fancy_accidentals(fancy: str) -> str:
+    return fancy.replace('♭', 'b').replace('♯', '#')
+
+
+def normalize_tonic(tonic: str) -> str:
+    """
+    Re-capitalize a tonic as it is spelled in a major key, i.e. ab -> Ab, g -> G, F# -> F#.
+    """
+    tonic = replace_fancy_accidentals(tonic.strip())
+    if not tonic or tonic[0].upper() not in 'ABCDEFG' or any(c not in '#b' for c in tonic[1:].lower()):
+        raise ValueError(f'Invalid tonic: {tonic!r}')
+    return tonic[0].upper() + tonic[1:].lower()
+
+
+def default_kind(quality: str) -> str:
+    return 'arpeggio' if quality in ('dominant', 'diminished') else 'scale'
+
+
+@dataclass(frozen=True)
+class ExerciseSpec:
+    """
+    Everything a scale or arpeggio render depends on. Two equal specs always render identical MusicXML.
+    """
+    kind: str
+    tonic: str
+    quality: str
+    style: str = 'ABRSM'
+    octaves: int = 2
+
+    def __post_init__(self):
+        object.__setattr__(self, 'tonic', normalize_tonic(self.tonic))
+        object.__setattr__(self, 'octaves', int(self.octaves))
+
+        if self.kind not in ('scale', 'arpeggio'):
+            raise ValueError(f'Invalid exercise kind: {self.kind!r}')
+        qualities = SCALE_QUALITIES if self.kind == 'scale' else ARPEGGIO_QUALITIES
+        if self.quality not in qualities:
+            raise ValueError(f'Invalid {self.kind} quality: {self.quality!r}')
+        # Other spellings of a tonic would need double sharps or flats in the key signature
+        if self.tonic not in TONICS_BY_QUALITY[self.quality]:
+            raise ValueError(f'Invalid tonic for a {self.quality} {self.kind}: {self.tonic!r}')
+        if self.style not in STYLES:
+            raise ValueError(f'Invalid style: {self.style!r}')
+        if self.octaves not in OCTAVES:
+            raise ValueError(f'Invalid number of octaves: {self.octaves!r}')
+
+    @classmethod
+    def from_query(cls, params) -> 'ExerciseSpec':
+        quality = params.get('quality', 'melodic')
+        try:
+            octaves = int(params.get('octaves', 2))
+        except ValueError:
+            raise ValueError(f'Invalid number of octaves: {params.get("octaves")!r}')
+        return cls(kind=params.get('kind', default_kind(quality)),
+                   tonic=params.get('tonic', 'ab'),
+                   quality=quality,
+                   style=params.get('style', 'ABRSM'),
+                   octaves=octaves)
+
+    def query_string(self) -> str:
+        """
+        The spec as query parameters for /api/scale/, every one given and in a fixed order, so each spec has one URL.
+        """
+        return urlencode({'kind': self.kind, 'tonic': self.tonic, 'quality': self.quality, 'style': self.style,
+                          'octaves': self.octaves})
+
+    def __str__(self):
+        return f'{self.tonic} {self.quality} {self.style} {self.kind} ({self.octaves} octaves)'
+
+
+def exercise_matrix(octaves=OCTAVES, styles=STYLES):
+    """
+    Every scale and arpeggio the API can generate, for the given octave counts and styles.
+    """
+    for kind, qualities in (('scale', SCALE_QUALITIES), ('arpeggio', ARPEGGIO_QUALITIES)):
+        for quality in qualities:
+            for tonic in TONICS_BY_QUALITY[quality]:
+                for style in styles:
+                    for octave_count in octaves:
+                        yield ExerciseSpec(kind, tonic, quality, style, octave_count)
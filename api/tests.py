@@ -1,3 +1,1053 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import itertools
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import zipfile
+from fractions import Fraction
+from io import BytesIO, StringIO
 
-# Create your tests here.
+import numpy as np
+from django.core.management import CommandError, call_command
+from django.test import AsyncClient, SimpleTestCase, override_settings
+from music21 import articulations, chord, clef, converter, interval, key, meter, note, pitch, scale, tempo
+
+from . import (books, cache_backends, chords, coalescing, executor, fingering, flashcards, layout, metrics,
+               musicxml_writer, payloads, render_cache, score_templates, theory, transposition)
+from .exercises import Arpeggio, build_exercise
+from .notation import STEPS, CompactScore, CompactStaff, NoteRecord, UnsupportedScore, interval_steps
+from .pitch_tables import CHROMATIC_TABLE, KEY_TABLES, parse_midi, random_pitches
+from .specs import MAJOR_TONICS, TONICS_BY_QUALITY, ExerciseSpec, exercise_matrix
+
+
+def score_summary(score) -> list:
+    """
+    Reduce a score to what a reader sees: per staff and measure the key, time signature, tempo, clefs, and each
+    note's pitch, displayed accidental, duration, beams and fingering. Hidden rests are ignored.
+    """
+    summary = []
+    for part in score.parts:
+        for measure in part.getElementsByClass('Measure'):
+            events = []
+            for element in measure.recurse():
+                offset = element.getOffsetInHierarchy(measure)
+                if isinstance(element, key.KeySignature):
+                    events.append((offset, 'key', element.sharps))
+                elif isinstance(element, meter.TimeSignature):
+                    events.append((offset, 'time', element.numerator, element.denominator))
+                elif isinstance(element, tempo.MetronomeMark):
+                    events.append((offset, 'tempo', float(element.number), element.referent.quarterLength))
+                elif isinstance(element, clef.Clef):
+                    events.append((offset, 'clef', element.sign))
+                elif isinstance(element, note.Note):
+                    accidental = element.pitch.accidental
+                    events.append((offset, 'note', element.nameWithOctave,
+                                   accidental.name if accidental is not None and accidental.displayStatus else None,
+                                   element.duration.quarterLength,
+                                   tuple(beam.type for beam in element.beams.beamsList),
+                                   tuple(str(a.fingerNumber) for a in element.articulations
+                                         if isinstance(a, articulations.Fingering))))
+            summary.append((measure.number, measure.barDuration.quarterLength, sorted(events, key=str)))
+    return summary
+
+
+def use_temporary_render_cache(test: SimpleTestCase, **overrides):
+    """
+    Give a test its own empty render cache, overriding any other settings given for the length of the test.
+    """
+    cache_dir = tempfile.TemporaryDirectory()
+    test.addCleanup(cache_dir.cleanup)
+    caches = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'renders': {'BACKEND': 'api.cache_backends.SQLiteCache', 'LOCATION': f'{cache_dir.name}/renders.sqlite3',
+                    'TIMEOUT': None},
+    }
+    settings = override_settings(CACHES=caches, RENDER_CACHE_DIR=cache_dir.name, **overrides)
+    settings.enable()
+    test.addCleanup(settings.disable)
+
+
+class DirectWriterGoldenTest(SimpleTestCase):
+    """
+    The direct MusicXML writer must produce the same score as music21's exporter.
+    """
+    specs = [
+        ExerciseSpec(kind, tonic, quality, style, octaves)
+        for kind, quality, tonics in (
+            ('scale', 'major', ('C', 'F#', 'Db', 'Cb')),
+            ('scale', 'minor', ('A', 'Bb', 'G#')),
+            ('scale', 'melodic', ('Ab', 'E', 'C#')),
+            ('scale', 'harmonic', ('D', 'Eb', 'A#')),
+            ('arpeggio', 'major', ('C', 'Ab', 'B')),
+            ('arpeggio', 'minor', ('A', 'F#', 'Eb')),
+            ('arpeggio', 'dominant', ('C', 'Gb', 'E')),
+            ('arpeggio', 'diminished', ('C', 'F#', 'Bb')),
+        )
+        for tonic in tonics
+        for style in ('ABRSM', 'Cooke')
+        for octaves in (1, 2)
+    ] + [
+        ExerciseSpec('scale', 'F', 'melodic', 'ABRSM', 3),
+        ExerciseSpec('scale', 'A', 'melodic', 'Cooke', 3),
+        ExerciseSpec('scale', 'B', 'major', 'Cooke', 4),
+        ExerciseSpec('arpeggio', 'Db', 'dominant', 'ABRSM', 3),
+        ExerciseSpec('arpeggio', 'C#', 'minor', 'Cooke', 4),
+    ]
+
+    @staticmethod
+    def build(spec: ExerciseSpec):
+        return build_exercise(spec.kind, spec.tonic, spec.quality, spec.style, spec.octaves)
+
+    def test_direct_writer_matches_music21_exporter(self):
+        for spec in self.specs:
+            with self.subTest(spec=str(spec)):
+                # music21 writes hidden time signatures as an empty <time />, which it can't read back, so the
+                # reference is the score the exporter is given rather than its output
+                reference = self.build(spec)
+                reference.render(fast=False)
+                xml = self.build(spec).render(fast=True)
+                self.assertEqual(score_summary(converter.parse(xml, format='musicxml')),
+                                 score_summary(reference.s))
+
+    def test_direct_writer_is_used(self):
+        xml = self.build(ExerciseSpec('scale', 'C', 'major')).render(fast=True)
+        self.assertIn('<software>conbrio</software>', xml)
+
+
+class ScoreTemplateTest(SimpleTestCase):
+    def setUp(self):
+        score_templates.reset()
+        self.addCleanup(score_templates.reset)
+
+    def test_templates_reproduce_the_direct_writer(self):
+        for spec in exercise_matrix():
+            exercise = transposition.transposed_exercise(spec)
+            exercise.lay_out()
+            score = exercise.compact_score()
+            with self.subTest(spec=str(spec)):
+                self.assertEqual(score_templates.write(spec.kind, spec.quality, spec.style, spec.octaves, score),
+                                 musicxml_writer.write(score))
+        # Far fewer shapes than exercises, none rejected
+        self.assertLess(len(score_templates._templates), 232)
+        self.assertNotIn(None, score_templates._templates.values())
+
+    def test_scores_of_another_shape_are_written_directly(self):
+        scores = []
+        for octaves in (1, 2):
+            exercise = transposition.transposed_exercise(ExerciseSpec('scale', 'G', 'major', octaves=octaves))
+            exercise.lay_out()
+            scores.append(exercise.compact_score())
+        score_templates.write('scale', 'major', 'ABRSM', 1, scores[0])
+        # Filed under the wrong shape, the two octave scale doesn't fit the template
+        self.assertEqual(score_templates.write('scale', 'major', 'ABRSM', 1, scores[1]),
+                         musicxml_writer.write(scores[1]))
+
+
+class NoteRecordTest(SimpleTestCase):
+    def test_transposition_matches_music21(self):
+        for name in ('C4', 'F#3', 'B-2', 'E#5', 'C-4', 'G##3'):
+            for i in ('m2', 'M3', 'p5', 'a4', 'd5', 'm6', 'm7', 'd7', 'p8', '-p8', '-M3', 'M9', '-p15'):
+                with self.subTest(pitch=name, interval=i):
+                    expected = pitch.Pitch(name).transpose(interval.Interval(i))
+                    record = NoteRecord.from_pitch(pitch.Pitch(name), 1).transposed(*interval_steps(i))
+                    self.assertEqual(record.name_with_octave, expected.nameWithOctave)
+
+    def test_music21_intervals_are_accepted(self):
+        self.assertEqual(interval_steps(interval.Interval('-p8')), (-7, -12))
+        self.assertEqual(interval_steps(interval.Interval('M10')), (9, 16))
+
+
+class BatchEndpointTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=2)
+        self.addCleanup(executor.shutdown)
+
+    def post(self, body):
+        return self.client.post('/api/scales/', json.dumps(body), content_type='application/json')
+
+    def test_streams_every_exercise_as_ndjson(self):
+        exercises = [
+            {'tonic': 'C', 'quality': 'major'},
+            {'tonic': 'f#', 'quality': 'minor', 'style': 'Cooke', 'octaves': 1},
+            {'tonic': 'Bb', 'quality': 'dominant'},
+        ]
+        cached = ExerciseSpec('scale', 'C', 'major')
+        render_cache.store(cached, '<cached />')
+
+        response = self.post({'exercises': exercises})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(line['index'] for line in lines), [0, 1, 2])
+
+        by_index = {line['index']: line for line in lines}
+        self.assertEqual(by_index[0]['xml'], '<cached />')
+        self.assertEqual(by_index[2]['spec']['kind'], 'arpeggio')
+        for index in (1, 2):
+            spec = ExerciseSpec(**by_index[index]['spec'])
+            self.assertEqual(by_index[index]['xml'], render_cache.load(spec))
+            self.assertIn('<score-partwise', by_index[index]['xml'])
+
+    def test_rejects_invalid_batches(self):
+        for body in ({}, {'exercises': []}, {'exercises': [{'tonic': 'C'}, {'tonic': 'H'}]},
+                     {'exercises': [{'quality': 'major'}] * 101}):
+            with self.subTest(body=str(body)[:50]):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+        self.assertIn('Exercise 1', self.post({'exercises': [{'tonic': 'C'}, {'tonic': 'H'}]}).json()['error'])
+        self.assertEqual(self.client.get('/api/scales/').status_code, 405)
+
+
+class StreamingRenderTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1)
+        self.addCleanup(executor.shutdown)
+
+    def test_streamed_scale_matches_render(self):
+        spec = ExerciseSpec('scale', 'Ab', 'melodic', octaves=4)
+        expected = transposition.transposed_exercise(spec).render()
+        query = {'tonic': 'Ab', 'quality': 'melodic', 'octaves': 4, 'stream': 'true'}
+
+        response = self.client.get('/api/scale/', {**query, 'format': 'musicxml'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(gzip.decompress(b''.join(chunks)).decode(), expected)
+        # Stored as it was sent, and streamed from the cache from then on
+        self.assertEqual(render_cache.load(spec), expected)
+        response = self.client.get('/api/scale/', query)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), {'xml': expected})
+
+        self.assertEqual(self.client.get('/api/scale/', {**query, 'format': 'mxl'}).status_code, 400)
+
+    def test_practice_set(self):
+        exercises = [{'tonic': 'C', 'quality': 'major'}, {'tonic': 'F#', 'quality': 'dominant'},
+                     {'tonic': 'Eb', 'quality': 'harmonic', 'style': 'Cooke', 'octaves': 1}]
+        response = self.client.post('/api/practice-set/', json.dumps({'exercises': exercises}),
+                                    content_type='application/json', HTTP_ACCEPT=payloads.MUSICXML_TYPE)
+        xml = b''.join(response.streaming_content).decode()
+        self.assertEqual(xml.count('<score-partwise'), 1)
+        self.assertEqual(xml.count('<print new-system="yes" />'), 2)
+        self.assertEqual(xml.count('light-heavy'), 1)
+
+        measures = converter.parse(xml, format='musicxml').parts[0].getElementsByClass('Measure')
+        self.assertEqual([m.number for m in measures], list(range(1, len(measures) + 1)))
+        self.assertEqual([k.sharps for k in measures.recurse().getElementsByClass(key.KeySignature)], [0, 5, -6])
+
+        response = self.client.post('/api/practice-set/', json.dumps({'exercises': exercises}),
+                                    content_type='application/json', QUERY_STRING='format=mxl')
+        self.assertEqual(response.status_code, 400)
+
+    def test_check(self):
+        staff = CompactStaff('G')
+        staff.append([NoteRecord('C', 0, 4, Fraction(3)), NoteRecord('D', 0, 4, Fraction(2))])
+        with self.assertRaises(UnsupportedScore):
+            musicxml_writer.MusicXMLWriter(CompactScore([staff])).check()
+        musicxml_writer.MusicXMLWriter(CompactScore([staff], time_signature=(5, 4))).check()
+
+
+class RenderExecutorTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1)
+        self.addCleanup(executor.shutdown)
+        self.addCleanup(flashcards.shutdown)
+
+    def test_views_render_in_worker_processes(self):
+        response = self.client.get('/api/scale/', {'tonic': 'D', 'quality': 'harmonic'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['xml'], render_cache.load(ExerciseSpec('scale', 'D', 'harmonic')))
+
+        response = self.client.get('/api/exercise/', {'max_sharps': 2, 'max_flats': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<score-partwise', response.json()['xml'])
+
+    def test_timeout(self):
+        with self.assertRaises(executor.RenderTimeout):
+            asyncio.run(executor.get_executor().run(time.sleep, 1, timeout=0.01))
+
+    def test_saturated_queue_is_rejected(self):
+        with override_settings(RENDER_QUEUE_DEPTH=1):
+            busy = executor.get_executor().submit(time.sleep, 1)
+            response = self.client.get('/api/scale/', {'tonic': 'E', 'quality': 'minor'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            busy.result()
+            while executor.get_executor().pending:  # the slot is released just after the result is set
+                time.sleep(0.01)
+            self.assertEqual(self.client.get('/api/scale/', {'tonic': 'E', 'quality': 'minor'}).status_code, 200)
+
+    def test_cpus_are_shared_between_server_processes(self):
+        with override_settings(WEB_CONCURRENCY=1):
+            self.assertEqual(executor.default_workers(), os.cpu_count())
+        with override_settings(WEB_CONCURRENCY=os.cpu_count() * 2):
+            self.assertEqual(executor.default_workers(), 1)
+
+    def test_broken_pool_is_replaced_once(self):
+        pool = executor.get_executor()
+        broken = pool._pool
+        replacements = [pool._replace_pool(broken) for _request in range(2)]
+        # The second request finds the pool already replaced, and the broken one shut down
+        self.assertIs(replacements[0], replacements[1])
+        self.assertIsNot(replacements[0], broken)
+        with self.assertRaises(RuntimeError):
+            broken.submit(time.sleep, 0)
+        self.assertEqual(pool.submit(time.sleep, 0).result(), None)
+
+
+class CoalescingTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1, COALESCE_ENDPOINTS=['scale', 'chords'])
+        self.addCleanup(executor.shutdown)
+
+    def test_concurrent_requests_share_a_render(self):
+        coalesced = coalescing.COALESCED.get(endpoint='scale')
+
+        async def requests():
+            client = AsyncClient()
+            query = {'tonic': 'Ab', 'quality': 'melodic'}
+            return await asyncio.gather(*(client.get('/api/scale/', query) for _request in range(3)))
+
+        responses = asyncio.run(requests())
+        self.assertEqual([r.status_code for r in responses], [200] * 3)
+        self.assertEqual(len({r.content for r in responses}), 1)
+        self.assertEqual(coalescing.COALESCED.get(endpoint='scale'), coalesced + 2)
+        self.assertEqual(coalescing.in_flight(), 0)
+
+    def test_job_is_cancelled_only_when_nobody_waits(self):
+        pool = executor.get_executor()
+        # Enough to fill the worker and the pool's call queue, so the next job stays cancellable
+        busy = [pool.submit(time.sleep, 0.2) for _job in range(3)]
+        first = pool.submit(time.sleep, 0.1, coalesce='chords')
+        second = pool.submit(time.sleep, 0.1, coalesce='chords')
+        self.assertEqual(pool.pending, 4)
+
+        first.cancel()
+        self.assertEqual(coalescing.in_flight(), 1)
+        second.cancel()
+        self.assertEqual(coalescing.in_flight(), 0)
+        for job in busy:
+            job.result()
+
+        # Endpoints not listed in COALESCE_ENDPOINTS always submit their own job
+        jobs = [pool.submit(time.sleep, 0, coalesce='random_note') for _job in range(2)]
+        self.assertEqual(coalescing.in_flight(), 0)
+        for job in jobs:
+            job.result()
+
+
+class PitchTableTest(SimpleTestCase):
+    ranges = list(itertools.combinations(('A0', 'G#2', 'B#3', 'C4', 'F#4', 'Cb5', 'B6', 'C8'), 2))
+
+    @staticmethod
+    def names(table, indices) -> list:
+        return [pitch.Pitch(STEPS[table.steps[i]], octave=int(table.octaves[i]),
+                            accidental=int(table.alters[i])).nameWithOctave for i in range(len(table.midi))[indices]]
+
+    def test_tables_match_music21_spelling(self):
+        for sharps, (min_note, max_note) in itertools.product(range(-7, 8), self.ranges):
+            with self.subTest(sharps=sharps, min_note=min_note, max_note=max_note):
+                expected = key.KeySignature(sharps).getScale().getPitches(min_note, max_note)
+                table = KEY_TABLES[sharps]
+                self.assertEqual(self.names(table, table.between(parse_midi(min_note), parse_midi(max_note))),
+                                 [p.nameWithOctave for p in expected])
+
+        for min_note, max_note in self.ranges:
+            with self.subTest(min_note=min_note, max_note=max_note):
+                expected = scale.ChromaticScale('C').getPitches(min_note, max_note)
+                self.assertEqual(self.names(CHROMATIC_TABLE, CHROMATIC_TABLE.between(parse_midi(min_note),
+                                                                                     parse_midi(max_note))),
+                                 [p.nameWithOctave for p in expected])
+
+    def test_random_pitches(self):
+        rng = np.random.default_rng(0)
+        steps, alters, octaves, midi = random_pitches('C4', 'B4', False, 2, count=1000, rng=rng)
+        self.assertEqual(sorted(set(zip(steps.tolist(), alters.tolist()))),
+                         [(0, 1), (1, 0), (2, 0), (3, 1), (4, 0), (5, 0), (6, 0)])
+        self.assertTrue(((midi >= 60) & (midi <= 71)).all())
+
+        steps, alters, octaves, midi = random_pitches('A0', 'C8', True, -3, count=1000, rng=rng)
+        self.assertEqual(set(alters.tolist()), {-2, -1, 0, 1, 2})
+        self.assertEqual(midi.tolist(), [pitch.Pitch(STEPS[s], octave=o, accidental=a).midi
+                                         for s, a, o in zip(steps.tolist(), alters.tolist(), octaves.tolist())])
+
+
+@override_settings(RENDER_WORKERS=1, FLASHCARD_POOL_SIZE=3, FLASHCARD_POOL_LOW=2)
+class FlashcardPoolTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self)
+        self.addCleanup(executor.shutdown)
+        self.addCleanup(flashcards.shutdown)
+
+    def wait_for_refills(self):
+        pool = flashcards.get_pool()
+        deadline = time.monotonic() + 30
+        while pool.metrics()['refills_pending'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def test_cards_are_served_from_the_pool(self):
+        params = {'max_sharps': 1, 'max_flats': 1, 'min_note': 'C4', 'max_note': 'C5', 'accidentals': 'false'}
+        response = self.client.get('/api/exercise/', params)
+        self.assertEqual(response.status_code, 200)
+        self.wait_for_refills()
+
+        for _card in range(3):
+            card = self.client.get('/api/exercise/', params).json()
+            self.assertTrue(60 <= card['note'] <= 72)
+            self.assertIn('<score-partwise', card['xml'])
+            self.wait_for_refills()
+
+        metrics = self.client.get('/api/exercise/metrics/').json()
+        self.assertEqual((metrics['hits'], metrics['misses']), (3, 1))
+        self.assertEqual(metrics['hit_rate'], 0.75)
+        self.assertEqual(metrics['refills'], 2)
+        # 3 after the first refill, 1 after two more cards, topped back up to 3, less the last card
+        self.assertEqual(metrics['cards_ready'], 2)
+        self.assertGreater(metrics['refill_lag_max'], 0)
+
+    def test_failed_buckets_are_not_refilled(self):
+        pool = flashcards.get_pool()
+        empty = (0, 0, 'C#4', 'C#4', False)
+        with self.assertLogs('api.flashcards', 'ERROR'):
+            self.assertIsNone(pool.take(empty))
+            self.wait_for_refills()
+        self.assertIsNone(pool.take(empty))
+        self.assertEqual(pool.metrics()['refills_pending'], 0)
+        self.assertEqual(pool.metrics()['refills'], 1)
+
+    def test_invalid_parameters(self):
+        for params in ({'max_sharps': 'x'}, {'max_flats': 9}, {'min_note': 'C5', 'max_note': 'C4'}, {'min_note': 'H2'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/exercise/', params).status_code, 400)
+        # The C major scale has no C#4
+        empty = {'min_note': 'C#4', 'max_note': 'C#4', 'max_sharps': 0, 'max_flats': 0, 'accidentals': 'false'}
+        response = self.client.get('/api/exercise/', empty)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('No notes between C#4 and C#4', response.json()['error'])
+        self.assertEqual(self.client.get('/api/exercise/session/', empty).status_code, 400)
+        # Every key signature has a D, a D flat or a C sharp
+        self.assertEqual(flashcards.bucket_from_query({**empty, 'max_note': 'D4', 'max_sharps': 7, 'max_flats': 7}),
+                         (7, 7, 'C#4', 'D4', False))
+        for params in ({'count': 0}, {'count': 1000}, {'phrase': 3}, {'count': 6, 'phrase': 4}, {'max_flats': 9}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/exercise/session/', params).status_code, 400)
+
+    def test_reading_session(self):
+        params = {'max_sharps': 2, 'max_flats': 0, 'min_note': 'A2', 'max_note': 'C6', 'accidentals': 'false',
+                  'count': 8, 'phrase': 2}
+        session = self.client.get('/api/exercise/session/', params).json()
+        self.assertEqual(len(session['notes']), 8)
+        self.assertTrue(all(45 <= midi <= 84 for midi in session['notes']))
+
+        score = converter.parseData(session['xml'])
+        right_hand, left_hand = score.parts
+        self.assertEqual(len(right_hand.getElementsByClass('Measure')), 4)
+        # Each note is in one hand or the other, in the order of the answers
+        self.assertEqual([n.pitch.midi for n in score.flatten().notes], session['notes'])
+        for part in score.parts:
+            for measure in part.getElementsByClass('Measure'):
+                self.assertEqual(measure.duration.quarterLength, 4)
+        for signature in score.flatten().getElementsByClass(key.KeySignature):
+            self.assertTrue(0 <= signature.sharps <= 2)
+
+
+class ChordExerciseTest(SimpleTestCase):
+    def test_shapes_match_music21_on_every_tonic(self):
+        for tonic in MAJOR_TONICS:
+            root = chords.common_tone(tonic)
+            for intervals in chords.COMMON_TONE_TRIADS + chords.COMMON_TONE_SEVENTHS:
+                with self.subTest(tonic=tonic, intervals=intervals):
+                    series, (key_step, key_alter), mode = chords.shape_on(chords.spelling(root), intervals)
+                    p = pitch.Pitch(root.name_with_octave)
+                    c = chord.Chord([p] + [p.transpose(i) for i in intervals])
+                    self.assertEqual([pitch.Pitch(step, octave=octave, accidental=alter).nameWithOctave
+                                      for step, alter, octave in series[0]],
+                                     [n.nameWithOctave for n in c.pitches])
+                    # The first inversion moves the bass up an octave
+                    self.assertEqual(series[1][-1], (series[0][0][0], series[0][0][1], series[0][0][2] + 1))
+                    self.assertEqual(series[-1], series[0])
+                    if c.quality in ('major', 'minor') and c.seventh is None:
+                        self.assertEqual((key_step, key_alter, mode),
+                                         (c.root().step, int(c.root().alter), c.quality))
+
+    def test_endpoint(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1)
+        self.addCleanup(executor.shutdown)
+        response = self.client.get('/api/chords/', {'tonic': 'Eb'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<score-partwise', response.json()['xml'])
+        self.assertEqual(self.client.get('/api/chords/', {'tonic': 'H'}).status_code, 400)
+        for tonic in ('Cbb', 'D#'):
+            response = self.client.get('/api/chords/', {'tonic': tonic})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], f'No chord series for {tonic!r}')
+        with self.assertRaises(ValueError):
+            chords.common_tone('Cbb')
+
+
+class BenchmarkCommandTest(SimpleTestCase):
+    def test_results_and_comparison(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f'{directory}/results.json'
+            call_command('benchmark', '--only', 'exercises', 'grand_staff', '--octaves', '1', '--style', 'ABRSM',
+                         '--repeat', '1', '--output', output, stdout=StringIO())
+            with open(output) as f:
+                saved = json.load(f)
+
+            self.assertEqual(saved['meta']['options']['repeat'], 1)
+            result = saved['results']['scale/C/major/ABRSM/1/fast']
+            self.assertEqual(set(result['phases']), {'construction', 'beaming', 'fingering', 'courtesy_clefs',
+                                                     'compact_score', 'xml_export'})
+            self.assertGreater(result['peak_memory'], 0)
+            self.assertIn('create_grand_staff', saved['results'])
+
+            # Against itself nothing regresses; against a much faster baseline everything does
+            call_command('benchmark', '--only', 'grand_staff', '--compare', output, '--threshold', '100',
+                         stdout=StringIO())
+            for result in saved['results'].values():
+                result['total'] /= 1000
+            with open(output, 'w') as f:
+                json.dump(saved, f)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', '--only', 'grand_staff', '--compare', output, stdout=StringIO())
+
+
+class ExerciseBookCommandTest(SimpleTestCase):
+    def write_syllabus(self, directory: str, groups: list) -> str:
+        path = f'{directory}/syllabus.json'
+        with open(path, 'w') as f:
+            json.dump({'exercises': groups}, f)
+        return path
+
+    def test_syllabus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            items = books.load_syllabus(self.write_syllabus(directory, [
+                {'kind': 'scale', 'tonic': ['c', 'G'], 'quality': ['major', 'harmonic'], 'octaves': 1},
+                {'kind': 'arpeggio', 'quality': 'diminished', 'style': 'Cooke'},
+                {'kind': 'scale', 'tonic': 'C', 'quality': 'major', 'octaves': 1},
+                {'kind': 'chords', 'tonic': 'Ab'},
+            ]))
+            self.assertEqual(items[:4], [ExerciseSpec('scale', 'C', 'major', octaves=1),
+                                         ExerciseSpec('scale', 'G', 'major', octaves=1),
+                                         ExerciseSpec('scale', 'C', 'harmonic', octaves=1),
+                                         ExerciseSpec('scale', 'G', 'harmonic', octaves=1)])
+            self.assertEqual(len(items), 4 + 12 + 1)
+            self.assertEqual(items[-1], books.ChordSeries('Ab'))
+
+            with self.assertRaisesRegex(ValueError, 'Exercise group 0'):
+                books.load_syllabus(self.write_syllabus(directory, [{'kind': 'scale', 'tonic': 'C'}]))
+
+    def test_mxl_files_and_resuming(self):
+        with tempfile.TemporaryDirectory() as directory:
+            syllabus = self.write_syllabus(directory, [
+                {'kind': 'scale', 'tonic': ['C', 'Eb'], 'quality': 'major', 'octaves': 1},
+                {'kind': 'chords', 'tonic': 'F'},
+            ])
+            output = StringIO()
+            call_command('build_exercise_book', syllabus, f'{directory}/book', '--workers', '2', stdout=output)
+            self.assertIn('Rendered 3 exercises', output.getvalue())
+            with zipfile.ZipFile(f'{directory}/book/scale-Eb-major-ABRSM-1.mxl') as archive:
+                xml = archive.read('score.musicxml').decode('utf-8')
+            self.assertEqual(xml, render_cache.render(ExerciseSpec('scale', 'Eb', 'major', octaves=1)))
+
+            # A second run only renders what is missing
+            os.remove(f'{directory}/book/chords-F.mxl')
+            output = StringIO()
+            call_command('build_exercise_book', syllabus, f'{directory}/book', stdout=output)
+            self.assertIn('Rendered 1 exercises', output.getvalue())
+            self.assertIn('2 already done', output.getvalue())
+            self.assertEqual(len(os.listdir(f'{directory}/book')), 3)
+
+    def test_merged_score(self):
+        with tempfile.TemporaryDirectory() as directory:
+            syllabus = self.write_syllabus(directory, [
+                {'kind': 'scale', 'tonic': 'C', 'quality': 'major', 'octaves': 1},
+                {'kind': 'arpeggio', 'tonic': 'G', 'quality': 'dominant', 'octaves': 1},
+            ])
+            call_command('build_exercise_book', syllabus, f'{directory}/book.musicxml', stdout=StringIO())
+            score = converter.parse(f'{directory}/book.musicxml')
+            self.assertEqual(len(score.parts), 2)  # The grand staff's two staves
+            self.assertEqual(len(score.flatten().getElementsByClass(tempo.MetronomeMark)), 2)
+            self.assertFalse(os.path.exists(f'{directory}/book.musicxml.parts'))
+
+            chords = self.write_syllabus(directory, [{'kind': 'chords', 'tonic': 'C'}])
+            with self.assertRaises(CommandError):
+                call_command('build_exercise_book', chords, f'{directory}/book.musicxml', stdout=StringIO())
+
+
+class MetricsTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1, SERVER_TIMING=True)
+        self.addCleanup(executor.shutdown)
+
+    def test_worker_spans_reach_server_timing_and_metrics(self):
+        rendered = metrics.PHASE_SECONDS.count(phase='fingering')
+        misses = metrics.EXERCISES.get(kind='scale', cache='miss')
+
+        response = self.client.get('/api/scale/', {'tonic': 'A', 'quality': 'minor'})
+        self.assertEqual(response.status_code, 200)
+        phases = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for phase in ('cache_lookup', 'render', 'construction', 'beaming', 'fingering', 'courtesy_clefs',
+                      'xml_export', 'total'):
+            self.assertIn(phase, phases)
+        self.assertEqual(metrics.PHASE_SECONDS.count(phase='fingering'), rendered + 1)
+        self.assertEqual(metrics.EXERCISES.get(kind='scale', cache='miss'), misses + 1)
+
+        self.client.get('/api/scale/', {'tonic': 'A', 'quality': 'minor'})
+        exposition = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE conbrio_phase_seconds histogram', exposition)
+        self.assertIn('conbrio_phase_seconds_bucket{phase="make_notation",le="+Inf"}', exposition)
+        self.assertRegex(exposition, r'conbrio_exercises_total\{kind="scale",cache="hit"\} [1-9]')
+        # Other tests' requests are counted too
+        self.assertRegex(exposition,
+                         r'conbrio_requests_total\{route="api/scale/",method="GET",status="200"\} ([2-9]|\d\d+)\n')
+        self.assertIn('conbrio_response_bytes_count{route="api/scale/"}', exposition)
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', ('phase',), buckets=(0.1, 1))
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, phase='a"b')
+        self.assertEqual(list(histogram.samples()), [
+            ('test_seconds_bucket', {'phase': 'a"b', 'le': '0.1'}, 2),
+            ('test_seconds_bucket', {'phase': 'a"b', 'le': '1'}, 3),
+            ('test_seconds_bucket', {'phase': 'a"b', 'le': '+Inf'}, 4),
+            ('test_seconds_sum', {'phase': 'a"b'}, 3.65),
+            ('test_seconds_count', {'phase': 'a"b'}, 4),
+        ])
+        self.assertIn('test_seconds_count{phase="a\\"b"} 4', metrics.exposition())
+
+
+class PayloadNegotiationTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1)
+        self.addCleanup(executor.shutdown)
+        self.spec = ExerciseSpec('scale', 'G', 'major')
+        render_cache.store(self.spec, '<score-partwise>G</score-partwise>')
+
+    def test_formats_and_encodings(self):
+        query = {'tonic': 'G', 'quality': 'major'}
+        self.assertEqual(self.client.get('/api/scale/', query).json(), {'xml': '<score-partwise>G</score-partwise>'})
+
+        response = self.client.get('/api/scale/', query, HTTP_ACCEPT=payloads.MUSICXML_TYPE)
+        self.assertEqual(response['Content-Type'], 'application/vnd.recordare.musicxml+xml; charset=utf-8')
+        self.assertEqual(response.content, b'<score-partwise>G</score-partwise>')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response = self.client.get('/api/scale/', {**query, 'format': 'musicxml'}, HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'<score-partwise>G</score-partwise>')
+
+        response = self.client.get('/api/scale/', {**query, 'format': 'mxl'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+            self.assertEqual(archive.namelist()[0], 'mimetype')
+            self.assertEqual(archive.read('score.musicxml'), b'<score-partwise>G</score-partwise>')
+
+        self.assertEqual(self.client.get('/api/scale/', {**query, 'format': 'pdf'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exercise/', {'format': 'mxl'}).status_code, 400)
+
+    def test_variants_are_cached_with_the_render(self):
+        query = {'tonic': 'G', 'quality': 'major', 'format': 'musicxml'}
+        self.client.get('/api/scale/', query, HTTP_ACCEPT_ENCODING='gzip')
+        cached = render_cache.load_variant(self.spec, 'musicxml.gz')
+        self.assertEqual(gzip.decompress(cached), b'<score-partwise>G</score-partwise>')
+
+        render_cache.store_variant(self.spec, 'musicxml.gz', gzip.compress(b'<from-cache />'))
+        response = self.client.get('/api/scale/', query, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gzip.decompress(response.content), b'<from-cache />')
+
+        # A new render of the spec drops the variants encoded from the old one
+        render_cache.store(self.spec, '<score-partwise>G2</score-partwise>')
+        self.assertIsNone(render_cache.load_variant(self.spec, 'musicxml.gz'))
+
+    def test_accept_headers(self):
+        self.assertEqual(payloads.parse_quality_list('gzip;q=0.5, br, *;q=0'), {'gzip': 0.5, 'br': 1.0, '*': 0.0})
+        self.assertEqual(payloads.mxl('<a/>'), payloads.mxl('<a/>'))
+
+
+class PlaybackTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1)
+        self.addCleanup(executor.shutdown)
+        self.spec = ExerciseSpec('scale', 'Eb', 'harmonic')
+
+    def test_formats_match_the_score(self):
+        xml, formats = render_cache.render_formats(self.spec)
+        score = converter.parse(xml)
+        notes = sorted(((Fraction(n.getOffsetInHierarchy(score)), n.pitch.midi) for n in score.recurse().notes))
+        metronome = score.recurse().getElementsByClass('MetronomeMark').first()
+
+        events = json.loads(formats['events'])
+        self.assertEqual(events['tempo'], metronome.number * metronome.referent.quarterLength)
+        seconds = 60 / events['tempo']
+        self.assertEqual([(round(float(onset) * seconds, 3), midi) for onset, midi in notes],
+                         [(onset, midi) for onset, midi, _duration, _hand in events['events']])
+        self.assertEqual({hand for *_, hand in events['events']}, {'right', 'left'})
+
+        midi = converter.parseData(formats['midi'], format='midi')
+        self.assertEqual(sorted((Fraction(n.getOffsetInHierarchy(midi)), n.pitch.midi) for n in midi.recurse().notes),
+                         notes)
+        self.assertEqual(midi.recurse().getElementsByClass('MetronomeMark').first().number, events['tempo'])
+
+    def test_endpoints(self):
+        query = {'tonic': 'Eb', 'quality': 'harmonic'}
+        response = self.client.get('/api/scale/', {**query, 'format': 'midi'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'audio/midi')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue(response.content.startswith(b'MThd'))
+        # One build rendered the MusicXML and both playback formats
+        self.assertIsNotNone(render_cache.load(self.spec))
+        self.assertEqual(render_cache.load_variant(self.spec, 'midi'), response.content)
+
+        response = self.client.get('/api/scale/', {**query, 'format': 'events'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)),
+                         json.loads(render_cache.load_variant(self.spec, 'events')))
+        self.assertIsNotNone(render_cache.load_variant(self.spec, 'events.gz'))
+        self.assertEqual(self.client.get('/api/scale/', {**query, 'format': 'midi', 'stream': 'true'}).status_code,
+                         400)
+
+        response = self.client.get('/api/chords/', {'tonic': 'F', 'format': 'events'})
+        self.assertEqual(response.json()['tempo'], 120)
+        self.assertTrue(response.json()['events'])
+        response = self.client.get('/api/chords/', {'tonic': 'F'}, HTTP_ACCEPT='audio/midi')
+        self.assertTrue(response.content.startswith(b'MThd'))
+
+
+class HTTPCachingTest(SimpleTestCase):
+    def setUp(self):
+        use_temporary_render_cache(self, RENDER_WORKERS=1)
+        self.addCleanup(executor.shutdown)
+        render_cache.store(ExerciseSpec('scale', 'G', 'major'), '<score-partwise>G</score-partwise>')
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/scale/', {'tonic': 'g', 'quality': 'major'})
+        canonical = '/api/scale/?kind=scale&tonic=G&quality=major&style=ABRSM&octaves=2'
+        self.assertEqual(response['Link'], f'<{canonical}>; rel="canonical"')
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        etag = response['ETag']
+
+        # The same exercise and representation has the same strong ETag under any of its URLs
+        self.assertEqual(self.client.get(canonical)['ETag'], etag)
+        self.assertNotEqual(self.client.get(canonical, HTTP_ACCEPT_ENCODING='gzip')['ETag'], etag)
+        self.assertNotEqual(self.client.get(canonical + '&format=musicxml')['ETag'], etag)
+
+        response = self.client.get(canonical, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('public', response['Cache-Control'])
+
+        response = self.client.get('/api/scale/', {'tonic': 'H'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        with override_settings(CANONICAL_REDIRECTS=True):
+            response = self.client.get('/api/scale/', {'quality': 'major', 'tonic': 'g'})
+            self.assertEqual((response.status_code, response['Location']), (301, canonical))
+            self.assertEqual(self.client.get(canonical).status_code, 200)
+
+    def test_chromatic_notes(self):
+        response = self.client.get('/api/chromatic/')
+        self.assertEqual(len(response.json()['notes']), 88)
+        self.assertEqual(self.client.get('/api/chromatic/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class TransposedExerciseTest(SimpleTestCase):
+    def test_matches_exercises_built_in_each_key(self):
+        for kind, quality, style, octaves in (('scale', 'melodic', 'ABRSM', 2), ('scale', 'major', 'Cooke', 4),
+                                              ('arpeggio', 'dominant', 'Cooke', 3), ('arpeggio', 'minor', 'ABRSM', 1)):
+            for tonic in TONICS_BY_QUALITY[quality]:
+                spec = ExerciseSpec(kind, tonic, quality, style, octaves)
+                with self.subTest(spec=spec):
+                    built = build_exercise(kind, spec.tonic, quality, style, octaves)
+                    self.assertEqual(transposition.transposed_exercise(spec).render(), built.render())
+
+        # Rendering the derived exercises leaves the canonical one untouched
+        canonical = transposition.canonical_exercise('arpeggio', 'minor', 'ABRSM', 1)
+        self.assertEqual(canonical.left_hand.clef_changes, [])
+        self.assertTrue(all(n.fingering is None and not n.beams for n in canonical.right_hand.notes))
+
+    def test_steps_from_canonical(self):
+        self.assertEqual(transposition.steps_from_canonical('C'), (0, 0))
+        self.assertEqual(transposition.steps_from_canonical('E#'), (-5, -7))  # E#3, as E#4 sounds as F4
+        self.assertEqual(transposition.steps_from_canonical('Cb'), (0, -1))
+        self.assertEqual(transposition.steps_from_canonical('f#'), (-4, -6))
+
+    def test_invalid_arpeggio_quality(self):
+        with self.assertRaisesMessage(ValueError, "Invalid arpeggio quality: 'augmented'"):
+            Arpeggio.key_for('C', 'augmented')
+
+
+class TheoryTablesTest(SimpleTestCase):
+    def test_keys_and_scales_match_music21(self):
+        for quality, tonics in TONICS_BY_QUALITY.items():
+            if quality not in theory.SCALE_PATTERNS:
+                continue
+            for tonic in tonics:
+                with self.subTest(tonic=tonic, quality=quality):
+                    mode = 'major' if quality == 'major' else 'minor'
+                    self.assertEqual(theory.key_for(tonic, quality).sharps,
+                                     key.Key(tonic if mode == 'major' else tonic.lower()).sharps)
+                    m21_scale = {'major': scale.MajorScale, 'minor': scale.MinorScale,
+                                 'harmonic': scale.HarmonicMinorScale, 'melodic': scale.MelodicMinorScale}[quality]
+                    for direction, degrees in zip((scale.Direction.ASCENDING, scale.Direction.DESCENDING),
+                                                  theory.scale_spelling(tonic, quality)):
+                        pitches = [m21_scale(tonic).pitchFromDegree(degree, direction=direction)
+                                   for degree in range(1, 8)]
+                        self.assertEqual(degrees, tuple((p.step, int(p.alter)) for p in pitches))
+
+    def test_invalid_tonics(self):
+        with self.assertRaisesMessage(ValueError, "No major key on 'Cbb'"):
+            theory.key_for('Cbb', 'major')
+        for tonic, quality in (('Cbb', 'major'), ('B#', 'major'), ('Db', 'harmonic'), ('Cb', 'dominant')):
+            with self.subTest(tonic=tonic, quality=quality):
+                with self.assertRaisesMessage(ValueError, f'Invalid tonic for a {quality}'):
+                    ExerciseSpec.from_query({'tonic': tonic, 'quality': quality})
+                response = self.client.get('/api/scale/', {'tonic': tonic, 'quality': quality})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Invalid tonic', response.json()['error'])
+
+    def test_dominant_keys(self):
+        self.assertEqual(theory.dominant_key('C'), theory.Key('F', 'major', -1))
+        self.assertEqual(theory.dominant_key('Gb'), theory.Key('Cb', 'major', -7))
+        self.assertEqual(theory.dominant_key('C#'), theory.Key('F#', 'major', 6))
+
+    def test_intervals_and_chromatic_names(self):
+        for name in ('M3', 'p5', '-p8', 'a4', 'd5', 'm7', 'M9', 'P15'):
+            self.assertEqual(theory.interval(name), interval_steps(interval.Interval(name)))
+        self.assertEqual(theory.interval(interval.Interval('m10')), (9, 15))
+        self.assertEqual(list(theory.CHROMATIC_NOTE_NAMES),
+                         [p.unicodeNameWithOctave for p in scale.ChromaticScale('C').getPitches('A0', 'C8')])
+
+
+class LayoutTest(SimpleTestCase):
+    def test_beam_codes(self):
+        begin, cont, end, none = layout.BEGIN, layout.CONTINUE, layout.END, layout.NO_BEAM
+        # The final whole note of a scale is left unbeamed, and the last group ends early
+        self.assertEqual(layout.beam_codes(np.array([0.5] * 6 + [4.0]), 4).tolist(),
+                         [begin, cont, cont, end, begin, end, none])
+        self.assertEqual(layout.beam_codes(np.array([0.25] * 3), 2).tolist(), [begin, end, end])
+
+        notes = [NoteRecord('C', 0, 4, 0.25, offset=i * 0.25) for i in range(4)]
+        layout.apply_beams(notes, 4, '16th')
+        self.assertEqual(notes[0].beams, ('begin', 'begin'))
+        self.assertEqual(notes[3].beams, ('end', 'end'))
+
+    def test_clef_changes(self):
+        g4, e4, c4, a3 = (parse_midi(name) for name in ('G4', 'E4', 'C4', 'A3'))
+        # Hovering between the thresholds doesn't flip clefs; each excursion above and back below does
+        midi = np.array([a3, c4, g4, e4, c4, a3, c4, g4, a3])
+        self.assertEqual(layout.clef_change_indices(midi, layout.TREBLE_CLEF_ABOVE, layout.BASS_CLEF_BELOW),
+                         [(2, 'G'), (5, 'F'), (7, 'G'), (8, 'F')])
+
+        notes = [NoteRecord(*spelling, 1, offset=i) for i, spelling in
+                 enumerate([('A', 0, 3), ('C', 0, 4), ('E', 0, 4), ('G', 0, 4), ('A', 0, 4), ('G', 0, 3)])]
+        self.assertEqual(layout.clef_changes(notes, layout.TREBLE_CLEF_ABOVE, layout.BASS_CLEF_BELOW, 2),
+                         [(2, 'G'), (4, 'F')])
+        self.assertEqual(layout.clef_changes(notes, layout.TREBLE_CLEF_ABOVE, layout.BASS_CLEF_BELOW, 1),
+                         [(3, 'G'), (5, 'F')])
+
+
+class FingeringTest(SimpleTestCase):
+    def fingers(self, spec: ExerciseSpec, hand: str) -> str:
+        exercise = transposition.transposed_exercise(spec)
+        exercise.render()
+        return ''.join(n.fingering or '-' for n in getattr(exercise, hand).notes)
+
+    def test_scales(self):
+        self.assertEqual(self.fingers(ExerciseSpec('scale', 'C', 'major', octaves=1), 'right_hand'),
+                         '123123454321321')
+        self.assertEqual(self.fingers(ExerciseSpec('scale', 'C', 'major', octaves=1), 'left_hand'),
+                         '543213212312345')
+        self.assertEqual(self.fingers(ExerciseSpec('scale', 'Bb', 'major', octaves=1), 'left_hand'),
+                         '321432131234123')
+        # B flat scales start and end on the right hand's second finger, not the fourth it uses mid-run
+        self.assertEqual(self.fingers(ExerciseSpec('scale', 'Bb', 'major', octaves=1), 'right_hand'),
+                         '212312343213212')
+        self.assertEqual(self.fingers(ExerciseSpec('scale', 'Bb', 'harmonic', octaves=2), 'right_hand')[::14],
+                         '242')
+        # Melodic minor: the raised sixth and seventh change the right hand's fingering going up
+        self.assertEqual(self.fingers(ExerciseSpec('scale', 'F#', 'melodic', octaves=1), 'right_hand'),
+                         '231234132132143')
+
+        for spec in exercise_matrix(octaves=(2,), styles=('ABRSM',)):
+            if spec.kind != 'scale':
+                continue
+            exercise = transposition.transposed_exercise(spec)
+            exercise.render()
+            for n in exercise.right_hand.notes + exercise.left_hand.notes:
+                with self.subTest(spec=spec, note=n):
+                    self.assertFalse(n.fingering == '1' and fingering.is_black(n), 'Thumb on a black key')
+
+    def test_single_staff_scales_are_rejected(self):
+        exercise = build_exercise('scale', 'C', 'major', 'ABRSM', 1)
+        exercise.staff = 'single'
+        with self.assertRaisesMessage(ValueError, 'Cannot apply fingering without separate hand information'):
+            fingering.ScaleFingering(exercise).apply()
+
+    def test_arpeggios(self):
+        # Starting on a black key, the right hand begins on its second finger and passes to the thumb
+        self.assertEqual(self.fingers(ExerciseSpec('arpeggio', 'Eb', 'major', octaves=1), 'right_hand'), '2124212')
+        self.assertEqual(self.fingers(ExerciseSpec('arpeggio', 'D', 'major', octaves=1), 'left_hand'), '5321235')
+        # ABRSM dominant sevenths end on the tonic, a finger on from the leading note
+        self.assertEqual(self.fingers(ExerciseSpec('arpeggio', 'G', 'dominant', octaves=1), 'right_hand'),
+                         '123454323')
+
+    def test_chords_and_detail(self):
+        self.assertEqual(fingering.ChordFingering.for_chord((('C', 0, 4), ('E', 0, 4), ('G', 0, 4))),
+                         ((5, 3, 1), (1, 3, 5)))
+        self.assertEqual(fingering.ChordFingering.for_chord((('E', 0, 4), ('G', 0, 4), ('C', 0, 5))),
+                         ((5, 3, 1), (1, 2, 5)))
+        self.assertEqual(fingering.ChordFingering.for_chord((('C', 0, 4), ('D', 0, 4), ('F', 1, 4), ('A', 0, 4))),
+                         ((5, 4, 2, 1), (1, 2, 3, 5)))
+
+        notes = [NoteRecord('C', 0, 4, 1) for _note in range(6)]
+        fingering.annotate(notes, [1, 2, 3, 1, 2, 3], 'crossings')
+        self.assertEqual([n.fingering for n in notes], ['1', None, None, '1', None, '3'])
+
+
+class RESPStandIn(socketserver.ThreadingTCPServer):
+    """
+    Just enough of a Redis server to test RESPCache against: strings, expiry and FLUSHDB, in one database.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        self.data = {}  # key -> (value, expiry time or None)
+        super().__init__(('127.0.0.1', 0), RESPStandInHandler)
+
+    def value(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            return None
+        return value
+
+
+class RESPStandInHandler(socketserver.StreamRequestHandler):
+    def read_command(self) -> list or None:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _arg in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        server = self.server
+        while (args := self.read_command()) is not None:
+            command, key = args[0].decode().upper(), args[1] if len(args) > 1 else None
+            options = [arg.decode().upper() for arg in args[3:]]
+            if command == 'GET':
+                value = server.value(key)
+                reply = b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+            elif command == 'SET':
+                if 'NX' in options and server.value(key) is not None:
+                    reply = b'$-1\r\n'
+                else:
+                    expires = time.time() + int(options[options.index('PX') + 1]) / 1000 if 'PX' in options else None
+                    server.data[key] = (args[2], expires)
+                    reply = b'+OK\r\n'
+            elif command in ('DEL', 'EXISTS'):
+                found = server.value(key) is not None
+                if command == 'DEL':
+                    server.data.pop(key, None)
+                reply = b':%d\r\n' % found
+            elif command in ('PEXPIRE', 'PERSIST'):
+                value = server.value(key)
+                if value is not None:
+                    server.data[key] = (value, time.time() + int(args[2]) / 1000 if command == 'PEXPIRE' else None)
+                reply = b':%d\r\n' % (value is not None)
+            elif command == 'FLUSHDB':
+                server.data.clear()
+                reply = b'+OK\r\n'
+            else:
+                reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+
+
+class CacheBackendTest(SimpleTestCase):
+    def backends(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        yield cache_backends.SQLiteCache(f'{directory.name}/cache.sqlite3', {'OPTIONS': {'MAX_SIZE': 4096}})
+
+        server = RESPStandIn()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        yield cache_backends.RESPCache(f'redis://127.0.0.1:{server.server_address[1]}/0', {})
+
+    def test_backends(self):
+        for cache in self.backends():
+            with self.subTest(backend=type(cache).__name__):
+                cache.set('render', {'xml': '<score />'})
+                self.assertEqual(cache.get('render'), {'xml': '<score />'})
+                # Keys are versioned, so a new RENDER_VERSION invalidates every render
+                self.assertIsNone(cache.get('render', version=2))
+
+                self.assertTrue(cache.add('lock', 1, timeout=0.05))
+                self.assertFalse(cache.add('lock', 2))
+                time.sleep(0.1)
+                self.assertFalse(cache.has_key('lock'))
+                self.assertTrue(cache.add('lock', 3))
+
+                self.assertTrue(cache.delete('render'))
+                self.assertEqual(cache.get('render', 'missing'), 'missing')
+                cache.clear()
+                self.assertFalse(cache.has_key('lock'))
+
+    def test_least_recently_used_are_evicted(self):
+        cache = next(self.backends())
+        cache.access_interval = 0
+        for name in 'abc':
+            cache.set(name, b'x' * 1200)
+        cache.get('a')
+        cache.set('d', b'x' * 1200)
+        self.assertEqual([cache.has_key(name) for name in 'abcd'], [True, False, True, True])
+        self.assertLessEqual(cache.size(), 4096)
+
+    def test_recent_hits_are_not_written(self):
+        cache = next(self.backends())
+        cache.set('a', b'x')
+        accessed = cache._connection().execute('SELECT accessed FROM cache').fetchone()[0]
+        self.assertEqual(cache.get('a'), b'x')
+        self.assertEqual(cache._connection().execute('SELECT accessed FROM cache').fetchone()[0], accessed)
+        self.assertEqual(cache._connection().total_changes, 1)
+
+    def test_render_version_follows_the_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'generator.py'), 'w') as f:
+                f.write('FINGERS = 4\n')
+            first = render_cache.source_version(('generator',), directory)
+            self.assertEqual(render_cache.source_version(('generator',), directory), first)
+            with open(os.path.join(directory, 'generator.py'), 'w') as f:
+                f.write('FINGERS = 2\n')
+            self.assertNotEqual(render_cache.source_version(('generator',), directory), first)
+        self.assertEqual(render_cache.RENDER_VERSION, render_cache.source_version())
+
+    def test_one_process_renders_while_others_wait(self):
+        use_temporary_render_cache(self)
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.2)
+            return '<score />'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(render_cache.get_or_set('chords:C', render)))
+                   for _thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['<score />'] * 4)
+        self.assertEqual(len(renders), 1)
@@ -0,0 +1,136 @@
+"""
+Music theory lookup tables, built once at import.
+
+Exercise builders look up key signatures, scale spellings and intervals here rather than building music21 keys,
+scales, intervals and pitches, and parsing their names, for every exercise. The tables are worked out from the line
+of fifths and the interval patterns of each scale, and spell every key, scale and interval as music21 does.
+"""
+from typing import NamedTuple
+
+from .notation import NATURAL_SEMITONES, STEPS, interval_steps
+from .pitch_tables import CHROMATIC_TABLE, SHARP_ORDER
+from .specs import normalize_tonic
+
+# Every tonic spelling with at most one sharp or flat, as normalize_tonic spells it
+TONICS = tuple(step + accidental for step in STEPS for accidental in ('b', '', '#'))
+
+# Semitones above the tonic of each degree of a scale
+SCALE_PATTERNS = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+    'harmonic': (0, 2, 3, 5, 7, 8, 11),
+    'melodic': (0, 2, 3, 5, 7, 9, 11),
+}
+# Melodic minor scales descend as natural minor scales
+DESCENDING_PATTERNS = {**SCALE_PATTERNS, 'melodic': SCALE_PATTERNS['minor']}
+MODES = {'major': 'major', 'minor': 'minor', 'harmonic': 'minor', 'melodic': 'minor'}
+
+
+class Key(NamedTuple):
+    tonic: str
+    mode: str
+    sharps: int
+
+
+class ScaleSpelling(NamedTuple):
+    """
+    The (step, alter) of each degree of a scale, 1-7, going up and going down.
+    """
+    ascending: tuple
+    descending: tuple
+
+
+def split_tonic(tonic: str) -> tuple:
+    """
+    The (step, alter) of a tonic spelled as normalize_tonic spells it, e.g. 'Bb' -> ('B', -1).
+    """
+    return tonic[0], tonic.count('#') - tonic.count('b')
+
+
+def fifths(tonic: str) -> int:
+    """
+    The position of a tonic on the line of fifths, counting from C: the sharps (or, negative, flats) of its major key.
+    """
+    step, alter = split_tonic(tonic)
+    return SHARP_ORDER.index(step) - 1 + 7 * alter
+
+
+def tonic_at(position: int) -> str:
+    """
+    The tonic at a position on the line of fifths, the inverse of fifths().
+    """
+    alter, index = divmod(position + 1, 7)
+    return SHARP_ORDER[index] + ('#' * alter if alter > 0 else 'b' * -alter)
+
+
+def spell(tonic: str, pattern: tuple) -> tuple:
+    step, alter = split_tonic(tonic)
+    first = STEPS.index(step)
+    degrees = []
+    for degree, semitones in enumerate(pattern):
+        index = first + degree
+        natural = NATURAL_SEMITONES[STEPS[index % 7]] + 12 * (index // 7)
+        degrees.append((STEPS[index % 7], NATURAL_SEMITONES[step] + alter + semitones - natural))
+    return tuple(degrees)
+
+
+def build_intervals() -> dict:
+    """
+    {name: (diatonic steps, semitones)} for every interval up to two octaves, up and down, in each spelling
+    interval_steps accepts.
+    """
+    table = {}
+    for number in range(1, 16):
+        perfect = (number - 1) % 7 + 1 in (1, 4, 5)
+        for quality in ('p', 'P', 'a', 'A', 'd') if perfect else ('m', 'M', 'a', 'A', 'd'):
+            for sign in ('', '-'):
+                name = f'{sign}{quality}{number}'
+                table[name] = interval_steps(name)
+    return table
+
+
+KEYS = {(tonic, mode): Key(tonic, mode, fifths(tonic) - (3 if mode == 'minor' else 0))
+        for tonic in TONICS for mode in ('major', 'minor')}
+SCALE_SPELLINGS = {(tonic, quality): ScaleSpelling(spell(tonic, SCALE_PATTERNS[quality]),
+                                                   spell(tonic, DESCENDING_PATTERNS[quality]))
+                   for tonic in TONICS for quality in SCALE_PATTERNS}
+INTERVALS = build_intervals()
+# The piano's keys, A0 to C8, named as music21's ChromaticScale('C') spells them
+CHROMATIC_NOTE_NAMES = tuple(STEPS[step] + ('♯' if alter > 0 else '♭' if alter < 0 else '') + str(octave)
+                             for step, alter, octave in zip(CHROMATIC_TABLE.steps, CHROMATIC_TABLE.alters,
+                                                            CHROMATIC_TABLE.octaves))
+
+
+def key_for(tonic: str, quality: str) -> Key:
+    """
+    The key of a scale, e.g. Bb minor for a Bb harmonic minor scale. Raises ValueError for a tonic with more than one
+    sharp or flat.
+    """
+    try:
+        return KEYS[(normalize_tonic(tonic), MODES[quality])]
+    except KeyError:
+        raise ValueError(f'No {quality} key on {tonic!r}')
+
+
+def dominant_key(tonic: str) -> Key:
+    """
+    The major key a dominant seventh on tonic belongs to: the key a fifth below.
+    """
+    position = fifths(normalize_tonic(tonic)) - 1
+    return Key(tonic_at(position), 'major', position)
+
+
+def scale_spelling(tonic: str, quality: str) -> ScaleSpelling:
+    return SCALE_SPELLINGS[(normalize_tonic(tonic), quality)]
+
+
+def interval(i) -> tuple:
+    """
+    The (diatonic steps, semitones) an interval moves a pitch by, looked up in INTERVALS if it's named there.
+
+    Parameters:
+        i (str or music21.interval.Interval): An interval such as 'M3', 'p5' or '-p8'.
+    """
+    if isinstance(i, str) and i in INTERVALS:
+        return INTERVALS[i]
+    return interval_steps(i)
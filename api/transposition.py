@@ -0,0 +1,48 @@
+"""
+Exercises in any key, derived from one canonical build.
+
+A scale or arpeggio is the same exercise in every key up to transposition: the same rhythm and shape, with its notes
+spelled from the tonic. So only the exercise in C is built with music21, once per (kind, quality, style, octaves)
+and kept for the life of the process. Any other tonic gets a copy of its note records moved to that key, with the
+key respelled; beaming, fingering and courtesy clefs are worked out by render() as for an exercise built there.
+"""
+from functools import lru_cache
+
+from .exercises import Exercise, build_exercise
+from .metrics import span
+from .notation import NATURAL_SEMITONES, STEPS, NoteRecord
+from .specs import ExerciseSpec, normalize_tonic
+from .theory import split_tonic
+
+CANONICAL_TONIC = 'C'
+CANONICAL_BOTTOM = NoteRecord('C', 0, 4, 1)
+# Exercises start on the tonic in octave 4, or octave 3 if that would be F4 or above
+HIGHEST_BOTTOM_MIDI = 64
+
+
+@lru_cache(maxsize=None)
+def canonical_exercise(kind: str, quality: str, style: str, octaves: int) -> Exercise:
+    """
+    The exercise in C. Never render it, or otherwise change it; copy it with ``transposed`` instead.
+    """
+    return build_exercise(kind, CANONICAL_TONIC, quality, style, octaves)
+
+
+def steps_from_canonical(tonic: str) -> tuple:
+    """
+    The (diatonic steps, semitones) from the first note of an exercise in C to the first note of one on tonic.
+    """
+    step, alter = split_tonic(normalize_tonic(tonic))
+    octave = 4 if 12 * 5 + NATURAL_SEMITONES[step] + alter <= HIGHEST_BOTTOM_MIDI else 3
+    bottom = NoteRecord(step, alter, octave, 1)
+    steps = bottom.octave * 7 + STEPS.index(bottom.step) - (CANONICAL_BOTTOM.octave * 7)
+    return steps, bottom.midi - CANONICAL_BOTTOM.midi
+
+
+def transposed_exercise(spec: ExerciseSpec) -> Exercise:
+    """
+    The exercise for a spec, as build_exercise would build it, derived from the canonical exercise in C.
+    """
+    canonical = canonical_exercise(spec.kind, spec.quality, spec.style, spec.octaves)
+    with span('construction'):
+        return canonical.transposed(spec.tonic, *steps_from_canonical(spec.tonic))
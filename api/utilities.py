@@ -1,26 +1,34 @@
-import random
+import logging
 
-from music21 import *
+from music21 import chord, clef, key, layout, pitch, stream
 
+from .notation import STEPS
+from .pitch_tables import random_pitches
 
-def generate_random_note(min_note: str, max_note: str, accidentals: bool,
-                         scale_key: key.KeySignature or None) -> pitch.Pitch:
-    if scale_key:
-        pitches = scale_key.getScale().getPitches(min_note, max_note)
-    else:
-        pitches = scale.ChromaticScale('C').getPitches(min_note, max_note)
+logger = logging.getLogger(__name__)
 
-    print(f'Generating random pitch in {scale_key} between {min_note} and {max_note}...')
-    random_pitch = random.choice(pitches)
 
-    if accidentals:
-        random_pitch.accidental = random.randint(-2, 2)
+def generate_random_notes(min_note: str, max_note: str, accidentals: bool, sharps: int or None,
+                          count: int) -> [pitch.Pitch]:
+    """
+    Random pitches between two notes, from the major scale of the key signature with the given sharps (negative for
+    flats), or the chromatic scale if sharps is None.
+    """
+    logger.debug('Generating %d random pitches in key of %s sharps between %s and %s', count, sharps, min_note,
+                 max_note)
+    steps, alters, octaves, _midi = random_pitches(min_note, max_note, accidentals, sharps, count)
 
-    return random_pitch
+    pitches = []
+    for step, alter, octave in zip(steps.tolist(), alters.tolist(), octaves.tolist()):
+        p = pitch.Pitch(STEPS[step], octave=octave)
+        if accidentals or alter:
+            p.accidental = pitch.Accidental(alter)
+        pitches.append(p)
+    return pitches
 
 
-def replace_fancy_accidentals(fancy: str) -> str:
-    return fancy.replace('♭', 'b').replace('♯', '#')
+def generate_random_note(min_note: str, max_note: str, accidentals: bool, sharps: int or None) -> pitch.Pitch:
+    return generate_random_notes(min_note, max_note, accidentals, sharps, 1)[0]
 
 
 def create_grand_staff(key_signature: key.KeySignature or None) -> tuple:
@@ -1,165 +1,276 @@
-from django.http import JsonResponse
-
-from .exercises import Scale, Arpeggio
-from .utilities import *
-from music21 import stream, layout, note, key, clef, pitch, musicxml
-
-
-def get_random_note(request):
-    max_sharps = int(request.GET.get('max_sharps', 7))
-    max_flats = int(request.GET.get('max_flats', 7))
-    min_note = replace_fancy_accidentals(request.GET.get('min_note', 'A0'))
-    max_note = replace_fancy_accidentals(request.GET.get('max_note', 'C8'))
-    accidentals = request.GET.get('accidentals', 'true') == 'true'
-
-    # Choose random key signature, hand, and note
-    key_sig = key.KeySignature(random.randint(max_flats * -1, max_sharps))
-    hand = random.randint(0, 1)
-    left_hand, right_hand, grand_staff, s = create_grand_staff(key_sig)
-
-    random_note = generate_random_note(min_note, max_note, accidentals, key_sig)
-
-    print(random_note)
-
-    if random_note < pitch.Pitch('Ab3'):
-        hand = 0
-    elif random_note > pitch.Pitch('F#4'):
-        hand = 1
-
-    if hand == 0:
-        left_hand.insert(note.Note(random_note))
-    else:
-        right_hand.insert(note.Note(random_note))
-
-    for part in left_hand, right_hand:
-        part.makeNotation(inPlace=True)  # makes measures
-
-    parser = musicxml.m21ToXml.GeneralObjectExporter(s)
-    return JsonResponse({'note': random_note.midi, 'xml': parser.parse().decode('utf-8')})
-
-
-def get_all_chromatic_notes(request):
-    return JsonResponse(
-        {'notes': [n.unicodeNameWithOctave for n in scale.ChromaticScale('C').getPitches('A0', 'C8')]})
-
-
-def generate_scale(request) -> JsonResponse:
-    tonic = request.GET.get('tonic', 'ab')
-    quality = request.GET.get('quality', 'melodic')
-    style = request.GET.get('style', 'ABRSM')
-    print(f'Generating {tonic} {quality} {style} scale...')
-
-    # _scale = Scale(tonic, quality, octaves=2, style=style)
-    _scale = Arpeggio(tonic, quality, octaves=2,
-                      tempo=tempo.MetronomeMark(number=110, referent=duration.Duration(2)), style=style)
-
-    return JsonResponse({'xml': _scale.render()})
-
-
-def generate_chord_exercise(request) -> JsonResponse:
-    def common_tone_chords_from_note(_note: note.Note) -> [chord.Chord]:
-        # Rachmaninoff common tone chord series
-        chords = [
-            chord.Chord([_note, _note.transpose('M3'), _note.transpose('p5')]),
-            chord.Chord([_note, _note.transpose('m3'), _note.transpose('p5')]),
-            chord.Chord([_note, _note.transpose('m3'), _note.transpose('m6')]),
-            chord.Chord([_note, _note.transpose('M3'), _note.transpose('m6')]),
-            chord.Chord([_note, _note.transpose('M3'), _note.transpose('M6')]),
-            chord.Chord([_note, _note.transpose('p4'), _note.transpose('M6')]),
-            chord.Chord([_note, _note.transpose('p4'), _note.transpose('m6')]),
-        ]
-
-        # If G or Ab, transpose down an octave for 7th chord series
-        if _note.pitch.name in ['G', 'Ab']:
-            _note = _note.transpose('-p8')
-
-        chords += [
-            chord.Chord([_note, _note.transpose('M3'), _note.transpose('p5'), _note.transpose('m7')]),
-            chord.Chord([_note, _note.transpose('m3'), _note.transpose('d5'), _note.transpose('m6')]),
-            chord.Chord([_note, _note.transpose('m3'), _note.transpose('p4'), _note.transpose('M6')]),
-            chord.Chord([_note, _note.transpose('M2'), _note.transpose('a4'), _note.transpose('M6')]),
-            chord.Chord([_note, _note.transpose('a2'), _note.transpose('a4'), _note.transpose('M6')]),
-        ]
-
-        return chords
-
-    def key_from_chord(_chord: chord.Chord) -> key.Key:
-        quality = _chord.quality
-        if quality == 'augmented':
-            quality = 'major'
-        elif quality == 'diminished':
-            return key.Key(_chord.sortAscending()[0].transpose('p5').name, 'major')
-        elif _chord.seventh is not None:
-            # Dominant
-            return key.Key(_chord.root().transpose('p4'), 'major')
-
-        return key.Key(_chord.root().name, quality)
-
-    def exercise_from_chord(_chord: chord.Chord) -> list[chord.Chord]:
-        chords = [_chord]
-        chord_notes = list(_chord.sortAscending().pitches)
-        num_chord_notes = len(_chord)
-        for inversion in range(num_chord_notes):
-            chord_notes[0] = chord_notes[0].transpose('p8')
-            c = chord.Chord(chord_notes)
-            chord_notes = list(c.sortAscending().pitches)
-            chords.append(c)
-
-        for inversion in range(num_chord_notes, 0, -1):
-            chord_notes[-1] = chord_notes[-1].transpose('-p8')
-            c = chord.Chord(chord_notes)
-            chord_notes = list(c.sortAscending().pitches)
-            chords.append(c)
-
-        for c in chords:
-            c.duration = duration.Duration(2)
-            c.sortAscending(inPlace=True)
-            lh_fingering = [
-                articulations.Fingering(5),
-                articulations.Fingering(3),
-                articulations.Fingering(1),
-            ]
-
-            rh_fingering = [
-                articulations.Fingering(1),
-                articulations.Fingering(3),
-                articulations.Fingering(5)
-            ]
-
-            fingering = lh_fingering
-            fingering.extend(rh_fingering)
-
-            for finger in lh_fingering:
-                finger.placement = 'below'
-                finger.alternate = True
-
-            for finger in rh_fingering:
-                finger.placement = 'above'
-                finger.substitution = True
-
-            c.articulations.extend(fingering)
-        chords[-1].duration = duration.Duration(4)
-        return chords
-
-    tonic = request.GET.get('tonic', 'ab')
-    # Re-capitalize tonic as major key, i.e. ab -> Ab, g -> G
-    key_name = tonic[0].upper() + tonic[1:]
-    _key = key.Key(key_name)
-    s = stream.Stream()
-    s.insert(0, clef.TrebleClef())
-    s.insert(0, key.KeySignature(_key.sharps))
-    if tonic in ['A', 'B', 'Bb']:
-        tonic += '3'
-    else:
-        tonic += '4'
-
-    for _chord in common_tone_chords_from_note(note.Note(tonic)):
-        s.append(key_from_chord(_chord))
-        s.append([c for c in exercise_from_chord(_chord)])
-        s.append(layout.SystemLayout(isNew=True))
-
-    s.definesExplicitSystemBreaks = True
-    s.makeNotation(inPlace=True)
-
-    parser = musicxml.m21ToXml.GeneralObjectExporter(s)
-    return JsonResponse({'xml': parser.parse().decode('utf-8')})
+import hashlib
+import json
+import logging
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponsePermanentRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import batch, flashcards, jobs, metrics, musicxml_writer, render_cache, theory
+from .executor import ExecutorSaturated, RenderTimeout, get_executor
+from .payloads import PLAYBACK_FORMATS, SCORE_FORMATS, Payload
+from .specs import MAJOR_TONICS, ExerciseSpec, normalize_tonic
+
+# music21 takes seconds to import, so it is only imported by the views that need it; see api.warmup for
+# preloading it before workers fork. Renders run in the worker processes of api.executor.
+
+logger = logging.getLogger(__name__)
+
+# The chromatic note list never changes, so its response body is built once
+CHROMATIC_BODY = json.dumps({'notes': list(theory.CHROMATIC_NOTE_NAMES)}).encode('utf-8')
+CHROMATIC_ETAG = f'"{hashlib.sha256(CHROMATIC_BODY).hexdigest()[:32]}"'
+
+
+def render_error(e: Exception) -> JsonResponse:
+    if isinstance(e, ExecutorSaturated):
+        metrics.RENDER_ERRORS.inc(reason='saturated')
+        response = JsonResponse({'error': str(e)}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    metrics.RENDER_ERRORS.inc(reason='timeout')
+    return JsonResponse({'error': str(e)}, status=504)
+
+
+async def get_random_note(request) -> HttpResponse:
+    try:
+        bucket = flashcards.bucket_from_query(request.GET)
+        # The client needs the card's note as well as its score
+        payload = Payload.from_request(request, formats=('json',))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    card = flashcards.get_pool().take(bucket)
+    metrics.EXERCISES.inc(kind='random_note', cache='miss' if card is None else 'hit')
+    if card is None:
+        try:
+            card = await get_executor().run(jobs.random_note, bucket, coalesce='random_note')
+        except (ExecutorSaturated, RenderTimeout) as e:
+            return render_error(e)
+    return payload.response(payload.encode(card['xml'], {'note': card['note']}))
+
+
+async def get_reading_session(request) -> HttpResponse:
+    """
+    Many random notes in one score, with the MIDI number of each in order, so the client can step through them
+    without asking for each note in turn.
+    """
+    try:
+        bucket, count, phrase_length = flashcards.session_from_query(request.GET)
+        payload = Payload.from_request(request, formats=('json',))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    metrics.EXERCISES.inc(kind='reading_session', cache='worker')
+    try:
+        session = await get_executor().run(jobs.reading_session, bucket, count, phrase_length,
+                                           coalesce='reading_session')
+    except (ExecutorSaturated, RenderTimeout) as e:
+        return render_error(e)
+    return payload.response(payload.encode(session['xml'], {'notes': session['notes']}))
+
+
+def get_flashcard_metrics(request) -> JsonResponse:
+    return JsonResponse(flashcards.get_pool().metrics())
+
+
+def get_metrics(request) -> HttpResponse:
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def cacheable(response: HttpResponse, etag: str) -> HttpResponse:
+    """
+    Let browsers and proxies keep a response that is the same for as long as the URL and RENDER_VERSION are.
+    """
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.EXERCISE_CACHE_MAX_AGE)
+    return response
+
+
+def get_all_chromatic_notes(request) -> HttpResponse:
+    not_modified = get_conditional_response(request, etag=CHROMATIC_ETAG)
+    if not_modified is not None:
+        return cacheable(not_modified, CHROMATIC_ETAG)
+    return cacheable(HttpResponse(CHROMATIC_BODY, content_type='application/json'), CHROMATIC_ETAG)
+
+
+def parse_stream(request, payload: Payload) -> bool:
+    stream = request.GET.get('stream', 'false') == 'true'
+    if stream and payload.format not in ('json', 'musicxml'):
+        raise ValueError(f'{payload.format} responses cannot be streamed')
+    return stream
+
+
+def canonical_url(request, spec: ExerciseSpec, stream: bool) -> str:
+    """
+    The one URL of a spec's exercise: every parameter given, in a fixed order, with the tonic spelled as normalized.
+    """
+    query = spec.query_string()
+    if 'format' in request.GET:
+        query += '&' + urlencode({'format': request.GET['format']})
+    if stream:
+        query += '&stream=true'
+    return f'{request.path}?{query}'
+
+
+def exercise_etag(url: str, payload: Payload) -> str:
+    """
+    A strong ETag for one representation of an exercise, which only changes with the render version.
+    """
+    tag = f'{url}|{payload.variant}|{render_cache.RENDER_VERSION}'
+    return f'"{hashlib.sha256(tag.encode("utf-8")).hexdigest()[:32]}"'
+
+
+async def generate_scale(request) -> HttpResponse or StreamingHttpResponse:
+    """
+    Render a scale or arpeggio. With stream=true the MusicXML is sent a measure at a time as it is written. With
+    format=midi or format=events the exercise is sent to be played back instead (see api.playback).
+
+    Responses can be cached by browsers and proxies, and revalidated with If-None-Match. Each exercise has a
+    canonical URL, given in a Link header, which requests are redirected to with the CANONICAL_REDIRECTS setting.
+    """
+    try:
+        spec = ExerciseSpec.from_query(request.GET)
+        payload = Payload.from_request(request, formats=SCORE_FORMATS + PLAYBACK_FORMATS)
+        stream = parse_stream(request, payload)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    url = canonical_url(request, spec, stream)
+    if settings.CANONICAL_REDIRECTS and request.get_full_path() != url:
+        return HttpResponsePermanentRedirect(url)
+    etag = exercise_etag(url, payload)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        metrics.EXERCISES.inc(kind=spec.kind, cache='not_modified')
+        patch_vary_headers(not_modified, ('Accept', 'Accept-Encoding'))
+        return cacheable(not_modified, etag)
+
+    response = await render_scale(spec, payload, stream)
+    if response.status_code == 200:
+        cacheable(response, etag)
+        response['Link'] = f'<{url}>; rel="canonical"'
+    return response
+
+
+async def render_scale(spec: ExerciseSpec, payload: Payload, stream: bool) -> HttpResponse or StreamingHttpResponse:
+    if stream:
+        return await stream_scale(spec, payload)
+    if payload.format in PLAYBACK_FORMATS:
+        return await render_playback(spec, payload)
+
+    with metrics.span('cache_lookup'):
+        body = render_cache.load_variant(spec, payload.variant)
+        xml = render_cache.load(spec) if body is None else None
+    metrics.EXERCISES.inc(kind=spec.kind, cache='miss' if body is None and xml is None else 'hit')
+    if body is None:
+        if xml is None:
+            logger.debug('Generating %s', spec)
+            try:
+                xml = await get_executor().run(jobs.scale, spec, coalesce='scale')
+            except (ExecutorSaturated, RenderTimeout) as e:
+                return render_error(e)
+        with metrics.span('encode'):
+            body = payload.encode(xml, best=True)
+        render_cache.store_variant(spec, payload.variant, body)
+    return payload.response(body)
+
+
+async def render_playback(spec: ExerciseSpec, payload: Payload) -> HttpResponse:
+    with metrics.span('cache_lookup'):
+        body = render_cache.load_variant(spec, payload.variant)
+        data = render_cache.load_variant(spec, payload.format) if body is None else None
+    metrics.EXERCISES.inc(kind=spec.kind, cache='miss' if body is None and data is None else 'hit')
+    if body is None:
+        if data is None:
+            logger.debug('Generating %s for playback', spec)
+            try:
+                data = await get_executor().run(jobs.playback, spec, payload.format, coalesce='scale')
+            except (ExecutorSaturated, RenderTimeout) as e:
+                return render_error(e)
+        body = payload.encode_playback(data, best=True)
+        if payload.variant != payload.format:
+            render_cache.store_variant(spec, payload.variant, body)
+    return payload.response(body)
+
+
+async def stream_scale(spec: ExerciseSpec, payload: Payload) -> HttpResponse or StreamingHttpResponse:
+    with metrics.span('cache_lookup'):
+        chunks = render_cache.iter_render(spec)
+    metrics.EXERCISES.inc(kind=spec.kind, cache='miss' if chunks is None else 'hit')
+    if chunks is None:
+        # The worker only lays the exercise out; it is written here as it is sent, and stored once it has been
+        try:
+            score = await get_executor().run(jobs.scale_score, spec, coalesce='scale')
+        except (ExecutorSaturated, RenderTimeout) as e:
+            return render_error(e)
+        if isinstance(score, str):
+            chunks = [score]
+        else:
+            chunks = render_cache.store_chunks(spec, musicxml_writer.MusicXMLWriter(score).iter_chunks())
+    return payload.streaming_response(payload.stream(chunks))
+
+
+@csrf_exempt
+@require_POST
+def generate_scales(request) -> StreamingHttpResponse or JsonResponse:
+    """
+    Render many exercises at once. The request body is {"exercises": [{"tonic": ..., "quality": ..., ...}, ...]},
+    each with the parameters of generate_scale. The response is NDJSON, one {"index", "spec", "xml"} object per
+    exercise (or "error" in place of "xml" if its render failed) in the order they finish rendering.
+    """
+    try:
+        body = json.loads(request.body)
+        specs = batch.parse_specs(body.get('exercises') if isinstance(body, dict) else None)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    logger.debug('Generating %d exercises', len(specs))
+    return StreamingHttpResponse(batch.ndjson_lines(specs), content_type='application/x-ndjson')
+
+
+@csrf_exempt
+@require_POST
+def generate_practice_set(request) -> StreamingHttpResponse or JsonResponse:
+    """
+    Render many exercises as one score, each on a new system, streamed a measure at a time. The request body is as
+    for generate_scales; the response is the score as negotiated by Payload, except that it can't be .mxl.
+    """
+    try:
+        body = json.loads(request.body)
+        specs = batch.parse_specs(body.get('exercises') if isinstance(body, dict) else None)
+        payload = Payload.from_request(request, formats=('json', 'musicxml'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    logger.debug('Generating a practice set of %d exercises', len(specs))
+    try:
+        futures = batch.submit_practice_set(specs)
+    except ExecutorSaturated as e:
+        return render_error(e)
+    return payload.streaming_response(payload.stream(batch.practice_set_chunks(specs, futures)))
+
+
+async def generate_chord_exercise(request) -> HttpResponse:
+    try:
+        tonic = normalize_tonic(request.GET.get('tonic', 'ab'))
+        if tonic not in MAJOR_TONICS:
+            raise ValueError(f'No chord series for {tonic!r}')
+        payload = Payload.from_request(request, formats=SCORE_FORMATS + PLAYBACK_FORMATS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    metrics.EXERCISES.inc(kind='chords', cache='worker')
+    try:
+        if payload.format in PLAYBACK_FORMATS:
+            data = await get_executor().run(jobs.chord_playback, tonic, payload.format, coalesce='chords')
+        else:
+            xml = await get_executor().run(jobs.chord_exercise, tonic, coalesce='chords')
+    except (ExecutorSaturated, RenderTimeout) as e:
+        return render_error(e)
+    with metrics.span('encode'):
+        if payload.format in PLAYBACK_FORMATS:
+            return payload.response(payload.encode_playback(data))
+        return payload.response(payload.encode(xml))
@@ -0,0 +1,30 @@
+"""
+Preloading of music21 for the preload-and-fork startup mode.
+
+With ``PRELOAD_MUSIC21`` enabled, ``ApiConfig.ready`` imports music21 and the exercise modules and renders a
+throwaway score, so that music21's lazily built caches exist before a preloading server (e.g. gunicorn with
+``preload_app``, see conbrio/gunicorn.conf.py) forks its workers. The workers then share those pages
+copy-on-write instead of each paying the import on their first request.
+"""
+import time
+
+
+def warm_music21() -> float:
+    """
+    Import music21 and run one grand staff through notation and export. Returns the elapsed time in seconds.
+    """
+    start = time.perf_counter()
+
+    from music21 import key, musicxml, note
+
+    from . import exercises, fingering  # noqa: F401
+    from .utilities import create_grand_staff
+
+    left_hand, right_hand, grand_staff, s = create_grand_staff(key.KeySignature(0))
+    right_hand.append(note.Note('C4'))
+    left_hand.append(note.Note('C3'))
+    for part in left_hand, right_hand:
+        part.makeNotation(inPlace=True)
+    musicxml.m21ToXml.GeneralObjectExporter(s).parse()
+
+    return time.perf_counter() - start
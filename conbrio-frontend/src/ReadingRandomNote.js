@@ -3,15 +3,19 @@ import {Button, FormControl, FormControlLabel, InputLabel, MenuItem, Select, Swi
 import axios from 'axios'
 import {WebMidi} from 'webmidi'
 
+// Notes fetched, and rendered, at a time; the player steps through them without asking the server for each one
+const SESSION_NOTES = 16
+
 function ReadingRandomNote(props) {
-  const [expectedNote, setExpectedNote] = useState(null)
   const [chromaticNoteNames, setChromaticNoteNames] = useState([])
   const [maxFlats, setMaxFlats] = useState(7)
   const [maxSharps, setMaxSharps] = useState(7)
   const [minNote, setMinNote] = useState('A0')
   const [maxNote, setMaxNote] = useState('C8')
   const [accidentals, setAccidentals] = useState(true)
-  const expectedNoteRef = useRef(expectedNote)
+  // The MIDI number of each note in the session's score, and the index of the one to play next
+  const sessionNotesRef = useRef([])
+  const positionRef = useRef(0)
 
   useEffect(() => {
     getExercise()
@@ -26,23 +30,31 @@ function ReadingRandomNote(props) {
   }
 
   function getExercise() {
-    const url = 'http://127.0.0.1:8000/api/exercise/'
+    const url = 'http://127.0.0.1:8000/api/exercise/session/'
     axios.get(url, {
       params: {
         max_flats: maxFlats,
         max_sharps: maxSharps,
         min_note: minNote,
         max_note: maxNote,
-        accidentals: accidentals
+        accidentals: accidentals,
+        count: SESSION_NOTES
       }
     }).then(response => {
       let data = response.data
-      setExpectedNote(data.note)
-      expectedNoteRef.current = data.note
+      sessionNotesRef.current = data.notes
+      positionRef.current = 0
       props.renderScore(data.xml)
     })
   }
 
+  function nextNote() {
+    positionRef.current += 1
+    if (positionRef.current >= sessionNotesRef.current.length) {
+      getExercise()
+    }
+  }
+
   function listenToMidiInput(id) {
     // Remove listener on previous device if applicable
     if (props.selectedInputDevice) {
@@ -51,12 +63,13 @@ function ReadingRandomNote(props) {
     console.log('Listening to input on device at ID', id)
     WebMidi.getInputById(id).addListener('noteon', e => {
       const playedNote = e.note.number
-      if (expectedNoteRef.current === playedNote) {
+      const expectedNote = sessionNotesRef.current[positionRef.current]
+      if (expectedNote === playedNote) {
         console.log('Correct note played')
-        getExercise()
+        nextNote()
       } else {
         console.log('Incorrect note played')
-        console.log('Expected', expectedNoteRef.current, 'got', playedNote)
+        console.log('Expected', expectedNote, 'got', playedNote)
       }
     })
   }
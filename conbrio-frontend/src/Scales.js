@@ -2,6 +2,9 @@ import React, {useEffect, useState} from 'react'
 import {FormControl, InputLabel, MenuItem, Select} from '@mui/material'
 import axios from 'axios'
 
+// Minor keys are spelled with at most seven sharps or flats; D♭ minor is written as C♯ minor
+const MINOR_SPELLINGS = {'Db': 'C#'}
+
 function Scales(props) {
   const [tonic, setTonic] = useState('C')
   const [quality, setQuality] = useState('minor')
@@ -12,7 +15,7 @@ function Scales(props) {
       const url = 'http://127.0.0.1:8000/api/scale/'
       axios.get(url, {
         params: {
-          tonic: tonic,
+          tonic: quality === 'major' ? tonic : (MINOR_SPELLINGS[tonic] || tonic),
           quality: quality
         }
       }).then(response => {
@@ -7,10 +7,32 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conbrio.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI handler plus the lifespan protocol: the render executor's worker processes are started when the
+    server starts, and allowed to finish their renders when it shuts down.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+
+    from api import executor
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            executor.get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(executor.shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
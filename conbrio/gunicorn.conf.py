@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for the preload-and-fork startup mode:
+
+    PRELOAD_MUSIC21=True gunicorn -c conbrio/gunicorn.conf.py conbrio.wsgi
+
+The master process loads the Django application (and with it music21, see api.warmup) once, then forks the
+workers, which share the loaded modules copy-on-write.
+
+WEB_CONCURRENCY sets the number of workers, 2 by default. Each worker starts its own pool of render processes (see
+api.executor), which unless RENDER_WORKERS says otherwise divide the CPUs between the workers rather than each taking
+one per CPU, so the two settings together shouldn't ask for more processes than the host has CPUs.
+"""
+import gc
+import os
+
+from decouple import config
+
+preload_app = True
+workers = config('WEB_CONCURRENCY', default=2, cast=int)
+# The application's settings read it too, to size each worker's render pool
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so that collections in the workers
+    # don't write to (and so copy) the shared pages
+    gc.freeze()
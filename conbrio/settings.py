@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.metrics_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -139,6 +140,74 @@ STATICFILES_DIRS = [
     os.path.join(REACT_APP_DIR, 'build', 'static'),
 ]
 
+# Rendered exercise MusicXML, filled on demand and by `manage.py prerender_exercises`, in the renders cache below
+RENDER_CACHE_DIR = config('RENDER_CACHE_DIR', default=os.path.join(BASE_DIR, 'render_cache'))
+# A Redis (or Redis-protocol) server to share renders between hosts, e.g. redis://localhost:6379/0; otherwise they
+# are kept in SQLite under RENDER_CACHE_DIR, evicting the least recently used beyond RENDER_CACHE_MAX_SIZE bytes
+RENDER_CACHE_URL = config('RENDER_CACHE_URL', default='')
+RENDER_CACHE_MAX_SIZE = config('RENDER_CACHE_MAX_SIZE', default=512 * 1024 * 1024, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'renders': {
+        'BACKEND': 'api.cache_backends.RESPCache',
+        'LOCATION': RENDER_CACHE_URL,
+        'TIMEOUT': None,
+    } if RENDER_CACHE_URL else {
+        'BACKEND': 'api.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(RENDER_CACHE_DIR, 'renders.sqlite3'),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_SIZE': RENDER_CACHE_MAX_SIZE},
+    },
+}
+
+# Import and warm up music21 at startup instead of on the first request that needs it. Enable together with a
+# preloading server (see conbrio/gunicorn.conf.py) so forked workers share the warmed-up modules.
+PRELOAD_MUSIC21 = config('PRELOAD_MUSIC21', default=False, cast=bool)
+
+# Server processes on the host, e.g. gunicorn workers (see conbrio/gunicorn.conf.py), which share its CPUs
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+# Render worker processes in each server process (see api.executor), 0 for one per CPU shared between them
+RENDER_WORKERS = config('RENDER_WORKERS', default=0, cast=int)
+# Seconds a view waits for a render before answering 504
+RENDER_TIMEOUT = config('RENDER_TIMEOUT', default=30, cast=float)
+# Renders that may be queued or running at once before views answer 503
+RENDER_QUEUE_DEPTH = config('RENDER_QUEUE_DEPTH', default=256, cast=int)
+# Endpoints whose concurrent requests for the same render share one job (see api.coalescing): scale, scales
+# (batch), practice_set, chords and random_note. Coalesced random_note requests would all get the same card.
+COALESCE_ENDPOINTS = config('COALESCE_ENDPOINTS', default='scale,scales,practice_set,chords', cast=Csv())
+
+# Random-note flashcards kept ready per set of /api/exercise/ parameters (see api.flashcards): buckets are topped
+# up to FLASHCARD_POOL_SIZE cards when they fall below FLASHCARD_POOL_LOW
+FLASHCARD_POOL_SIZE = config('FLASHCARD_POOL_SIZE', default=20, cast=int)
+FLASHCARD_POOL_LOW = config('FLASHCARD_POOL_LOW', default=5, cast=int)
+FLASHCARD_MAX_BUCKETS = config('FLASHCARD_MAX_BUCKETS', default=64, cast=int)
+BATCH_MAX_EXERCISES = config('BATCH_MAX_EXERCISES', default=100, cast=int)
+# Most random notes one sight-reading session (/api/exercise/session/) may ask for
+SESSION_MAX_NOTES = config('SESSION_MAX_NOTES', default=64, cast=int)
+
+# Seconds browsers and proxies may keep exercise renders and the chromatic note list, which never change for the same
+# URL (until a deploy changes how exercises are rendered)
+EXERCISE_CACHE_MAX_AGE = config('EXERCISE_CACHE_MAX_AGE', default=24 * 60 * 60, cast=int)
+# Redirect /api/scale/ requests to the exercise's canonical URL, so shared caches keep one copy per exercise
+CANONICAL_REDIRECTS = config('CANONICAL_REDIRECTS', default=False, cast=bool)
+
+# List the time spent in each render phase in a Server-Timing header on every response (see api.metrics)
+SERVER_TIMING = config('SERVER_TIMING', default=False, cast=bool)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': config('LOG_LEVEL', default='INFO')},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
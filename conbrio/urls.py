@@ -21,9 +21,15 @@ import frontend.views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', api.views.get_metrics),
     path('api/exercise/', api.views.get_random_note),
+    path('api/exercise/metrics/', api.views.get_flashcard_metrics),
+    path('api/exercise/session/', api.views.get_reading_session),
     path('api/scale/', api.views.generate_scale),
+    path('api/scales/', api.views.generate_scales),
+    path('api/practice-set/', api.views.generate_practice_set),
     path('api/chromatic/', api.views.get_all_chromatic_notes),
+    path('api/chords/', api.views.generate_chord_exercise),
     re_path('practice/*', frontend.views.app),
     path('', frontend.views.home)
 ]
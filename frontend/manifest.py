@@ -0,0 +1,97 @@
+"""
+The React app's build manifest, and the app shell page rendered from it.
+
+``npm run build`` writes the app's bundles to conbrio-frontend/build, along with asset-manifest.json listing the
+entry point scripts and stylesheets a page must load. The shell is rendered from the manifest once, and again only
+when the manifest changes, which is checked at most every RELOAD_INTERVAL seconds; serving /practice/ touches neither
+the filesystem nor the template engine in between.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from django.conf import settings
+from django.template import loader
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'asset-manifest.json'
+RELOAD_INTERVAL = 2  # Seconds
+
+
+class Shell(NamedTuple):
+    html: str
+    etag: str
+    last_modified: datetime or None  # When the manifest was written
+
+
+_shell = None
+_mtime = None  # Of the manifest the shell was rendered from, in nanoseconds
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def build_dir() -> str:
+    return os.path.join(settings.REACT_APP_DIR, 'build')
+
+
+def manifest_mtime() -> int or None:
+    try:
+        return os.stat(os.path.join(build_dir(), MANIFEST_NAME)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_entrypoints() -> tuple:
+    """
+    The (scripts, stylesheets) the app loads, as paths relative to the build directory, e.g. 'static/js/main.js'.
+    """
+    directory = build_dir()
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            entrypoints = json.load(f).get('entrypoints', [])
+    except FileNotFoundError:
+        # A build without a manifest: load every script it has
+        logger.warning('No %s in %s', MANIFEST_NAME, directory)
+        scripts = glob.glob(os.path.join(directory, 'static', 'js', '*.js'))
+        return sorted(os.path.relpath(path, directory).replace(os.sep, '/') for path in scripts), []
+    return ([path for path in entrypoints if path.endswith('.js')],
+            [path for path in entrypoints if path.endswith('.css')])
+
+
+def render_shell(mtime: int or None) -> Shell:
+    js_chunks, css_chunks = read_entrypoints()
+    html = loader.render_to_string('frontend/app.html', {'js_chunks': js_chunks, 'css_chunks': css_chunks})
+    return Shell(html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:32],
+                 None if mtime is None else datetime.fromtimestamp(mtime // 10 ** 9, timezone.utc))
+
+
+def get_shell() -> Shell:
+    """
+    The rendered app shell, re-rendered if the manifest has changed since it was last checked.
+    """
+    global _shell, _mtime, _checked
+    if _shell is not None and time.monotonic() - _checked < RELOAD_INTERVAL:
+        return _shell
+    with _lock:
+        if _shell is None or time.monotonic() - _checked >= RELOAD_INTERVAL:
+            mtime = manifest_mtime()
+            if _shell is None or mtime != _mtime:
+                _shell, _mtime = render_shell(mtime), mtime
+            _checked = time.monotonic()
+    return _shell
+
+
+def reset():
+    """
+    Forget the rendered shell, e.g. after settings change in tests.
+    """
+    global _shell, _mtime, _checked
+    with _lock:
+        _shell, _mtime, _checked = None, None, 0.0
@@ -1,3 +1,52 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from . import manifest
+
+
+class AppShellTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.build = os.path.join(directory.name, 'build')
+        os.makedirs(self.build)
+        self.write_manifest(['static/css/main.1.css', 'static/js/main.1.js'])
+
+        settings = override_settings(REACT_APP_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        manifest.reset()
+        self.addCleanup(manifest.reset)
+
+    def write_manifest(self, entrypoints: list):
+        with open(os.path.join(self.build, manifest.MANIFEST_NAME), 'w') as f:
+            json.dump({'files': {}, 'entrypoints': entrypoints}, f)
+
+    def test_shell_from_manifest(self):
+        cwd = os.getcwd()
+        response = self.client.get('/practice/scales')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<script src="/static/js/main.1.js"></script>')
+        self.assertContains(response, '<link href="/static/css/main.1.css" rel="stylesheet">')
+        self.assertEqual(os.getcwd(), cwd)
+
+        # Repeat visits get a 304, without the shell being rendered again
+        shell = manifest.get_shell()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get('/practice/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/practice/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertIs(manifest.get_shell(), shell)
+
+    def test_new_build_is_picked_up(self):
+        etag = self.client.get('/practice/')['ETag']
+        self.write_manifest(['static/js/main.2.js'])
+        os.utime(os.path.join(self.build, manifest.MANIFEST_NAME), ns=(0, 10 ** 18))
+        manifest._checked = 0.0  # As if RELOAD_INTERVAL had passed
+
+        response = self.client.get('/practice/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'main.2.js')
+        self.assertNotContains(response, 'main.1.js')
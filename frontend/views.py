@@ -1,8 +1,8 @@
-import glob
-import os
-
 from django.http import HttpResponse
 from django.template import loader
+from django.views.decorators.http import condition
+
+from . import manifest
 
 
 def home(request):
@@ -10,13 +10,17 @@ def home(request):
     return HttpResponse(template.render({}, request))
 
 
-def app(request):
-    try:
-        print(os.listdir())
-        os.chdir(os.path.join('conbrio-frontend', 'build'))
-        js_chunks = glob.glob(os.path.join('static', 'js', '*.js'))
-        template = loader.get_template('frontend/app.html')
-        return HttpResponse(template.render({'js_chunks': js_chunks}, request))
-    finally:
-        os.chdir(os.path.join('..', '..'))
+def shell_etag(request) -> str:
+    return manifest.get_shell().etag
+
 
+def shell_last_modified(request):
+    return manifest.get_shell().last_modified
+
+
+@condition(etag_func=shell_etag, last_modified_func=shell_last_modified)
+def app(request):
+    # Rendered from the build manifest once, not per request; repeat visits revalidate and get a 304
+    response = HttpResponse(manifest.get_shell().html)
+    response['Cache-Control'] = 'no-cache'
+    return response